@@ -3,6 +3,7 @@ import os
 
 from deepagents import CompiledSubAgent
 from deepagents.backends import FilesystemBackend
+from deepagents.graph import DeepAgentState
 
 from deepagents.middleware import (
     FilesystemMiddleware,
@@ -14,8 +15,9 @@ from langchain.agents import create_agent
 from langchain.agents.middleware import TodoListMiddleware
 from langchain.agents.middleware.summarization import SummarizationMiddleware
 from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import InMemorySaver
 
+from agents.checkpointer import get_checkpointer
+from config.settings import settings
 from agents.main_agent.middleware import MainAgentMiddleware
 from agents.main_agent.prompt import MAIN_AGENT_SYSTEM_PROMPT
 from agents.os_agent.middleware.advanced_file_middleware import AdvancedFileMiddleware
@@ -39,6 +41,10 @@ class Context:
 
 default_model = ChatOpenAI(model=os.getenv("OPENAI_MODEL"))
 
+# messages 用 DeltaChannel 存储：每个检查点只写本步新增的消息，每 50 次更新存一次全量快照，
+# 检查点体积与写入耗时随本轮增量而不是整段历史增长。已按增量写入的线程不能再关闭该选项读取
+state_schema = DeepAgentState if settings.CHECKPOINT_DELTA_MESSAGES else None
+
 backend = FilesystemBackend(
     "D:/ai_lab/langgraph-agents/agent-store-space", virtual_mode=True
 )
@@ -46,6 +52,7 @@ backend = FilesystemBackend(
 os_agent = create_agent(
     model=default_model,
     system_prompt=OS_AGENT_SYSTEM_PROMPT,
+    state_schema=state_schema,
     middleware=[
         AdvancedFileMiddleware(backend=backend),
         FilesystemMiddleware(backend=backend),
@@ -57,6 +64,7 @@ web_agent = create_agent(
     model=default_model,
     tools=[web_fetch, web_search],
     system_prompt=RESEARCHER_SYSTEM_PROMPT,
+    state_schema=state_schema,
     middleware=[WebAgentMiddleware()],
 )
 
@@ -64,6 +72,7 @@ web_agent = create_agent(
 agent = create_agent(
     model=default_model,
     system_prompt=MAIN_AGENT_SYSTEM_PROMPT,
+    state_schema=state_schema,
     middleware=[
         MemOSMiddleware(),
         MainAgentMiddleware(),
@@ -108,7 +117,8 @@ agent = create_agent(
             ],
         ),
     ],
-    checkpointer=InMemorySaver(),
+    # 由 CHECKPOINTER_BACKEND 选择 memory / sqlite / postgres
+    checkpointer=get_checkpointer(),
     
     # context_schema=Context,
 )
@@ -0,0 +1,85 @@
+"""
+检查点序列化压缩（CHECKPOINT_COMPRESSION）。
+
+CompressedSerializer 在 langgraph 默认的 JsonPlusSerializer 之上，对超过 min_size 的 msgpack / json / pickle
+负载做 zstd（未安装 zstandard 时退回 zlib）压缩，并在类型标记后追加 "+zstd" / "+zlib"，
+与 langgraph 自带的 EncryptedSerializer 给类型加 "+aes" 的方式相同。读取时按后缀解压，
+没有后缀的旧数据照常读取，所以开启 / 关闭压缩都不需要迁移已有线程。
+
+小负载（单条工具调用写入、计数器等）压缩收益抵不上 CPU 开销，保持原样；压缩后没变小的也保持原样。
+"""
+import zlib
+from typing import Any, Tuple
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from config.settings import settings
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，缺失时退回 zlib
+    zstandard = None
+
+CODEC_ZSTD = "zstd"
+CODEC_ZLIB = "zlib"
+CODEC_NONE = "none"
+CODECS = (CODEC_ZSTD, CODEC_ZLIB, CODEC_NONE)
+
+# 只压缩这些序列化类型；null / bytes 等原样保留
+COMPRESSIBLE_TYPES = frozenset({"msgpack", "json", "pickle"})
+
+
+def _compress(codec: str, data: bytes, level: int) -> bytes:
+    if codec == CODEC_ZSTD:
+        return zstandard.compress(data, level)
+    return zlib.compress(data, level)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("checkpoint blob is zstd-compressed but zstandard is not installed")
+        return zstandard.decompress(data)
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown checkpoint compression codec {codec!r}")
+
+
+class CompressedSerializer(JsonPlusSerializer):
+    """JsonPlusSerializer + 透明压缩；继承而不是包装，saver.with_allowlist() 派生出的副本仍然压缩"""
+
+    def __init__(self, *, codec: str = CODEC_ZSTD, level: int = 3, min_size: int = 1024, **kwargs: Any):
+        super().__init__(**kwargs)
+        if codec not in CODECS:
+            raise ValueError(f"Unknown CHECKPOINT_COMPRESSION {codec!r}, expected one of {CODECS}")
+        if codec == CODEC_ZSTD and zstandard is None:
+            codec = CODEC_ZLIB
+        # zlib 级别范围是 0-9，zstd 是 1-22
+        self.codec = codec
+        self.level = min(level, 9) if codec == CODEC_ZLIB else level
+        self.min_size = min_size
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = super().dumps_typed(obj)
+        if self.codec == CODEC_NONE or type_ not in COMPRESSIBLE_TYPES or len(data) < self.min_size:
+            return type_, data
+        compressed = _compress(self.codec, data, self.level)
+        if len(compressed) >= len(data):
+            return type_, data
+        return f"{type_}+{self.codec}", compressed
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if "+" in type_:
+            type_, codec = type_.split("+", 1)
+            payload = _decompress(codec, payload)
+        return super().loads_typed((type_, payload))
+
+
+def make_serializer(
+    codec: str = settings.CHECKPOINT_COMPRESSION,
+    level: int = settings.CHECKPOINT_COMPRESSION_LEVEL,
+    min_size: int = settings.CHECKPOINT_COMPRESSION_MIN_BYTES,
+) -> CompressedSerializer:
+    """按配置创建检查点序列化器；codec=none 时不再压缩新数据，但仍能读取之前压缩过的检查点"""
+    return CompressedSerializer(codec=codec, level=level, min_size=min_size)
@@ -0,0 +1,292 @@
+"""
+常驻的无头浏览器池：
+- 由 FastAPI lifespan 负责 start/close，web_fetch 每次抓取只租用一个页面槽位
+- 全局并发上限 = 浏览器数量 * 每个浏览器的并发页面数
+- 单个浏览器服务满 N 个页面或 Chromium 总内存超过阈值后，在空闲时回收重建：
+  退役的浏览器从槽位上摘下后在后台关闭，不阻塞归还租用的抓取，也不占用分配槽位的锁
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from crawl4ai import AsyncWebCrawler, BrowserConfig
+
+from config.settings import settings
+from utils.logger import get_logger
+
+try:  # psutil 为可选依赖，缺失时不做内存阈值检查
+    import psutil
+except ImportError:  # pragma: no cover
+    psutil = None
+
+logger = get_logger(__name__)
+
+# 浏览器伪装头 (解决 403 Forbidden 关键)
+BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1"
+}
+
+
+def default_browser_config() -> BrowserConfig:
+    """默认的浏览器配置，支持通过 WEB_FETCH_PROXY_SERVER 注入代理"""
+    browser_args = []
+    proxy_server = os.getenv("WEB_FETCH_PROXY_SERVER")
+    if proxy_server:
+        browser_args.append(f"--proxy-server={proxy_server}")
+
+    return BrowserConfig(
+        headless=True,
+        verbose=False,
+        headers=BROWSER_HEADERS,
+        extra_args=browser_args,
+    )
+
+
+class _BrowserSlot:
+    """池中的一个浏览器实例及其使用统计"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.crawler: Optional[AsyncWebCrawler] = None
+        self.active = 0
+        self.pages_served = 0
+        self.started_at: Optional[float] = None
+        self.retiring = False
+        self.generation = 0
+
+
+class BrowserPool:
+    def __init__(
+        self,
+        size: int = settings.BROWSER_POOL_SIZE,
+        pages_per_browser: int = settings.BROWSER_POOL_PAGES_PER_BROWSER,
+        max_pages_before_recycle: int = settings.BROWSER_POOL_MAX_PAGES_BEFORE_RECYCLE,
+        max_memory_mb: int = settings.BROWSER_POOL_MAX_MEMORY_MB,
+        lease_timeout: float = settings.BROWSER_POOL_LEASE_TIMEOUT,
+        memory_check_interval: float = settings.BROWSER_POOL_MEMORY_CHECK_INTERVAL,
+        browser_config: Optional[BrowserConfig] = None,
+    ):
+        self.size = max(1, size)
+        self.pages_per_browser = max(1, pages_per_browser)
+        self.max_pages_before_recycle = max_pages_before_recycle
+        self.max_memory_mb = max_memory_mb
+        self.lease_timeout = lease_timeout
+        self.memory_check_interval = memory_check_interval
+        self.browser_config = browser_config
+
+        self._slots = [_BrowserSlot(i) for i in range(self.size)]
+        self._semaphore = asyncio.Semaphore(self.size * self.pages_per_browser)
+        self._lock = asyncio.Lock()
+        self._closed = False
+        # 后台关闭中的已退役浏览器
+        self._closing: Set[asyncio.Task] = set()
+        # 子进程 RSS 扫描结果缓存：(扫描时间, MB)
+        self._memory_sample: Optional[Tuple[float, Optional[float]]] = None
+
+        self._waiting = 0
+        self._total_leases = 0
+        self._lease_timeouts = 0
+        self._recycles = 0
+        self._launch_failures = 0
+        # 连续启动失败次数，任一浏览器启动成功即清零；持续失败说明浏览器池已不可用
+        self._consecutive_launch_failures = 0
+
+    async def start(self, warm: bool = True):
+        """启动浏览器池；warm=True 时预先拉起所有浏览器"""
+        self._closed = False
+        if warm:
+            async with self._lock:
+                await asyncio.gather(
+                    *(self._ensure_started(slot) for slot in self._slots),
+                    return_exceptions=True,
+                )
+        logger.info(f"[BrowserPool] started: size={self.size}, pages_per_browser={self.pages_per_browser}")
+
+    async def close(self):
+        """关闭所有浏览器（应用退出时调用）"""
+        self._closed = True
+        async with self._lock:
+            await asyncio.gather(
+                *(self._shutdown(slot) for slot in self._slots),
+                *self._closing,
+                return_exceptions=True,
+            )
+        logger.info("[BrowserPool] closed")
+
+    @asynccontextmanager
+    async def lease(self):
+        """
+        租用一个浏览器页面槽位：
+            async with browser_pool.lease() as crawler:
+                result = await crawler.arun(url=url, config=run_config)
+        """
+        if self._closed:
+            raise RuntimeError("BrowserPool is closed")
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.lease_timeout)
+        except asyncio.TimeoutError:
+            self._lease_timeouts += 1
+            raise RuntimeError(f"BrowserPool lease timed out after {self.lease_timeout}s")
+        finally:
+            self._waiting -= 1
+
+        try:
+            async with self._lock:
+                slot = self._pick_slot()
+                await self._ensure_started(slot)
+                slot.active += 1
+                self._total_leases += 1
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+        try:
+            yield slot.crawler
+        finally:
+            slot.active -= 1
+            slot.pages_served += 1
+            try:
+                self._maybe_recycle(slot)
+            finally:
+                self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回浏览器池状态，供 readiness / metrics 使用"""
+        now = time.time()
+        browsers: List[Dict[str, Any]] = [
+            {
+                "index": slot.index,
+                "running": slot.crawler is not None,
+                "active_pages": slot.active,
+                "pages_served": slot.pages_served,
+                "generation": slot.generation,
+                "retiring": slot.retiring,
+                "uptime_s": round(now - slot.started_at, 1) if slot.started_at else None,
+            }
+            for slot in self._slots
+        ]
+        return {
+            "size": self.size,
+            "capacity": self.size * self.pages_per_browser,
+            "active_pages": sum(slot.active for slot in self._slots),
+            "waiting": self._waiting,
+            "total_leases": self._total_leases,
+            "lease_timeouts": self._lease_timeouts,
+            "recycles": self._recycles,
+            "launch_failures": self._launch_failures,
+            "consecutive_launch_failures": self._consecutive_launch_failures,
+            "memory_mb": self._memory_mb(),
+            "closing": len(self._closing),
+            "closed": self._closed,
+            "browsers": browsers,
+        }
+
+    def _pick_slot(self) -> _BrowserSlot:
+        # 优先选择已启动、未退役且最空闲的浏览器，避免无谓地拉起新进程
+        candidates = [s for s in self._slots if not s.retiring and s.active < self.pages_per_browser]
+        if not candidates:
+            candidates = [s for s in self._slots if s.active < self.pages_per_browser]
+        return min(candidates, key=lambda s: (s.crawler is None, s.active))
+
+    async def _ensure_started(self, slot: _BrowserSlot):
+        if slot.crawler is not None:
+            return
+        crawler = AsyncWebCrawler(config=self.browser_config or default_browser_config())
+        try:
+            await crawler.start()
+        except Exception:
+            self._launch_failures += 1
+            self._consecutive_launch_failures += 1
+            raise
+        self._consecutive_launch_failures = 0
+        slot.crawler = crawler
+        slot.pages_served = 0
+        slot.retiring = False
+        slot.started_at = time.time()
+        slot.generation += 1
+        logger.debug(f"[BrowserPool] browser #{slot.index} launched (gen {slot.generation})")
+
+    async def _shutdown(self, slot: _BrowserSlot):
+        crawler, slot.crawler = slot.crawler, None
+        slot.started_at = None
+        if crawler is None:
+            return
+        try:
+            await crawler.close()
+        except Exception as e:
+            logger.warning(f"[BrowserPool] failed to close browser #{slot.index}: {e}")
+
+    def _maybe_recycle(self, slot: _BrowserSlot):
+        # 同步执行（没有 await），期间不会有其他租用交错，不需要持有 _lock
+        if slot.crawler is None:
+            return
+        if not slot.retiring:
+            if self.max_pages_before_recycle and slot.pages_served >= self.max_pages_before_recycle:
+                slot.retiring = True
+                logger.info(f"[BrowserPool] browser #{slot.index} served {slot.pages_served} pages, recycling")
+            elif self._over_memory_threshold() and slot is self._busiest_running_slot():
+                slot.retiring = True
+                logger.info(f"[BrowserPool] memory threshold exceeded, recycling browser #{slot.index}")
+
+        # 只在没有进行中的页面时摘下，之后的租用会在该槽位上拉起新浏览器；旧浏览器在后台关闭
+        if slot.retiring and slot.active == 0:
+            crawler, slot.crawler = slot.crawler, None
+            slot.started_at = None
+            slot.retiring = False
+            self._recycles += 1
+            task = asyncio.create_task(self._close_crawler(slot.index, crawler), name=f"browser-close-{slot.index}")
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close_crawler(index: int, crawler: AsyncWebCrawler):
+        try:
+            await crawler.close()
+        except Exception as e:
+            logger.warning(f"[BrowserPool] failed to close browser #{index}: {e}")
+
+    def _busiest_running_slot(self) -> Optional[_BrowserSlot]:
+        running = [s for s in self._slots if s.crawler is not None]
+        return max(running, key=lambda s: s.pages_served) if running else None
+
+    def _over_memory_threshold(self) -> bool:
+        if not self.max_memory_mb:
+            return False
+        memory_mb = self._memory_mb()
+        return memory_mb is not None and memory_mb > self.max_memory_mb
+
+    def _memory_mb(self) -> Optional[float]:
+        """遍历子进程开销不小，每次归还租用都会检查：最多每 memory_check_interval 秒扫描一次"""
+        now = time.monotonic()
+        if self._memory_sample is None or now - self._memory_sample[0] >= self.memory_check_interval:
+            self._memory_sample = (now, self._browser_memory_mb())
+        return self._memory_sample[1]
+
+    @staticmethod
+    def _browser_memory_mb() -> Optional[float]:
+        """统计本进程所有子进程（Playwright driver + Chromium）的 RSS 总和"""
+        if psutil is None:
+            return None
+        try:
+            total = 0
+            for child in psutil.Process().children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+            return round(total / (1024 * 1024), 1)
+        except Exception:
+            return None
+
+
+# 进程级共享实例，由 api 层的 lifespan 负责 start/close；
+# 未启动时（例如直接通过 langgraph dev 运行）首次租用会按需拉起浏览器
+browser_pool = BrowserPool()
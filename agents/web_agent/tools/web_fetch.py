@@ -1,4 +1,3 @@
-import os
 import socket
 import ipaddress
 import asyncio
@@ -8,10 +7,12 @@ from pydantic import BaseModel, Field
 from async_lru import alru_cache  # pip install async_lru
 
 # 引入 crawl4ai 核心组件
-from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
+from crawl4ai import CrawlerRunConfig, CacheMode
 from crawl4ai.content_filter_strategy import PruningContentFilter
 from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
 
+from agents.web_agent.tools.browser_pool import browser_pool
+from utils.load_state import is_degraded
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -41,27 +42,14 @@ def is_safe_url(url: str) -> bool:
 
 # --- 2. 核心抓取逻辑 (带缓存) ---
 # 使用 async_lru 进行内存缓存，TTL=600秒 (10分钟)
-# 这样翻页时不需要重新启动浏览器爬取
+# 这样翻页时不需要重新抓取页面
 @alru_cache(maxsize=32, ttl=600)
 async def _crawl_url(url: str) -> str:
     """
-    使用 Crawl4AI 启动无头浏览器抓取网页，并返回 Markdown。
+    使用 Crawl4AI 从浏览器池租用无头浏览器抓取网页，并返回 Markdown。
     """
     logger.info(f"[Crawl4AI] Starting crawl for: {url}")
 
-    # A. 浏览器配置
-    # 如果有代理，需要在这里注入
-    browser_args = []
-    PROXY_SERVER = os.getenv("WEB_FETCH_PROXY_SERVER")
-
-    if PROXY_SERVER:
-        browser_args.append(f"--proxy-server={PROXY_SERVER}")
-
-    browser_config = BrowserConfig(
-        headless=True,  # 无头模式，不弹出浏览器窗口
-        verbose=False,  # 减少日志干扰
-        extra_args=browser_args,  # 注入代理参数
-    )
 # --- 2. 抓取运行配置 (CrawlerRunConfig) ---
     # 这一层控制具体的页面处理逻辑
     
@@ -98,13 +86,13 @@ async def _crawl_url(url: str) -> str:
         remove_overlay_elements=True,
         process_iframes=True,
         js_code="window.scrollTo(0, document.body.scrollHeight);",
-        delay_before_return_html=2.0,  # 滚动后等待 2 秒让内容渲染
+        delay_before_return_html=0.5 if is_degraded() else 2.0,  # 滚动后等待 2 秒让内容渲染（过载降级时缩短）
         
         # 爬取策略
     )
 
-    # C. 执行抓取
-    async with AsyncWebCrawler(config=browser_config) as crawler:
+    # C. 执行抓取：从常驻浏览器池租用页面，避免每次冷启动 Chromium
+    async with browser_pool.lease() as crawler:
         result = await crawler.arun(url=url, config=run_config)
 
         if not result.success:
@@ -12,27 +12,22 @@ from pydantic import BaseModel, Field
 from async_lru import alru_cache
 
 # --- Crawl4AI 组件 ---
-from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
+from crawl4ai import CrawlerRunConfig, CacheMode
 from crawl4ai.content_filter_strategy import PruningContentFilter
 from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
 
 # --- MarkItDown 组件 ---
 from markitdown import MarkItDown
 
+from agents.web_agent.tools.browser_pool import BROWSER_HEADERS, browser_pool
+from utils.load_state import is_degraded
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
 # =================配置区=================
 
-# 1. 浏览器伪装头 (解决 403 Forbidden 关键)
-BROWSER_HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-    "Accept-Language": "en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7",
-    "Connection": "keep-alive",
-    "Upgrade-Insecure-Requests": "1"
-}
+# 1. 浏览器伪装头 (解决 403 Forbidden 关键)，与浏览器池共用同一份
 
 # 2. 支持的文档类型映射 (解决 URL 无后缀问题)
 # 当 URL 类似于 download.jsp?id=123 时，我们依靠 Content-Type 来决定保存为什么后缀
@@ -176,14 +171,7 @@ async def _crawl_url(url: str) -> str:
         return await _process_with_markitdown(url, detected_type)
     else:
         # === Crawl4AI 网页抓取配置 ===
-        logger.info(f"[Crawl4AI] Starting browser for: {url}")
-        
-        browser_config = BrowserConfig(
-            headless=True,
-            # 这里的 headers 主要是给 Playwright 的
-            headers=BROWSER_HEADERS, 
-            verbose=False
-        )
+        logger.info(f"[Crawl4AI] Leasing pooled browser for: {url}")
 
         run_config = CrawlerRunConfig(
             cache_mode=CacheMode.BYPASS,
@@ -199,10 +187,12 @@ async def _crawl_url(url: str) -> str:
             process_iframes=True,
             # 等待页面完全加载
             js_code="window.scrollTo(0, document.body.scrollHeight);",
-            delay_before_return_html=2.0, 
+            # 过载降级时缩短渲染等待
+            delay_before_return_html=0.5 if is_degraded() else 2.0,
         )
 
-        async with AsyncWebCrawler(config=browser_config) as crawler:
+        # 从常驻浏览器池租用页面，避免每次冷启动 Chromium
+        async with browser_pool.lease() as crawler:
             result = await crawler.arun(url=url, config=run_config)
             
             if not result.success:
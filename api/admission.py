@@ -0,0 +1,248 @@
+"""
+按用户的运行准入控制：
+
+- 令牌桶限制每个用户发起新运行的速率（允许一定突发）
+- 每个用户同时进行中的运行数有上限；超出时进入一个很短的 FIFO 等待队列
+- 等待超时、队列已满或令牌不足时立即拒绝，由 endpoint 返回 429 + Retry-After
+
+运行的准入凭证（AdmissionPermit）在运行结束时释放，而不是在 HTTP 请求结束时，
+因为运行由 RunRegistry 驱动，可能比发起它的连接活得更久。
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from config.settings import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+REJECT_RATE_LIMITED = "rate_limited"
+REJECT_CONCURRENCY = "concurrency_limit"
+REJECT_QUEUE_FULL = "queue_full"
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float, message: str):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.message = message
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self) -> float:
+        """取一个令牌；成功返回 0，否则返回需要等待的秒数"""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def refund(self) -> None:
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class _UserState:
+    __slots__ = ("active", "waiters", "bucket")
+
+    def __init__(self, bucket: TokenBucket):
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.bucket = bucket
+
+
+class AdmissionPermit:
+    """一个运行的准入凭证；release 幂等"""
+
+    __slots__ = ("controller", "key", "_released")
+
+    def __init__(self, controller: "AdmissionController", key: str):
+        self.controller = controller
+        self.key = key
+        self._released = False
+
+    def release(self, *_: Any) -> None:
+        if not self._released:
+            self._released = True
+            self.controller._release(self.key)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent_runs: int = settings.ADMISSION_MAX_CONCURRENT_RUNS,
+        rate_per_minute: float = settings.ADMISSION_RATE_PER_MINUTE,
+        burst: int = settings.ADMISSION_BURST,
+        max_queue: int = settings.ADMISSION_MAX_QUEUE,
+        queue_timeout: float = settings.ADMISSION_QUEUE_TIMEOUT,
+    ):
+        self.max_concurrent_runs = max(1, max_concurrent_runs)
+        self.rate = rate_per_minute / 60
+        self.burst = max(1, burst)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+
+        self._users: Dict[str, _UserState] = {}
+        self._admitted = 0
+        self._queued = 0
+        self._rejected: Dict[str, int] = {}
+        self._acquires_since_sweep = 0
+
+    async def acquire(self, key: str) -> AdmissionPermit:
+        """为 key（用户）申请一个运行名额，被拒绝时抛出 AdmissionRejected"""
+        self._maybe_sweep()
+        state = self._users.get(key)
+        if state is None:
+            state = _UserState(TokenBucket(self.rate, self.burst))
+            self._users[key] = state
+
+        wait = state.bucket.take()
+        if wait > 0:
+            raise self._reject(REJECT_RATE_LIMITED, wait, "Too many runs started, slow down")
+
+        if state.active < self.max_concurrent_runs and not state.waiters:
+            state.active += 1
+            self._admitted += 1
+            return AdmissionPermit(self, key)
+
+        if len(state.waiters) >= self.max_queue:
+            state.bucket.refund()
+            raise self._reject(REJECT_QUEUE_FULL, self.queue_timeout, "Too many concurrent runs")
+
+        # 排队等待其他运行结束后让出名额（名额由 _release 直接移交，active 不变）
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters.append(waiter)
+        self._queued += 1
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await waiter
+        except TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # 超时的同时恰好拿到了名额：照常接受
+                self._admitted += 1
+                return AdmissionPermit(self, key)
+            waiter.cancel()
+            self._discard_waiter(state, waiter)
+            state.bucket.refund()
+            raise self._reject(REJECT_CONCURRENCY, self.queue_timeout, "Too many concurrent runs")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(key)
+            else:
+                waiter.cancel()
+                self._discard_waiter(state, waiter)
+            raise
+        self._admitted += 1
+        return AdmissionPermit(self, key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limits": {
+                "max_concurrent_runs": self.max_concurrent_runs,
+                "rate_per_minute": self.rate * 60,
+                "burst": self.burst,
+                "max_queue": self.max_queue,
+            },
+            "users": len(self._users),
+            "active_runs": sum(state.active for state in self._users.values()),
+            "waiting": sum(len(state.waiters) for state in self._users.values()),
+            "admitted": self._admitted,
+            "queued": self._queued,
+            "rejected": dict(self._rejected),
+        }
+
+    def _reject(self, reason: str, retry_after: float, message: str) -> AdmissionRejected:
+        self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        return AdmissionRejected(reason, retry_after, message)
+
+    def _release(self, key: str) -> None:
+        state = self._users.get(key)
+        if state is None:
+            return
+        while state.waiters:
+            waiter = state.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        state.active = max(0, state.active - 1)
+
+    @staticmethod
+    def _discard_waiter(state: _UserState, waiter: asyncio.Future) -> None:
+        try:
+            state.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _maybe_sweep(self) -> None:
+        # 定期清理空闲用户；只清理令牌桶已回满的用户，避免通过"被清理"绕过速率限制
+        self._acquires_since_sweep += 1
+        if self._acquires_since_sweep < 1024:
+            return
+        self._acquires_since_sweep = 0
+        now = time.monotonic()
+        idle = [
+            key for key, state in self._users.items()
+            if state.active == 0 and not state.waiters and state.bucket.is_full(now)
+        ]
+        for key in idle:
+            del self._users[key]
+
+
+def admission_key(user_id: Optional[str], user_type: Optional[str], client_host: Optional[str]) -> str:
+    """认证用户按 user_id 计数；匿名用户共用默认 user_id，因此按客户端地址区分"""
+    if user_type == "anonymous" or not user_id:
+        return f"anon:{client_host or 'unknown'}"
+    return f"user:{user_id}"
+
+
+admission_controller = AdmissionController()
+
+
+if __name__ == "__main__":
+    # 演示：单个用户并发超限时排队 / 快速 429，其他用户不受影响
+    async def main():
+        controller = AdmissionController(max_concurrent_runs=2, rate_per_minute=600, burst=20, max_queue=1, queue_timeout=0.2)
+
+        async def run(user: str, duration: float) -> str:
+            try:
+                permit = await controller.acquire(user)
+            except AdmissionRejected as e:
+                return f"429 ({e.reason}, Retry-After {e.retry_after_header})"
+            try:
+                await asyncio.sleep(duration)
+                return "ok"
+            finally:
+                permit.release()
+
+        greedy = [run("user:greedy", 0.5) for _ in range(6)]
+        polite = [run("user:polite", 0.1)]
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*greedy, *polite)
+        print(f"greedy: {results[:6]}")
+        print(f"polite: {results[6:]}  ({time.perf_counter() - t0:.2f}s total)")
+        print(controller.stats())
+
+    asyncio.run(main())
@@ -0,0 +1,376 @@
+"""
+批量（离线）运行：一次提交成千上万条 RunAgentInput，按吞吐优化执行
+
+- 上传的 JSONL 按块流式写入磁盘，不在内存中保留完整文件；执行时逐行读取
+- 每条输入通过 LangGraphAgent.invoke 执行（ainvoke，不构造逐 token 的 AG-UI 事件），
+  只把最终回复和 token 用量写入 output.jsonl
+- 每条执行都在调度器的 batch 通道中排队（与聊天共用 worker 名额，但让位于 interactive），
+  单个批次同时执行的条数由 concurrency 控制
+- manifest.json 记录批次状态；进程重启后根据 output.jsonl 中已完成的行号跳过已完成的输入，继续执行
+
+目录结构（BATCH_DIR/<batch_id>/）：input.jsonl、output.jsonl、manifest.json
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+import aiofiles
+
+from api.event_handler import LangGraphAgent
+from api.models.types import RunAgentInput
+from api.scheduler import PRIORITY_BATCH, SchedulerFull, run_scheduler
+from config.settings import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+BATCH_PENDING = "pending"
+BATCH_RUNNING = "running"
+BATCH_COMPLETED = "completed"
+BATCH_FAILED = "failed"
+
+INPUT_FILE = "input.jsonl"
+OUTPUT_FILE = "output.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+# RunAgentInput 中批量场景通常不关心的必填字段
+_INPUT_DEFAULTS = {"state": {}, "tools": [], "context": [], "forwardedProps": {}}
+
+
+class BatchTooLarge(Exception):
+    pass
+
+
+def parse_batch_line(line: str, batch_id: str, index: int) -> RunAgentInput:
+    """解析一行输入；缺省的 threadId / runId 按批次和行号生成，保证重跑时保持一致"""
+    data = json.loads(line)
+    if not isinstance(data, dict):
+        raise ValueError("each line must be a JSON object")
+    data.setdefault("threadId", data.pop("thread_id", None) or f"{batch_id}-{index}")
+    data.setdefault("runId", data.pop("run_id", None) or f"{batch_id}-{index}")
+    for key, value in _INPUT_DEFAULTS.items():
+        data.setdefault(key, value)
+    return RunAgentInput.model_validate(data)
+
+
+def _write_json_atomic(path: Path, data: Dict[str, Any]) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+class BatchJob:
+    def __init__(self, directory: Path, manifest: Dict[str, Any]):
+        self.directory = directory
+        self.manifest = manifest
+        self.batch_id: str = manifest["batch_id"]
+        self.completed_lines: Set[int] = set()
+        self.succeeded = 0
+        self.failed = 0
+        self.started_monotonic: Optional[float] = None
+        self.completed_at_start = 0
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def status(self) -> str:
+        return self.manifest["status"]
+
+    def save_manifest(self) -> None:
+        self.manifest["succeeded"] = self.succeeded
+        self.manifest["failed"] = self.failed
+        _write_json_atomic(self.directory / MANIFEST_FILE, self.manifest)
+
+    def load_progress(self) -> None:
+        """从 output.jsonl 恢复已完成的行号（崩溃时写了一半的最后一行会被忽略，该行重跑）"""
+        output_path = self.directory / OUTPUT_FILE
+        if not output_path.exists():
+            return
+        with open(output_path, "rb") as f:
+            for raw in f:
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    continue
+                index = record.get("line")
+                if isinstance(index, int) and index not in self.completed_lines:
+                    self.completed_lines.add(index)
+                    if record.get("status") == "ok":
+                        self.succeeded += 1
+                    elif record.get("status") == "error":
+                        self.failed += 1
+
+    def progress(self) -> Dict[str, Any]:
+        total = self.manifest.get("total") or 0
+        done = len(self.completed_lines)
+        rate = None
+        eta = None
+        if self.started_monotonic is not None and self.status == BATCH_RUNNING:
+            elapsed = time.monotonic() - self.started_monotonic
+            processed = done - self.completed_at_start
+            if elapsed > 0 and processed > 0:
+                rate = processed / elapsed
+                eta = (total - done) / rate
+        return {
+            **self.manifest,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "completed": done,
+            "remaining": max(0, total - done),
+            "runs_per_second": round(rate, 3) if rate else None,
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+        }
+
+
+class BatchManager:
+    def __init__(self, root: Path = settings.BATCH_DIR, max_bytes: int = settings.BATCH_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._jobs: Dict[str, BatchJob] = {}
+        # 图名 -> LangGraphAgent 或延迟加载的占位对象，由 endpoint 挂载路由时登记；重启恢复批次时按名字找回
+        self._agents: Dict[str, Any] = {}
+
+    def register_agent(self, agent) -> None:
+        self._agents.setdefault(agent.name, agent)
+
+    def get(self, batch_id: str) -> Optional[BatchJob]:
+        job = self._jobs.get(batch_id)
+        if job is None:
+            manifest_path = self.root / batch_id / MANIFEST_FILE
+            if batch_id.isalnum() and manifest_path.exists():
+                job = BatchJob(manifest_path.parent, json.loads(manifest_path.read_text(encoding="utf-8")))
+                job.load_progress()
+                self._jobs[batch_id] = job
+        return job
+
+    async def create(
+        self,
+        body: AsyncIterator[bytes],
+        graph: str,
+        user_id: Optional[str],
+        user_key: str,
+        concurrency: int,
+    ) -> BatchJob:
+        """把上传的 JSONL 流式写入磁盘并启动批次；超过 BATCH_MAX_BYTES 时抛出 BatchTooLarge"""
+        batch_id = uuid.uuid4().hex
+        directory = self.root / batch_id
+        directory.mkdir(parents=True, exist_ok=True)
+        size = 0
+        lines = 0
+        last_byte = b"\n"
+        async with aiofiles.open(directory / INPUT_FILE, "wb") as f:
+            async for chunk in body:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if self.max_bytes and size > self.max_bytes:
+                    break
+                lines += chunk.count(b"\n")
+                last_byte = chunk[-1:]
+                await f.write(chunk)
+        if self.max_bytes and size > self.max_bytes:
+            for path in directory.iterdir():
+                path.unlink()
+            directory.rmdir()
+            raise BatchTooLarge(f"Batch input exceeds {self.max_bytes} bytes")
+        if last_byte != b"\n":
+            lines += 1
+
+        job = BatchJob(directory, {
+            "batch_id": batch_id,
+            "graph": graph,
+            "user_id": user_id,
+            "user_key": user_key,
+            "concurrency": concurrency,
+            "status": BATCH_PENDING,
+            "total": lines,
+            "bytes": size,
+            "created_at": time.time(),
+            "finished_at": None,
+            "error": None,
+        })
+        job.save_manifest()
+        self._jobs[batch_id] = job
+        self._start(job)
+        return job
+
+    async def resume(self) -> None:
+        """启动时继续执行上次未完成的批次"""
+        if not self.root.exists():
+            return
+        for manifest_path in self.root.glob(f"*/{MANIFEST_FILE}"):
+            job = self.get(manifest_path.parent.name)
+            if job is None or job.status not in (BATCH_PENDING, BATCH_RUNNING) or job.task is not None:
+                continue
+            if job.manifest["graph"] not in self._agents:
+                logger.warning(f"[Batch] cannot resume {job.batch_id}: graph {job.manifest['graph']} is not mounted")
+                continue
+            logger.info(f"[Batch] resuming {job.batch_id}: {len(job.completed_lines)}/{job.manifest['total']} done")
+            self._start(job)
+
+    async def stop(self) -> None:
+        """停止执行中的批次；状态保持 running，重启后继续"""
+        tasks = [job.task for job in self._jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _start(self, job: BatchJob) -> None:
+        job.task = asyncio.create_task(self._run(job), name=f"batch-{job.batch_id}")
+
+    async def _run(self, job: BatchJob) -> None:
+        job.manifest["status"] = BATCH_RUNNING
+        job.save_manifest()
+        job.started_monotonic = time.monotonic()
+        job.completed_at_start = len(job.completed_lines)
+        try:
+            agent = await self._resolve_agent(job.manifest["graph"])
+            await self._execute(job, agent)
+        except asyncio.CancelledError:
+            job.save_manifest()
+            raise
+        except Exception as e:
+            logger.exception(f"[Batch] {job.batch_id} failed: {e}")
+            job.manifest["status"] = BATCH_FAILED
+            job.manifest["error"] = f"{type(e).__name__}: {e}"
+        else:
+            job.manifest["status"] = BATCH_COMPLETED
+            logger.info(f"[Batch] {job.batch_id} completed: {job.succeeded} ok, {job.failed} failed")
+        job.manifest["finished_at"] = time.time()
+        job.save_manifest()
+
+    async def _resolve_agent(self, graph: str) -> LangGraphAgent:
+        agent = self._agents[graph]
+        return agent if isinstance(agent, LangGraphAgent) else await agent.get()
+
+    async def _execute(self, job: BatchJob, agent) -> None:
+        concurrency = asyncio.Semaphore(max(1, job.manifest["concurrency"]))
+        pending: Set[asyncio.Task] = set()
+        output_path = job.directory / OUTPUT_FILE
+        # 上次崩溃可能留下没有换行的半行，先补齐换行，保证后续追加的每一行都完整
+        if output_path.exists() and output_path.stat().st_size:
+            with open(output_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        else:
+            needs_newline = False
+
+        # 结果行很小，直接同步追加并逐行 flush，保证崩溃后最多丢失正在执行的几条
+        with open(output_path, "a", encoding="utf-8") as output:
+            if needs_newline:
+                output.write("\n")
+
+            def write_result(result: Dict[str, Any]) -> None:
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                job.completed_lines.add(result["line"])
+                if result["status"] == "ok":
+                    job.succeeded += 1
+                elif result["status"] == "error":
+                    job.failed += 1
+
+            try:
+                with open(job.directory / INPUT_FILE, "r", encoding="utf-8") as input_file:
+                    for index, line in enumerate(input_file):
+                        if index in job.completed_lines:
+                            continue
+                        if not line.strip():
+                            write_result({"line": index, "status": "skipped"})
+                            continue
+                        await concurrency.acquire()
+                        task = asyncio.create_task(self._run_line(job, agent, index, line))
+                        pending.add(task)
+
+                        def on_done(t: asyncio.Task, index: int = index):
+                            pending.discard(t)
+                            concurrency.release()
+                            if not t.cancelled():
+                                write_result(t.result())
+
+                        task.add_done_callback(on_done)
+                        # 定期持久化计数，进度接口读到的 manifest 不会太旧
+                        if index % 100 == 0:
+                            job.save_manifest()
+                if pending:
+                    await asyncio.gather(*pending)
+            finally:
+                for task in pending:
+                    task.cancel()
+
+    async def _run_line(self, job: BatchJob, agent, index: int, line: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result: Dict[str, Any] = {"line": index}
+        try:
+            input_data = parse_batch_line(line, job.batch_id, index)
+            result["run_id"] = input_data.run_id
+            if input_data.forwarded_props is None:
+                input_data.forwarded_props = {}
+            if job.manifest.get("user_id"):
+                input_data.forwarded_props["user_id"] = job.manifest["user_id"]
+            while True:
+                try:
+                    output = await run_scheduler.run_task(
+                        lambda: agent.invoke(input_data), PRIORITY_BATCH, job.manifest["user_key"]
+                    )
+                    break
+                except SchedulerFull as e:
+                    # batch 通道排满时退避重试，而不是把整行记为失败
+                    await asyncio.sleep(e.retry_after)
+            result.update(status="ok", **output)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result.update(status="error", error=f"{type(e).__name__}: {e}")
+        result["duration_ms"] = round((time.perf_counter() - started) * 1000)
+        return result
+
+
+batch_manager = BatchManager()
+
+
+if __name__ == "__main__":
+    # 演示：200 条输入，处理到一半时"重启"，恢复后只执行剩余的输入
+    import tempfile
+
+    class FakeAgent(LangGraphAgent):
+        name = "fake"
+
+        def __init__(self):
+            pass
+
+        calls = 0
+
+        async def invoke(self, input_data: RunAgentInput) -> Dict[str, Any]:
+            FakeAgent.calls += 1
+            await asyncio.sleep(0.01)
+            return {"thread_id": input_data.thread_id, "output": f"echo: {input_data.messages[0].content}", "usage": {}}
+
+    async def body(n: int):
+        for i in range(n):
+            yield (json.dumps({"messages": [{"id": f"m{i}", "role": "user", "content": f"prompt {i}"}]}) + "\n").encode()
+
+    async def main():
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = BatchManager(Path(tmp))
+            manager.register_agent(FakeAgent())
+            job = await manager.create(body(200), "fake", None, "user:demo", concurrency=8)
+            while len(job.completed_lines) < 100:
+                await asyncio.sleep(0.01)
+            await manager.stop()
+            print(f"stopped at {len(job.completed_lines)}/200, calls={FakeAgent.calls}")
+
+            restarted = BatchManager(Path(tmp))
+            restarted.register_agent(FakeAgent())
+            FakeAgent.calls = 0
+            await restarted.resume()
+            resumed = restarted.get(job.batch_id)
+            await resumed.task
+            progress = resumed.progress()
+            print(f"resumed: calls={FakeAgent.calls}, status={progress['status']}, "
+                  f"completed={progress['completed']}, ok={progress['succeeded']}, failed={progress['failed']}")
+        await run_scheduler.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+"""
+TEXT_MESSAGE_CONTENT 增量合并：
+
+把同一 message_id 的连续 token 增量在一个时间窗口 / 字节预算内合并成一个事件，
+减少每帧的 pydantic 构造、JSON 编码和 socket 写入次数。
+遇到任何其他事件（消息结束、工具开始、运行结束等）或换了 message_id 时立即刷新。
+"""
+import asyncio
+from typing import Any, AsyncIterator, List, Mapping, Optional
+
+from api.models.events import BaseEvent, TextMessageContentEvent
+from config.settings import settings
+
+COALESCE_HEADER = "x-agui-coalesce"
+
+
+def resolve_coalesce(forwarded_props: Optional[Mapping[str, Any]], headers: Optional[Mapping[str, str]] = None) -> bool:
+    """
+    客户端按请求关闭合并：请求头 X-AGUI-Coalesce: off，或 forwarded_props.coalesce = false
+    """
+    if headers is not None:
+        header = headers.get(COALESCE_HEADER)
+        if header is not None:
+            return _parse_flag(header)
+    if forwarded_props and forwarded_props.get("coalesce") is not None:
+        return _parse_flag(forwarded_props["coalesce"])
+    return settings.STREAM_COALESCE_ENABLED
+
+
+def _parse_flag(value: Any) -> bool:
+    # forwarded_props 里的字符串（"false" / "off"）与请求头同样解析，不能直接 bool()
+    if isinstance(value, str):
+        return value.strip().lower() not in ("0", "off", "false", "no")
+    return bool(value)
+
+
+class TextDeltaCoalescer:
+    def __init__(
+        self,
+        window_ms: float = settings.STREAM_COALESCE_WINDOW_MS,
+        max_bytes: int = settings.STREAM_COALESCE_MAX_BYTES,
+    ):
+        self.window = window_ms / 1000
+        self.max_bytes = max_bytes
+
+    async def coalesce(self, events: AsyncIterator[BaseEvent]) -> AsyncIterator[BaseEvent]:
+        iterator = events.__aiter__()
+        loop = asyncio.get_running_loop()
+
+        pending: Optional[TextMessageContentEvent] = None
+        parts: List[str] = []
+        size = 0
+        deadline = 0.0
+        next_item: Optional[asyncio.Future] = None
+
+        def flush() -> TextMessageContentEvent:
+            nonlocal pending, parts, size
+            event, pending = pending, None
+            if len(parts) > 1:
+                event.delta = "".join(parts)
+            parts, size = [], 0
+            return event
+
+        try:
+            while True:
+                # 没有缓冲内容时直接等待上游；有缓冲内容时只等到窗口结束
+                if pending is None and next_item is None:
+                    try:
+                        event = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                else:
+                    if next_item is None:
+                        next_item = asyncio.ensure_future(iterator.__anext__())
+                    if pending is not None:
+                        timeout = deadline - loop.time()
+                        if timeout > 0:
+                            await asyncio.wait((next_item,), timeout=timeout)
+                        if not next_item.done():
+                            yield flush()
+                            continue
+                    try:
+                        event = await next_item
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        next_item = None
+
+                if isinstance(event, TextMessageContentEvent):
+                    if pending is not None and pending.message_id != event.message_id:
+                        yield flush()
+                    if pending is None:
+                        pending = event
+                        deadline = loop.time() + self.window
+                    parts.append(event.delta)
+                    size += len(event.delta.encode("utf-8"))
+                    if size >= self.max_bytes:
+                        yield flush()
+                    continue
+
+                if pending is not None:
+                    yield flush()
+                yield event
+
+            if pending is not None:
+                yield flush()
+        finally:
+            if next_item is not None and not next_item.done():
+                next_item.cancel()
+                try:
+                    await next_item
+                except (asyncio.CancelledError, StopAsyncIteration, Exception):
+                    pass
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
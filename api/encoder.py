@@ -0,0 +1,201 @@
+"""
+AG-UI 事件的 SSE 编码器
+
+- full 模式：与原有行为一致，`model_dump_json(exclude_none=True, by_alias=True)`
+- lean 模式：不携带 raw_event，高频事件走按类型预编译的字段表 + orjson 快速序列化
+"""
+import json
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from api.models.events import (
+    BaseEvent,
+    TextMessageStartEvent,
+    TextMessageContentEvent,
+    TextMessageEndEvent,
+    ToolCallStartEvent,
+    ToolCallArgsEvent,
+    ToolCallEndEvent,
+    ToolCallResultEvent,
+    StepStartedEvent,
+    StepFinishedEvent,
+)
+
+try:  # orjson 为可选依赖，缺失时回退到标准库 json
+    import orjson
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:  # pragma: no cover
+    orjson = None
+
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+WIRE_MODE_FULL = "full"
+WIRE_MODE_LEAN = "lean"
+WIRE_MODE_HEADER = "x-agui-wire-mode"
+
+# 每个 token / 每次工具调用都会出现的事件类型，lean 模式下走快速路径
+HOT_EVENT_TYPES: Tuple[Type[BaseEvent], ...] = (
+    TextMessageStartEvent,
+    TextMessageContentEvent,
+    TextMessageEndEvent,
+    ToolCallStartEvent,
+    ToolCallArgsEvent,
+    ToolCallEndEvent,
+    ToolCallResultEvent,
+    StepStartedEvent,
+    StepFinishedEvent,
+)
+
+
+def resolve_wire_mode(forwarded_props: Optional[Mapping[str, Any]], headers: Optional[Mapping[str, str]] = None) -> str:
+    """
+    协商传输模式：请求头 X-AGUI-Wire-Mode 优先，其次 forwarded_props.wire_mode，默认 full
+    """
+    mode = None
+    if headers is not None:
+        mode = headers.get(WIRE_MODE_HEADER)
+    if not mode and forwarded_props:
+        mode = forwarded_props.get("wire_mode")
+    if isinstance(mode, str) and mode.strip().lower() == WIRE_MODE_LEAN:
+        return WIRE_MODE_LEAN
+    return WIRE_MODE_FULL
+
+
+def _compile_plan(event_cls: Type[BaseModel]) -> Tuple[Tuple[str, str], ...]:
+    """按类型预先计算 (属性名, 序列化别名) 列表，跳过 raw_event 和 type"""
+    plan = []
+    for field_name, field in event_cls.model_fields.items():
+        if field_name in ("raw_event", "type"):
+            continue
+        plan.append((field_name, field.alias or field_name))
+    return tuple(plan)
+
+
+class EventEncoder:
+    def __init__(self, mode: str = WIRE_MODE_FULL):
+        self.mode = mode
+        self._plans: Dict[Type[BaseModel], Tuple[Tuple[str, str], ...]] = {
+            event_cls: _compile_plan(event_cls) for event_cls in HOT_EVENT_TYPES
+        }
+        self._encode: Callable[[BaseEvent], str] = (
+            self._encode_lean if mode == WIRE_MODE_LEAN else self._encode_full
+        )
+
+    @property
+    def lean(self) -> bool:
+        return self.mode == WIRE_MODE_LEAN
+
+    def encode(self, event: BaseEvent) -> str:
+        """把事件编码为 JSON 字符串"""
+        return self._encode(event)
+
+    def encode_sse(self, event: BaseEvent, event_id: Optional[int] = None) -> str:
+        """把事件编码为一帧 Server-Sent Events 数据；event_id 用于客户端断线重连（Last-Event-ID）"""
+        if event_id is not None:
+            return f"id: {event_id}\ndata: {self._encode(event)}\n\n"
+        return f"data: {self._encode(event)}\n\n"
+
+    def to_payload(self, event: BaseEvent, fast: bool = True) -> Dict[str, Any]:
+        """
+        事件的字段字典（别名为键，不含 type），供二进制编码使用；
+        fast=False 时强制走 pydantic 的 JSON 兼容转换（快速路径中出现非基础类型时使用）
+        """
+        plan = self._plans.get(type(event)) if self.lean and fast else None
+        if plan is None:
+            exclude = {"type", "raw_event"} if self.lean else {"type"}
+            return event.model_dump(mode="json", exclude_none=True, by_alias=True, exclude=exclude)
+        payload = {}
+        for field_name, alias in plan:
+            value = getattr(event, field_name)
+            if value is not None:
+                payload[alias] = value
+        extra = event.__pydantic_extra__
+        if extra:
+            payload.update(extra)
+        return payload
+
+    @staticmethod
+    def _encode_full(event: BaseEvent) -> str:
+        return event.model_dump_json(exclude_none=True, by_alias=True)
+
+    def _encode_lean(self, event: BaseEvent) -> str:
+        plan = self._plans.get(type(event))
+        if plan is None:
+            return event.model_dump_json(exclude_none=True, by_alias=True, exclude={"raw_event"})
+
+        payload = {"type": event.type.value}
+        for field_name, alias in plan:
+            value = getattr(event, field_name)
+            if value is not None:
+                payload[alias] = value
+        extra = event.__pydantic_extra__
+        if extra:
+            payload.update(extra)
+        try:
+            return _dumps(payload)
+        except TypeError:
+            # 出现了非基础类型（例如工具结果是对象），交给 pydantic 处理
+            return event.model_dump_json(exclude_none=True, by_alias=True, exclude={"raw_event"})
+
+
+if __name__ == "__main__":
+    # 基准测试：对比 full 模式（原有路径）与 lean 模式的每次运行字节数和每个事件的 CPU 耗时
+    import time
+
+    from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+
+    from api.models.events import RunFinishedEvent, RunStartedEvent
+    from api.utils import make_json_safe, summarize_run_result
+
+    N_TOKENS = 400
+    history = [HumanMessage(content="北京明天天气如何？" * 20, id=f"h{i}") for i in range(30)]
+
+    def build_events(lean: bool):
+        events = []
+        run_event = {
+            "event": "on_chain_start", "name": "LangGraph", "run_id": "run-1", "parent_ids": [],
+            "metadata": {"thread_id": "t-1"}, "data": {"input": {"messages": history}},
+        }
+        events.append(RunStartedEvent(run_id="run-1", thread_id="t-1", raw_event=run_event))
+        for i in range(N_TOKENS):
+            chunk = AIMessageChunk(content="晴转多云", id="msg-1")
+            raw = {
+                "event": "on_chat_model_stream", "name": "ChatOpenAI", "run_id": "llm-1",
+                "parent_ids": ["run-1", "model-1"],
+                "metadata": {"thread_id": "t-1", "langgraph_node": "model", "ls_model_name": "gpt-4o"},
+                "data": {"chunk": chunk},
+            }
+            events.append(TextMessageContentEvent(message_id="msg-1", delta="晴转多云", timestamp=i, raw_event=raw))
+        final_state = {"messages": [*history, AIMessage(content="晴转多云" * N_TOKENS, id="msg-1")]}
+        events.append(RunFinishedEvent(
+            run_id="run-1", thread_id="t-1",
+            result=summarize_run_result(final_state) if lean else str(final_state),
+            raw_event={"event": "on_chain_end", "data": {"output": final_state}},
+        ))
+        return events
+
+    def bench(lean: bool):
+        encoder = EventEncoder(WIRE_MODE_LEAN if lean else WIRE_MODE_FULL)
+        events = build_events(lean)
+        total_bytes = 0
+        t0 = time.perf_counter()
+        for event in events:
+            if lean:
+                event.raw_event = None
+            elif event.raw_event:
+                event.raw_event = make_json_safe(event.raw_event)
+            total_bytes += len(encoder.encode_sse(event).encode())
+        elapsed = time.perf_counter() - t0
+        return total_bytes, elapsed / len(events) * 1e6
+
+    full_bytes, full_us = bench(lean=False)
+    lean_bytes, lean_us = bench(lean=True)
+    print(f"events per run: {N_TOKENS + 2}")
+    print(f"full: {full_bytes / 1024:.1f} KiB/run, {full_us:.1f} us/event")
+    print(f"lean: {lean_bytes / 1024:.1f} KiB/run, {lean_us:.1f} us/event")
+    print(f"bytes x{full_bytes / lean_bytes:.1f} smaller, cpu x{full_us / lean_us:.1f} faster")
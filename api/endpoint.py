@@ -1,52 +1,341 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+from typing import Any, Dict, Optional, Union
+
+from fastapi import FastAPI, Request, WebSocket
+from starlette.requests import HTTPConnection
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from api.models.types import RunAgentInput
 from api.event_handler import LangGraphAgent
+from api.coalescer import resolve_coalesce
+from api.encoder import EventEncoder, resolve_wire_mode
+from api.batch import OUTPUT_FILE, BatchTooLarge, batch_manager
+from api.admission import AdmissionRejected, admission_controller, admission_key
+from api.models.events import RunErrorEvent
+from api.overload import Overloaded, overload_controller
+from api.readiness import readiness_checker
+from api.graph_registry import GraphLoadError, LazyGraphAgent
+from api.run_registry import RunRecord, parse_last_event_id, run_registry
+from api.scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, SchedulerFull, resolve_priority, run_scheduler
+from api.streaming import CANCEL_SLOW_CONSUMER, StreamCancelled, StreamPump, stream_stats
+from api.event_filter import resolve_event_types
+from api.history import resolve_history_mode
+from api.metrics import STREAM_SIZE, stream_counters
+from api.middleware.auth_middleware import register_public_path
+from api.middleware.sse_compression import sse_compression_stats
+from api.ws_protocol import WebSocketSession, negotiate_codec
+from agents.checkpointer import checkpointer_manager
+from agents.web_agent.tools.browser_pool import browser_pool
+from config.settings import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*",
+}
+
+
+def _sse_response(record: RunRecord, after_seq: int, request: Request, encoder: EventEncoder) -> StreamingResponse:
+    """订阅运行的事件日志并以 SSE 写出，每帧带上 id 以便断线后通过 Last-Event-ID 续传"""
+
+    async def event_generator():
+        frames, frame_bytes = stream_counters("sse")
+        total = 0
+        # 事件经有界队列转发；客户端断开或消费过慢时退订，运行在无人订阅超过宽限期后才会被取消
+        try:
+            async for seq, event in StreamPump().pump(record.subscribe(after_seq), request=request, run_id=record.run_id):
+                # 将事件对象编码为JSON，并按照Server-Sent Events格式发送数据（直接给出字节，便于计量）
+                frame = encoder.encode_sse(event, event_id=seq).encode()
+                frames.inc()
+                frame_bytes.inc(len(frame))
+                total += len(frame)
+                yield frame
+        except StreamCancelled as e:
+            if e.reason == CANCEL_SLOW_CONSUMER:
+                yield encoder.encode_sse(RunErrorEvent(message="Stream cancelled: client is not consuming events", code=e.reason))
+        finally:
+            STREAM_SIZE.labels("sse").observe(total)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+async def _resolve_agent(agent) -> LangGraphAgent:
+    """agent 可以是 LangGraphAgent，也可以是首次使用时才加载图的占位对象（见 api.graph_registry）"""
+    if isinstance(agent, LangGraphAgent):
+        return agent
+    return await agent.get()
+
+
+class RunRejected(Exception):
+    """新运行未通过准入（过载 / 限流 / 队列已满等），HTTP 路由转换为对应的 JSONResponse，WebSocket 转换为错误帧"""
+
+    def __init__(self, status_code: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        super().__init__(body.get("error"))
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers
+
+    def response(self) -> JSONResponse:
+        return JSONResponse(self.body, status_code=self.status_code, headers=self.headers)
+
+
+def _prepare_input(input_data: RunAgentInput, request: HTTPConnection) -> str:
+    """把 user_id、传输模式等请求级参数写入 forwarded_props，返回协商出的传输模式"""
+    # 从request.state中获取user_id（由AuthMiddleware设置）
+    user_id = getattr(request.state, 'user_id', None)
+
+    # 将user_id注入到forwarded_props中
+    if input_data.forwarded_props is None:
+        input_data.forwarded_props = {}
+
+    if user_id:
+        input_data.forwarded_props["user_id"] = user_id
+
+    # 协商传输模式（full / lean），并写回 forwarded_props 供 agent 决定是否携带 raw_event
+    wire_mode = resolve_wire_mode(input_data.forwarded_props, request.headers)
+    input_data.forwarded_props["wire_mode"] = wire_mode
+    # 是否合并 TEXT_MESSAGE_CONTENT 增量（X-AGUI-Coalesce: off 可关闭）
+    input_data.forwarded_props["coalesce"] = resolve_coalesce(input_data.forwarded_props, request.headers)
+    # 历史上传模式（full / delta），X-AGUI-History 请求头可覆盖
+    input_data.forwarded_props["history_mode"] = resolve_history_mode(input_data.forwarded_props, request.headers)
+    # 事件类型订阅（X-AGUI-Event-Types / X-AGUI-Exclude-Event-Types），在事件源头过滤
+    input_data.forwarded_props.update(resolve_event_types(input_data.forwarded_props, request.headers))
+    return wire_mode
+
+
+async def _submit_run(
+    agent,
+    input_data: RunAgentInput,
+    request: HTTPConnection,
+    priority: str,
+    background: bool = False,
+) -> RunRecord:
+    """
+    新运行的准入与排队：全局过载 -> 按用户准入 -> 调度队列容量，全部通过后登记到 RunRegistry 并交给调度器。
+    被拒绝时抛出 RunRejected
+    """
+    user_id = getattr(request.state, 'user_id', None)
+    try:
+        langgraph_agent = await _resolve_agent(agent)
+    except GraphLoadError as e:
+        raise RunRejected(503, {"error": "Graph unavailable", "detail": str(e)})
+
+    # 全局过载时先短暂延后，仍过载则返回 503
+    try:
+        await overload_controller.admit()
+    except Overloaded as e:
+        logger.warning(f"Run {input_data.run_id} shed: {e.detail}")
+        raise RunRejected(
+            503,
+            {"error": "Server overloaded, retry later", "detail": e.detail},
+            headers={"Retry-After": e.retry_after_header},
+        )
 
-def add_langgraph_fastapi_endpoint(app: FastAPI, agent: LangGraphAgent, path: str = "/"):
+    # 新运行需要先通过按用户的准入控制（并发数 / 速率），名额在运行结束时归还
+    key = admission_key(user_id, getattr(request.state, 'user_type', None), request.client.host if request.client else None)
+    permit = None
+    if settings.ADMISSION_ENABLED:
+        try:
+            permit = await admission_controller.acquire(key)
+        except AdmissionRejected as e:
+            logger.warning(f"Run {input_data.run_id} rejected for {key}: {e.reason}")
+            raise RunRejected(
+                429,
+                {"error": e.message, "reason": e.reason},
+                headers={"Retry-After": e.retry_after_header},
+            )
+    try:
+        if run_registry.get(input_data.run_id) is not None:
+            # 排队期间同一 run_id 的另一个请求已经启动了运行（名额在下方统一归还）
+            raise RunRejected(409, {"error": "Run already started, reconnect with Last-Event-ID"})
+        run_scheduler.check_capacity(priority)
+        record = run_registry.create(
+            run_id=input_data.run_id,
+            thread_id=input_data.thread_id,
+            user_id=user_id,
+            cancel_on_detach=not background,
+            graph=agent.name,
+        )
+        if permit is not None:
+            record.add_done_callback(permit.release)
+        run_scheduler.submit(record, langgraph_agent.run(input_data), priority, key)
+    except SchedulerFull as e:
+        if permit is not None:
+            permit.release()
+        logger.warning(f"Run {input_data.run_id} rejected: {e}")
+        raise RunRejected(503, {"error": str(e)}, headers={"Retry-After": e.retry_after_header})
+    except BaseException:
+        if permit is not None:
+            permit.release()
+        raise
+    return record
+
+
+def add_langgraph_fastapi_endpoint(app: FastAPI, agent: Union[LangGraphAgent, LazyGraphAgent], path: str = "/"):
     """Adds an endpoint to the FastAPI app."""
+    base_path = path.rstrip("/")
+    batch_manager.register_agent(agent)
+
+    def _find_run(run_id: str, request: Request) -> Optional[RunRecord]:
+        # 登记表由所有图共用：其他用户或其他图的运行一律按不存在处理
+        record = run_registry.get(run_id)
+        if record is None or record.user_id != getattr(request.state, 'user_id', None) or record.graph != agent.name:
+            return None
+        return record
+
+    def _find_batch(batch_id: str, request: Request):
+        job = batch_manager.get(batch_id)
+        if job is None or job.manifest.get("user_id") != getattr(request.state, 'user_id', None) \
+                or job.manifest.get("graph") != agent.name:
+            return None
+        return job
 
     @app.post(path)
     async def langgraph_agent_endpoint(input_data: RunAgentInput, request: Request):
-        # Get the accept header from the request
-        accept_header = request.headers.get("accept")
-        
-        # 从request.state中获取user_id（由AuthMiddleware设置）
         user_id = getattr(request.state, 'user_id', None)
-        
-        # 将user_id注入到forwarded_props中
-        if input_data.forwarded_props is None:
-            input_data.forwarded_props = {}
-        
-        if user_id:
-            input_data.forwarded_props["user_id"] = user_id
-
-        async def event_generator():
-            async for event in agent.run(input_data):
-                # 将事件对象转换为JSON格式
-                if event is not None:
-                    # 使用model_dump_json方法将事件序列化为JSON
-                    event_json = event.model_dump_json(exclude_none=True, by_alias=True)
-                    # 按照Server-Sent Events格式发送数据
-                    yield f"data: {event_json}\n\n"
-
-        return StreamingResponse(
-            event_generator(),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Headers": "*",
-            }
+        encoder = EventEncoder(_prepare_input(input_data, request))
+        after_seq = parse_last_event_id(request.headers.get("last-event-id"))
+
+        # 相同 run_id 的重试请求附加到已有运行（从 Last-Event-ID 之后回放），不重复执行
+        record = run_registry.get(input_data.run_id)
+        if record is not None:
+            if record.user_id != user_id:
+                return JSONResponse({"error": "Run not found"}, status_code=404)
+            if record.graph != agent.name:
+                return JSONResponse({"error": "run_id already used by another graph"}, status_code=409)
+            if record.thread_id != input_data.thread_id:
+                return JSONResponse({"error": "run_id already used by another thread"}, status_code=409)
+            logger.info(f"Attaching to existing run {record.run_id} after event {after_seq}")
+            run_registry.attach(record)
+        else:
+            priority = resolve_priority(input_data.forwarded_props, request.headers, default=PRIORITY_INTERACTIVE)
+            try:
+                record = await _submit_run(agent, input_data, request, priority)
+            except RunRejected as e:
+                return e.response()
+
+        return _sse_response(record, after_seq, request, encoder)
+
+    @app.post(f"{base_path}/runs")
+    async def langgraph_background_run(input_data: RunAgentInput, request: Request):
+        """
+        提交后台运行：立即返回 run_id，运行在没有订阅者时也会执行完；
+        之后通过 GET runs/{run_id}/stream 订阅事件（从头回放），或 GET runs/{run_id} 查询状态。
+        默认进入 batch 通道，forwarded_props.priority / X-Run-Priority 可指定 interactive
+        """
+        user_id = getattr(request.state, 'user_id', None)
+        _prepare_input(input_data, request)
+        record = run_registry.get(input_data.run_id)
+        if record is not None:
+            if record.user_id != user_id:
+                return JSONResponse({"error": "Run not found"}, status_code=404)
+            if record.graph != agent.name:
+                return JSONResponse({"error": "run_id already used by another graph"}, status_code=409)
+            if record.thread_id != input_data.thread_id:
+                return JSONResponse({"error": "run_id already used by another thread"}, status_code=409)
+            return JSONResponse({**record.info(), "stream_url": f"{base_path}/runs/{record.run_id}/stream"})
+
+        priority = resolve_priority(input_data.forwarded_props, request.headers, default=PRIORITY_BATCH)
+        try:
+            record = await _submit_run(agent, input_data, request, priority, background=True)
+        except RunRejected as e:
+            return e.response()
+        return JSONResponse(
+            {**record.info(), "priority": priority, "stream_url": f"{base_path}/runs/{record.run_id}/stream"},
+            status_code=202,
         )
 
-    @app.get(f"{path}/health")
+    @app.websocket(f"{base_path}/ws")
+    async def langgraph_websocket(websocket: WebSocket):
+        """WebSocket 传输：同一条连接上发起 / 订阅 / 取消运行，事件使用紧凑编码（见 api.ws_protocol）"""
+        codec = negotiate_codec(websocket)
+        await websocket.accept(subprotocol=codec.subprotocol if websocket.scope.get("subprotocols") else None)
+
+        async def start_run(input_data: RunAgentInput) -> RunRecord:
+            _prepare_input(input_data, websocket)
+            priority = resolve_priority(input_data.forwarded_props, websocket.headers, default=PRIORITY_INTERACTIVE)
+            return await _submit_run(agent, input_data, websocket, priority)
+
+        await WebSocketSession(websocket, codec, start_run, reject_types=(RunRejected,), graph=agent.name).serve()
+
+    @app.post(f"{base_path}/batches")
+    async def langgraph_batch_create(request: Request, concurrency: int = settings.BATCH_DEFAULT_CONCURRENCY):
+        """
+        提交批量运行：请求体为 JSONL，每行一个 RunAgentInput（threadId / runId 等可省略）。
+        结果写入 output.jsonl，通过 GET batches/{batch_id} 查询进度，GET batches/{batch_id}/output 下载结果
+        """
+        user_id = getattr(request.state, 'user_id', None)
+        key = admission_key(user_id, getattr(request.state, 'user_type', None), request.client.host if request.client else None)
+        concurrency = max(1, min(concurrency, settings.BATCH_MAX_CONCURRENCY))
+        try:
+            job = await batch_manager.create(request.stream(), agent.name, user_id, key, concurrency)
+        except BatchTooLarge as e:
+            return JSONResponse({"error": str(e)}, status_code=413)
+        return JSONResponse(job.progress(), status_code=202)
+
+    @app.get(f"{base_path}/batches/{{batch_id}}")
+    async def langgraph_batch_progress(batch_id: str, request: Request):
+        """查询批量运行进度"""
+        job = _find_batch(batch_id, request)
+        if job is None:
+            return JSONResponse({"error": "Batch not found"}, status_code=404)
+        return job.progress()
+
+    @app.get(f"{base_path}/batches/{{batch_id}}/output")
+    async def langgraph_batch_output(batch_id: str, request: Request):
+        """下载已完成部分的结果（JSONL，按完成顺序，line 字段对应输入行号）"""
+        job = _find_batch(batch_id, request)
+        if job is None:
+            return JSONResponse({"error": "Batch not found"}, status_code=404)
+        output_path = job.directory / OUTPUT_FILE
+        if not output_path.exists():
+            return JSONResponse({"error": "No output yet"}, status_code=404)
+        return FileResponse(output_path, media_type="application/x-ndjson", filename=f"{batch_id}.jsonl")
+
+    @app.get(f"{base_path}/runs/{{run_id}}/stream")
+    async def langgraph_run_stream(run_id: str, request: Request, after: Optional[int] = None):
+        """重新连接到一个运行的事件流：Last-Event-ID 请求头或 ?after= 指定从哪个事件之后开始"""
+        record = _find_run(run_id, request)
+        if record is None:
+            return JSONResponse({"error": "Run not found"}, status_code=404)
+        after_seq = after if after is not None else parse_last_event_id(request.headers.get("last-event-id"))
+        run_registry.attach(record)
+        return _sse_response(record, after_seq, request, EventEncoder(resolve_wire_mode(None, request.headers)))
+
+    @app.get(f"{base_path}/runs/{{run_id}}")
+    async def langgraph_run_info(run_id: str, request: Request):
+        """查询运行状态"""
+        record = _find_run(run_id, request)
+        if record is None:
+            return JSONResponse({"error": "Run not found"}, status_code=404)
+        return record.info()
+
+    register_public_path(f"{base_path}/health")
+    register_public_path(f"{base_path}/ready")
+
+    @app.get(f"{base_path}/health")
     def health():
         """Health check."""
         return {
             "status": "ok",
             "agent": {
                 "name": agent.name,
-            }
-        }
\ No newline at end of file
+                "loaded": getattr(agent, "loaded", True),
+            },
+            "browser_pool": browser_pool.stats(),
+            "checkpointer": checkpointer_manager.stats(),
+            "streams": stream_stats.snapshot(),
+            "sse_compression": sse_compression_stats.snapshot(),
+            "runs": run_registry.stats(),
+            "scheduler": run_scheduler.stats(),
+            "admission": admission_controller.stats(),
+            "overload": overload_controller.stats(),
+        }
+
+    @app.get(f"{base_path}/ready")
+    async def ready():
+        """Readiness probe: 503 while this worker should not receive new runs."""
+        report = await readiness_checker.check(agent)
+        return JSONResponse(report, status_code=200 if report["ready"] else 503)
\ No newline at end of file
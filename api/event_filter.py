@@ -0,0 +1,204 @@
+"""
+按事件类型订阅：在事件产生的源头过滤
+
+客户端声明需要的事件类型后，不需要的事件在 _process_event 中根本不会被构造（也就不会做 JSON 安全化），
+能映射到 LangGraph 运行类型的部分进一步下推为 astream_events 的 exclude_types，图内部也不再产生对应的事件：
+
+- RAW 不需要时排除 prompt / parser / retriever / llm 类型的运行（它们只会产生 RAW 事件）
+- TOOL_CALL_* 都不需要时排除 tool 类型的运行
+- TEXT_MESSAGE_* 和 TOOL_CALL_* 都不需要时排除 chat_model 类型的运行
+- chain 类型无法排除：运行生命周期、步骤与状态差分都依赖 on_chain_start / on_chain_end
+
+指定方式（请求头优先，逗号分隔；forwarded_props 中为列表）：
+    X-AGUI-Event-Types / forwarded_props.event_types                  只接收这些类型
+    X-AGUI-Exclude-Event-Types / forwarded_props.exclude_event_types  不接收这些类型
+RUN_STARTED / RUN_FINISHED / RUN_ERROR 总会下发；未知的类型名忽略（兼容新版本协议的客户端）。
+过滤在运行级别生效：附加到同一运行的其他订阅者看到的是发起方声明的事件集合。
+"""
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional
+
+from api.models.events import EventType
+
+EVENT_TYPES_HEADER = "x-agui-event-types"
+EXCLUDE_EVENT_TYPES_HEADER = "x-agui-exclude-event-types"
+
+LIFECYCLE_EVENT_TYPES = frozenset({EventType.RUN_STARTED, EventType.RUN_FINISHED, EventType.RUN_ERROR})
+ALL_EVENT_TYPES = frozenset(EventType)
+
+TEXT_MESSAGE_EVENT_TYPES = frozenset({
+    EventType.TEXT_MESSAGE_START,
+    EventType.TEXT_MESSAGE_CONTENT,
+    EventType.TEXT_MESSAGE_END,
+})
+TOOL_CALL_EVENT_TYPES = frozenset({
+    EventType.TOOL_CALL_START,
+    EventType.TOOL_CALL_ARGS,
+    EventType.TOOL_CALL_END,
+    EventType.TOOL_CALL_RESULT,
+})
+STATE_EVENT_TYPES = frozenset({EventType.STATE_SNAPSHOT, EventType.STATE_DELTA})
+
+# 只会产生 RAW 事件的 LangChain 运行类型
+RAW_ONLY_RUN_TYPES = ("prompt", "parser", "retriever", "llm")
+
+
+def parse_event_type_names(values: Any) -> List[str]:
+    """接受逗号分隔的字符串或列表，返回规范化的事件类型名（忽略未知名称）"""
+    if values is None:
+        return []
+    if isinstance(values, str):
+        values = values.split(",")
+    names = []
+    for value in values:
+        name = str(value).strip().upper()
+        if name in EventType.__members__:
+            names.append(name)
+    return names
+
+
+def resolve_event_types(
+    forwarded_props: Optional[Mapping[str, Any]],
+    headers: Optional[Mapping[str, str]] = None,
+) -> Dict[str, Optional[List[str]]]:
+    """协商包含 / 排除的事件类型，返回写回 forwarded_props 的 {"event_types", "exclude_event_types"}"""
+    props = forwarded_props or {}
+    resolved: Dict[str, Optional[List[str]]] = {}
+    for key, header in (("event_types", EVENT_TYPES_HEADER), ("exclude_event_types", EXCLUDE_EVENT_TYPES_HEADER)):
+        value = headers.get(header) if headers is not None else None
+        if value is None:
+            value = props.get(key)
+        resolved[key] = parse_event_type_names(value) if value is not None else None
+    return resolved
+
+
+class EventFilter:
+    __slots__ = ("allowed",)
+
+    def __init__(self, include: Optional[Iterable[str]] = None, exclude: Optional[Iterable[str]] = None):
+        allowed = ALL_EVENT_TYPES if include is None else frozenset(EventType[name] for name in include)
+        if exclude:
+            allowed = allowed - {EventType[name] for name in exclude}
+        self.allowed: FrozenSet[EventType] = allowed | LIFECYCLE_EVENT_TYPES
+
+    @classmethod
+    def from_props(cls, forwarded_props: Optional[Mapping[str, Any]]) -> "EventFilter":
+        props = forwarded_props or {}
+        include = props.get("event_types")
+        return cls(
+            include=parse_event_type_names(include) if include is not None else None,
+            exclude=parse_event_type_names(props.get("exclude_event_types")),
+        )
+
+    @property
+    def unfiltered(self) -> bool:
+        return self.allowed == ALL_EVENT_TYPES
+
+    def wants(self, event_type: EventType) -> bool:
+        return event_type in self.allowed
+
+    def wants_any(self, event_types: FrozenSet[EventType]) -> bool:
+        return not self.allowed.isdisjoint(event_types)
+
+    def exclude_run_types(self) -> List[str]:
+        """可以下推给 astream_events(exclude_types=...) 的 LangChain 运行类型"""
+        run_types = []
+        if not self.wants(EventType.RAW):
+            run_types.extend(RAW_ONLY_RUN_TYPES)
+        wants_tool_calls = self.wants_any(TOOL_CALL_EVENT_TYPES)
+        if not wants_tool_calls:
+            run_types.append("tool")
+        if not wants_tool_calls and not self.wants_any(TEXT_MESSAGE_EVENT_TYPES):
+            run_types.append("chat_model")
+        return run_types
+
+
+if __name__ == "__main__":
+    # 基准：full 传输模式下同一个带工具调用的图，不过滤 vs 只订阅文本和工具结果时的事件数与耗时
+    import asyncio
+    import time
+    from typing import Annotated, TypedDict
+
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.messages import AIMessageChunk
+    from langchain_core.outputs import ChatGenerationChunk, ChatResult
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.tools import tool
+    from langgraph.checkpoint.memory import InMemorySaver
+    from langgraph.graph import END, START, StateGraph
+    from langgraph.graph.message import add_messages
+    from langgraph.prebuilt import ToolNode
+
+    from api.event_handler import LangGraphAgent
+    from api.models.types import RunAgentInput
+
+    class ScriptedChatModel(BaseChatModel):
+        """第一次调用工具，看到工具结果后逐块流式输出长回复"""
+
+        @property
+        def _llm_type(self) -> str:
+            return "scripted"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+            raise NotImplementedError
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            if messages[-1].type == "tool":
+                text = "长沙明天多云转小雨，气温 18-24℃，出门记得带伞。" * 20
+                chunks = [AIMessageChunk(content=text[i:i + 8]) for i in range(0, len(text), 8)]
+            else:
+                tool_call = {"id": "call-1", "name": "search", "args": '{"query": "长沙天气"}', "index": 0}
+                chunks = [AIMessageChunk(content="", tool_call_chunks=[tool_call])]
+            for message in chunks:
+                chunk = ChatGenerationChunk(message=message)
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+
+    @tool
+    def search(query: str) -> str:
+        """搜索"""
+        return f"{query}：" + "多云转小雨 " * 200
+
+    class BenchState(TypedDict):
+        messages: Annotated[list, add_messages]
+
+    model = ScriptedChatModel()
+    prompt = ChatPromptTemplate.from_messages([("system", "你是天气助手"), ("placeholder", "{messages}")])
+
+    async def call_model(state: BenchState):
+        return {"messages": [await (prompt | model).ainvoke({"messages": state["messages"]})]}
+
+    def route(state: BenchState):
+        return "tools" if state["messages"][-1].tool_calls else END
+
+    builder = StateGraph(BenchState)
+    builder.add_node("model", call_model)
+    builder.add_node("tools", ToolNode([search]))
+    builder.add_edge(START, "model")
+    builder.add_conditional_edges("model", route)
+    builder.add_edge("tools", "model")
+    agent = LangGraphAgent(name="bench", graph=builder.compile(checkpointer=InMemorySaver()))
+
+    async def one_run(i: int, props: dict) -> int:
+        input_data = RunAgentInput(
+            thread_id=f"thread-{i}", run_id=f"run-{i}", state={}, tools=[], context=[],
+            messages=[{"id": f"user-{i}", "role": "user", "content": "长沙明天天气？"}],
+            forwarded_props={"wire_mode": "full", "coalesce": False, **props},
+        )
+        return len([event async for event in agent.run(input_data)])
+
+    async def main():
+        cases = {
+            "unfiltered": {},
+            "text + tool results": {"event_types": ["TEXT_MESSAGE_CONTENT", "TOOL_CALL_RESULT"]},
+            "exclude RAW": {"exclude_event_types": ["RAW"]},
+        }
+        for label, props in cases.items():
+            await one_run(-1, props)
+            t0 = time.perf_counter()
+            counts = [await one_run(i, props) for i in range(50)]
+            elapsed = (time.perf_counter() - t0) / len(counts) * 1000
+            print(f"{label:20s}: {counts[0]:3d} events/run, {elapsed:.2f} ms/run, "
+                  f"exclude_types={EventFilter.from_props(props).exclude_run_types()}")
+
+    asyncio.run(main())
@@ -1,7 +1,8 @@
 import inspect
 import json
 import time
-from typing import Any, Dict, List, Literal, Optional, Union
+from contextlib import aclosing
+from typing import Any, Dict, List, Literal, Optional, Tuple, Union
 import uuid
 from langgraph.types import Command
 
@@ -31,10 +32,30 @@ from api.models.events import (
 
 
 # 用于类型检查辅助
-from langchain_core.messages import  ToolMessage, SystemMessage, BaseMessage
+from langchain_core.messages import  ToolMessage, BaseMessage
+from langchain_core.callbacks import UsageMetadataCallbackHandler
 
+from agents.checkpointer import checkpointer_manager
 from api.models.types import RunAgentInput, State
-from api.utils import agui_messages_to_langchain, get_stream_payload_input, make_json_safe
+from api.coalescer import TextDeltaCoalescer, resolve_coalesce
+from api.event_filter import STATE_EVENT_TYPES, TEXT_MESSAGE_EVENT_TYPES, TOOL_CALL_EVENT_TYPES
+from api.history import HISTORY_MISMATCH, HistoryMismatch, select_new_messages
+from api.metrics import (
+    RUN_DURATION,
+    RUN_STATUS_CANCELLED,
+    RUN_STATUS_ERROR,
+    RUN_STATUS_FINISHED,
+    RUN_TTFT,
+    RUNS,
+    SCHEMA_CACHE_HIT,
+    SCHEMA_CACHE_MISS,
+    MetricsCallbackHandler,
+)
+from api.session import RunSession
+from api.state_diff import StateTracker, iter_state_updates
+from api.utils import agui_messages_to_langchain, get_stream_payload_input, make_json_safe, summarize_run_result
+from langgraph.channels.binop import BinaryOperatorAggregate
+from langgraph.channels.delta import DeltaChannel
 from langgraph.graph.state import CompiledStateGraph
 from langchain_core.runnables import RunnableConfig
 from utils.logger import get_logger
@@ -42,27 +63,92 @@ from utils.logger import get_logger
 logger = get_logger()
 class LangGraphAgent:
     def __init__(self,name, graph: CompiledStateGraph,  description: Optional[str] = None, config:  Union[Optional[RunnableConfig], dict] = None):
-        # 定义需要忽略的内部链名称，避免生成过多无意义的 Step 事件
-        self.tool_calls = {}
-        self.messages_id = set()
+        # 实例在所有请求间共享，随运行变化的状态都放在每个运行独立的 RunSession 中
         self.graph = graph
         self.name = name
         self.description = description
         self.config = config  
+        # 定义需要忽略的内部链名称，避免生成过多无意义的 Step 事件
         self.ignored_chains = []
         
-        self.active_run = None
+        # 正在进行中的运行（run_id -> RunSession），运行结束即移除
+        self.active_runs: Dict[str, RunSession] = {}
         self.constant_schema_keys = ['messages', 'tools']
 
+        # 图的 schema 与 astream_events 签名在图的生命周期内不会变化，只计算一次
+        self._schema_keys_cache: Dict[Tuple[str, ...], Dict[str, List[str]]] = {}
+        self._stream_accepts_context: Optional[bool] = None
+        # 带 reducer 的状态键（如 files），状态差分时用于合并节点的局部更新；
+        # DeltaChannel 的 reducer 一次接收一批写入，包装成 (当前值, 单个更新) 的形式
+        channels = getattr(graph, "channels", None) or {}
+        self._state_reducers: Dict[str, Any] = {
+            key: channel.operator
+            for key, channel in channels.items()
+            if isinstance(channel, BinaryOperatorAggregate)
+        }
+        self._state_reducers.update(
+            (key, lambda left, right, reducer=channel.reducer: reducer(left, [right]))
+            for key, channel in channels.items()
+            if isinstance(channel, DeltaChannel)
+        )
+
         
     async def run(self, input_data: RunAgentInput):
-        async for event in self._handle_stream_events(input_data):
-            yield event
+        events = self._handle_stream_events(input_data)
+        # 默认按 STREAM_COALESCE_ENABLED 合并连续的文本增量，客户端可通过 forwarded_props.coalesce = false 关闭
+        if resolve_coalesce(input_data.forwarded_props):
+            events = TextDeltaCoalescer().coalesce(events)
+        # 显式关闭整条生成器链，保证上游被取消/提前关闭时 astream_events 的图任务随之结束
+        async with aclosing(events):
+            async for event in events:
+                yield event
     
-    def _dispatch_event(self, event: Event):
+    async def invoke(self, input_data: RunAgentInput) -> Dict[str, Any]:
+        """
+        非流式执行（批量任务使用）：直接 ainvoke，不构造逐 token 的 AG-UI 事件，只返回最终回复和 token 用量
+        """
+        thread_id = input_data.thread_id or str(uuid.uuid4())
+        forwarded_props = input_data.forwarded_props or {}
+        config = self.config.copy() if self.config else {}
+        config["configurable"] = {**(config.get('configurable', {})), "thread_id": thread_id}
+        if "user_id" in forwarded_props:
+            config["configurable"]["user_id"] = forwarded_props["user_id"]
+        # 用量统计包含子 agent 内部的模型调用
+        usage_handler = UsageMetadataCallbackHandler()
+        config["callbacks"] = [*(config.get("callbacks") or []), usage_handler, MetricsCallbackHandler(self.name)]
+
+        agent_state = await self.graph.aget_state(config)
+        state_input = input_data.state or {}
+        state_input["messages"] = agent_state.values.get("messages", [])
+        # delta 模式下历史与检查点不一致时抛出 HistoryMismatch
+        new_messages = self._select_new_messages(input_data, state_input["messages"])
+        state = self.langgraph_default_merge_state(state_input, agui_messages_to_langchain(new_messages), input_data)
+        payload_input = get_stream_payload_input(mode="start", state=state, schema_keys=self.get_schema_keys(config))
+
+        kwargs: Dict[str, Any] = {"config": config}
+        if self._accepts_context():
+            kwargs["context"] = dict(config["configurable"])
+        output = await self.graph.ainvoke(payload_input, **kwargs)
+        checkpointer_manager.schedule_prune(self.graph.checkpointer, thread_id)
+
+        messages = output.get("messages", []) if isinstance(output, dict) else []
+        content = messages[-1].content if messages else None
+        return {
+            "thread_id": thread_id,
+            "output": content if isinstance(content, str) else make_json_safe(content),
+            "message_count": len(messages),
+            "usage": make_json_safe(usage_handler.usage_metadata),
+        }
+
+    def _dispatch_event(self, event: Event, session: RunSession):
         """
         这里应该是将事件发送到前端、存入数据库或通过 SSE/WebSocket 发出的逻辑
+        lean 模式下直接丢弃 raw_event，不再对其做 JSON 安全化遍历
         """
+        if session.lean:
+            event.raw_event = None
+            return event
+
         if event.type == EventType.RAW:
             event.event = make_json_safe(event.event)
         elif event.raw_event:
@@ -80,7 +166,7 @@ class LangGraphAgent:
             return chunk
         return ""
 
-    async def _process_event(self, event: Dict[str, Any]):
+    async def _process_event(self, event: Dict[str, Any], session: RunSession):
         """
         处理 LangGraph v2 协议的事件，并转换为 Agent Protocol 事件
         使用 yield 生成事件，以便在 _handle_stream_events 中使用 async for 处理
@@ -94,6 +180,8 @@ class LangGraphAgent:
         metadata = event.get("metadata", {})
         # 获取当前时间戳
         ts = int(time.time() * 1000)
+        # 客户端不需要的事件不构造，也就不会做 JSON 安全化
+        wants = session.event_filter.wants
 
         match event_type:
             # --- 1. Chain/Graph 生命周期 ---
@@ -108,19 +196,24 @@ class LangGraphAgent:
                             thread_id=metadata.get("thread_id"),
                             input=None,
                             raw_event=event,
-                        )
+                        ),
+                        session,
                     )
+                    # 完整状态只在运行开始时下发一次，之后都是 STATE_DELTA
+                    if wants(EventType.STATE_SNAPSHOT):
+                        yield StateSnapshotEvent(timestamp=ts, snapshot=session.state.snapshot())
                 # 否则，如果是具体的节点（Node）或 Chain，且不在忽略列表中
                 elif name not in self.ignored_chains:
-                    if self.active_run['node_name'] != name:
+                    if session.node_name != name and wants(EventType.STEP_STARTED):
                         yield self._dispatch_event(
                             StepStartedEvent(
                                 timestamp=ts,
                                 step_name=name,
                                 raw_event=event,
-                            )
+                            ),
+                            session,
                         )
-                self.active_run['node_name'] = name
+                session.node_name = name
                 
 
             case "on_chain_end":
@@ -128,30 +221,37 @@ class LangGraphAgent:
                 output = data.get("output")
                 # 根节点结束 -> RunFinished
                 if not parent_ids:
+                    # 用完整的最终状态校正产生的 STATE_DELTA 必须先发：AG-UI 规定 RUN_FINISHED 之后不能再有事件
+                    if session.event_filter.wants_any(STATE_EVENT_TYPES):
+                        patch = self._track_state(event, output, session)
+                        if patch and wants(EventType.STATE_DELTA):
+                            yield StateDeltaEvent(timestamp=ts, delta=patch)
                     # 获取最终输出结果
                     yield self._dispatch_event(
                         RunFinishedEvent(
                             timestamp=ts,
                             run_id=run_id,
                             thread_id=metadata.get("thread_id"),
-                            result=str(output) if output else None,
+                            result=self._project_result(output, session),
                             raw_event=event
-                        )
+                        ),
+                        session,
                     )
                 # 子节点结束 -> StepFinished
-                elif name not in self.ignored_chains:
+                elif name not in self.ignored_chains and wants(EventType.STEP_FINISHED):
                     yield self._dispatch_event(
                         StepFinishedEvent(
                             timestamp=ts,
                             step_name=name,
                             raw_event=event
-                        )
+                        ),
+                        session,
                     )
-                self.active_run['node_name'] = name
-                if output is not None and isinstance(
-                    output, dict
-                ):
-                    self.active_run['current_graph_state'].update(output)
+                session.node_name = name
+                if parent_ids and session.event_filter.wants_any(STATE_EVENT_TYPES):
+                    patch = self._track_state(event, output, session)
+                    if patch and wants(EventType.STATE_DELTA):
+                        yield StateDeltaEvent(timestamp=ts, delta=patch)
 
             case "on_chain_error":
                 # 如果是根节点报错
@@ -162,7 +262,8 @@ class LangGraphAgent:
                             message=str(data.get("error", "Unknown Error")),
                             code="500",
                             raw_event=event
-                        )
+                        ),
+                        session,
                     )
 
             # --- 2. Chat Model (LLM) 交互 ---
@@ -173,75 +274,91 @@ class LangGraphAgent:
             case "on_chat_model_stream":
                 # LLM 流式输出 (打字机效果)
                 chunk = data.get("chunk")
+                # 按 (message_id, index) 累积工具调用参数，不做 JSON 往返
+                if session.event_filter.wants_any(TOOL_CALL_EVENT_TYPES):
+                    for tool_call_chunk in getattr(chunk, "tool_call_chunks", None) or ():
+                        session.tool_calls.add_chunk(chunk.id, tool_call_chunk)
+                if not session.event_filter.wants_any(TEXT_MESSAGE_EVENT_TYPES):
+                    return
                 content = self._extract_content(chunk)
-                tool_call_datas = event["data"]["chunk"].tool_call_chunks
-                if tool_call_datas:
-                    for tool_call_data in tool_call_datas:
-                        self._add_tool_call_data(tool_call_data)
-                
-                if chunk.id not in self.messages_id:
-                    self.messages_id.add(chunk.id)
+
+                if chunk.id not in session.messages_id and wants(EventType.TEXT_MESSAGE_START):
+                    session.messages_id.add(chunk.id)
                     yield self._dispatch_event(
                         TextMessageStartEvent(
                             timestamp=ts,
                             message_id=chunk.id,
                             raw_event=event,
-                        )
+                        ),
+                        session,
                     )
 
-                if content:
+                if content and wants(EventType.TEXT_MESSAGE_CONTENT):
                     yield self._dispatch_event(
                         TextMessageContentEvent(
                             timestamp=ts,
                             message_id=chunk.id,
                             delta=content,
                             raw_event=event,
-                        )
+                        ),
+                        session,
                     )
 
             case "on_chat_model_end":
-                # LLM 生成结束
+                # LLM 生成结束，登记本条消息发起的工具调用
+                if session.event_filter.wants_any(TOOL_CALL_EVENT_TYPES):
+                    session.tool_calls.finish_message(data['output'])
+                if not wants(EventType.TEXT_MESSAGE_END):
+                    return
                 yield self._dispatch_event(
                     TextMessageEndEvent(
                         timestamp=ts,
                         message_id=data['output'].id,
                         raw_event=event,
 
-                    )
+                    ),
+                    session,
                 )
 
             # --- 3. Tool (工具) 调用 ---
             case "on_tool_start":
                 # 工具开始执行
+                if not session.event_filter.wants_any(TOOL_CALL_EVENT_TYPES):
+                    return
                 args = data.get("input", {})
                 name = event.get("name")
-                tool_call_data = self._get_tool_call_data(name, args)
+                tool_call_id, call_args = session.tool_calls.bind_run(run_id, name, args)
                 yield self._dispatch_event(
                     ToolCallStartEvent(
                         timestamp=ts,
-                        tool_call_id=tool_call_data['id'],
+                        tool_call_id=tool_call_id,
                         tool_call_name=name,
                         parent_message_id=parent_ids[-1] if parent_ids else None,
                         raw_event=event,
 
-                    )
+                    ),
+                    session,
                 )
                 
                 # 如果需要发送参数细节，也可以在这里发送 ToolCallArgsEvent
                 yield self._dispatch_event(
                     ToolCallArgsEvent(
                         timestamp=ts,
-                        tool_call_id=tool_call_data['id'],
-                        delta=json.dumps(args, ensure_ascii=False),
+                        tool_call_id=tool_call_id,
+                        delta=json.dumps(call_args, ensure_ascii=False, default=str),
                         raw_event=event
-                    )
+                    ),
+                    session,
                 )
 
             case "on_tool_end":
                 # 工具执行完毕，返回结果
+                if not session.event_filter.wants_any(TOOL_CALL_EVENT_TYPES):
+                    return
                 output = data.get("output")
+                # 释放 run_id 与 tool_call_id 的绑定
+                bound_tool_call_id = session.tool_calls.resolve_run(run_id)
 
-                
                 if isinstance(output, Command):
                     messages = output.update.get('messages', [])
                     tool_messages = [m for m in messages if isinstance(m, ToolMessage)]
@@ -253,61 +370,104 @@ class LangGraphAgent:
                                 tool_call_id=tool_msg.tool_call_id,
                                 content=tool_msg.content,
                                 raw_event=event
-                            )
+                            ),
+                            session,
                         )
                         yield self._dispatch_event(
                             ToolCallEndEvent(
                                 timestamp=ts,
                                 tool_call_id=tool_msg.tool_call_id,
                                 raw_event=event,
-                            )
+                            ),
+                            session,
                         )
                 else:
-                    # 序列化输出内容
-                    args = data.get("input", {})
-                    name = event.get("name")
-                    tool_call_data = self._get_tool_call_data(name, args)
+                    # 工具返回 ToolMessage 时直接使用其 tool_call_id
+                    tool_call_id = getattr(output, "tool_call_id", None) or bound_tool_call_id
                     yield self._dispatch_event(
                         ToolCallResultEvent(
                             timestamp=ts,
                             message_id=str(uuid.uuid4()), # 通常结果绑定在调用 ID 上
-                            tool_call_id=tool_call_data['id'],
-                            content=output.content,
+                            tool_call_id=tool_call_id,
+                            content=self._extract_content(output),
                             raw_event=event
-                        )
+                        ),
+                        session,
                     )
                     yield self._dispatch_event(
                         ToolCallEndEvent(
                             timestamp=ts,
-                            tool_call_id=tool_call_data['id'],
+                            tool_call_id=tool_call_id,
                             raw_event=event,
-                        )
+                        ),
+                        session,
                     )
                 
             
             case _:
-                # 其他事件，忽略
-                yield RawEvent(timestamp=ts, event=event)
+                # 其他事件：lean 模式下不再透传原始事件
+                if not session.lean and wants(EventType.RAW):
+                    yield RawEvent(timestamp=ts, event=event)
     
-    def _add_tool_call_data(self, tool_call_data: Dict[str, Any]):
-        tool_name = tool_call_data["name"]
-        tool_args = tool_call_data.get("args", "{}")
-        tool_args = json.dumps(json.loads(tool_args))
-        self.tool_calls[f"{tool_name}-{tool_args}"] = tool_call_data
-    def _get_tool_call_data(self, tool_name: str, tool_args: Dict[str, Any]):
-        return self.tool_calls.get(f"{tool_name}-{json.dumps(tool_args)}", None)
+    @staticmethod
+    def _track_state(event: Dict[str, Any], output: Any, session: RunSession):
+        """
+        根图结束时用完整的最终状态校正；根图节点结束时应用其局部更新。
+        子图、工具内部以及节点内部的 chain 不影响根图状态，直接跳过
+        """
+        if not event.get("parent_ids"):
+            return session.state.replace(output) if isinstance(output, dict) else None
+        metadata = event.get("metadata", {})
+        if metadata.get("langgraph_node") != event["name"] or "|" in (metadata.get("langgraph_checkpoint_ns") or ""):
+            return None
+        patch = []
+        for update in iter_state_updates(output):
+            patch.extend(session.state.update(update))
+        return patch
+
+    def _project_result(self, output: Any, session: RunSession):
+        """RunFinished 的 result：lean 模式只返回摘要，否则保持原有的字符串化结果"""
+        if session.lean:
+            return summarize_run_result(output)
+        return str(output) if output else None
 
     async def _handle_stream_events(self, input: RunAgentInput):
         thread_id = input.thread_id or str(uuid.uuid4())
-        INITIAL_ACTIVE_RUN = {
-            "id": input.run_id,
-            "thread_id": thread_id,
-            "thinking_process": None,
-            "node_name": None,
-            "has_function_streaming": False,
-        }
-        self.active_run = INITIAL_ACTIVE_RUN
-        
+        # 每个运行独立的会话状态，避免并发请求互相覆盖
+        session = RunSession.from_input(input, thread_id)
+        self.active_runs[session.run_id] = session
+        started = time.perf_counter()
+        first_token = None
+        # 没有正常结束也没有报错（客户端断开、运行被取消）时按 cancelled 计
+        status = RUN_STATUS_CANCELLED
+        try:
+            allowed = None if session.event_filter.unfiltered else session.event_filter.allowed
+            async with aclosing(self._stream_session_events(input, session)) as events:
+                async for event in events:
+                    event_type = event.type
+                    if first_token is None and event_type == EventType.TEXT_MESSAGE_CONTENT:
+                        first_token = time.perf_counter()
+                        RUN_TTFT.labels(self.name).observe(first_token - started)
+                    elif event_type == EventType.RUN_FINISHED:
+                        status = RUN_STATUS_FINISHED
+                    elif event_type == EventType.RUN_ERROR:
+                        status = RUN_STATUS_ERROR
+                    # 源头按事件组过滤，这里去掉组内客户端没有声明的单个类型（如只要 TOOL_CALL_RESULT）
+                    if allowed is None or event_type in allowed:
+                        yield event
+        except Exception:
+            status = RUN_STATUS_ERROR
+            raise
+        finally:
+            self.active_runs.pop(session.run_id, None)
+            if status == RUN_STATUS_FINISHED:
+                # 后台清理该线程超出保留数量的旧检查点
+                checkpointer_manager.schedule_prune(self.graph.checkpointer, thread_id)
+            RUNS.labels(self.name, status).inc()
+            RUN_DURATION.labels(self.name).observe(time.perf_counter() - started)
+
+    async def _stream_session_events(self, input: RunAgentInput, session: RunSession):
+        thread_id = session.thread_id
         forwarded_props = input.forwarded_props
 
         node_name_input = forwarded_props.get('node_name', None) if forwarded_props else None
@@ -318,51 +478,65 @@ class LangGraphAgent:
         if forwarded_props and "user_id" in forwarded_props:
             config["configurable"]["user_id"] = forwarded_props["user_id"]
             logger.info(f"Extracted user_id from forwarded_props: {forwarded_props['user_id']}")
-        
+        # 模型 / 工具指标走回调而不是 astream_events，事件过滤排除了 chat_model / tool 运行时照样记录
+        config["callbacks"] = [*(config.get("callbacks") or []), MetricsCallbackHandler(self.name)]
+
         agent_state = await self.graph.aget_state(config)
 
         resume_input = forwarded_props.get('command', {}).get('resume', None)
-        if resume_input is None and thread_id and self.active_run.get("node_name") != "__end__" and self.active_run.get("node_name"):
-            self.active_run["mode"] = "continue"
+        if resume_input is None and thread_id and session.node_name != "__end__" and session.node_name:
+            session.mode = "continue"
         else:
-            self.active_run["mode"] = "start"
-        prepared_stream_response = await self.prepare_stream(input=input, agent_state=agent_state, config=config)
+            session.mode = "start"
+        try:
+            prepared_stream_response = await self.prepare_stream(input=input, agent_state=agent_state, config=config, session=session)
+        except HistoryMismatch as e:
+            # 客户端视图已过期，由客户端同步历史后重试
+            logger.warning(f"Run {session.run_id} rejected: {e}")
+            yield self._dispatch_event(RunErrorEvent(message=str(e), code=HISTORY_MISMATCH), session)
+            return
 
         state = prepared_stream_response["state"]
         stream = prepared_stream_response["stream"]
         config = prepared_stream_response["config"]
         
-        async for event in stream:
-            if event["event"] == "error":
-                yield self._dispatch_event(
-                    RunErrorEvent(type=EventType.RUN_ERROR, message=event["data"]["message"], raw_event=event)
-                )
-                break
-            # 使用 async for 处理 _process_event 生成的事件
-            async for processed_event in self._process_event(event):
-                if processed_event is not None:
-                    yield processed_event
-    async def prepare_stream(self, input: RunAgentInput, agent_state: State, config: RunnableConfig):
+        async with aclosing(stream):
+            async for event in stream:
+                if event["event"] == "error":
+                    yield self._dispatch_event(
+                        RunErrorEvent(type=EventType.RUN_ERROR, message=event["data"]["message"], raw_event=event),
+                        session,
+                    )
+                    break
+                # 使用 async for 处理 _process_event 生成的事件
+                async for processed_event in self._process_event(event, session):
+                    if processed_event is not None:
+                        yield processed_event
+    async def prepare_stream(self, input: RunAgentInput, agent_state: State, config: RunnableConfig, session: RunSession):
         state_input = input.state or {}
-        messages = input.messages or []
         forwarded_props = input.forwarded_props or {}
         thread_id = input.thread_id
         
         state_input["messages"] = agent_state.values.get("messages", [])
 
-        self.active_run["current_graph_state"] = agent_state.values.copy()
-        langchain_messages = agui_messages_to_langchain(messages)
+        track_state = session.event_filter.wants_any(STATE_EVENT_TYPES)
+        if track_state:
+            session.state = StateTracker(agent_state.values, reducers=self._state_reducers)
+        # 只转换检查点中还没有的消息
+        langchain_messages = agui_messages_to_langchain(self._select_new_messages(input, state_input["messages"]))
         state = self.langgraph_default_merge_state(state_input, langchain_messages, input)
-        self.active_run["current_graph_state"].update(state)
+        # 客户端随请求提交的状态同样计入初始快照
+        if track_state:
+            session.state.replace(state)
         config["configurable"]["thread_id"] = thread_id
         interrupts = agent_state.tasks[0].interrupts if agent_state.tasks and len(agent_state.tasks) > 0 else []
         has_active_interrupts = len(interrupts) > 0
         resume_input = forwarded_props.get('command', {}).get('resume', None)
-        self.active_run["schema_keys"] = self.get_schema_keys(config)
+        session.schema_keys = self.get_schema_keys(config)
         payload_input = get_stream_payload_input(
-            mode=self.active_run["mode"],
+            mode=session.mode,
             state=state,
-            schema_keys=self.active_run["schema_keys"],
+            schema_keys=session.schema_keys,
         )
         stream_input = {**forwarded_props, **payload_input} if payload_input else None
         subgraphs_stream_enabled = input.forwarded_props.get('stream_subgraphs') if input.forwarded_props else False
@@ -372,6 +546,7 @@ class LangGraphAgent:
             config=config,
             subgraphs=bool(subgraphs_stream_enabled),
             version="v2",
+            exclude_types=session.event_filter.exclude_run_types(),
         )
 
         stream = self.graph.astream_events(**kwargs)
@@ -381,7 +556,35 @@ class LangGraphAgent:
             "config": config
         }
 
+    def warm_up(self, user_ids: bool = True):
+        """
+        预热：提前计算 schema keys 和 astream_events 签名，避免首个请求承担这部分开销
+        """
+        config = self.config.copy() if self.config else {}
+        configurable = {**(config.get('configurable', {})), "thread_id": "__warm_up__"}
+        self.get_schema_keys({**config, "configurable": configurable})
+        if user_ids:
+            self.get_schema_keys({**config, "configurable": {**configurable, "user_id": "__warm_up__"}})
+        self._accepts_context()
+
+    @staticmethod
+    def _config_signature(config: Optional[RunnableConfig]) -> Tuple[str, ...]:
+        """缓存键：只取 configurable 的键名（thread_id 等值每次请求都不同，但不影响 schema）"""
+        configurable = (config or {}).get("configurable") or {}
+        return tuple(sorted(configurable.keys()))
+
     def get_schema_keys(self, config):
+        signature = self._config_signature(config)
+        schema_keys = self._schema_keys_cache.get(signature)
+        if schema_keys is None:
+            SCHEMA_CACHE_MISS.inc()
+            schema_keys = self._compute_schema_keys(config)
+            self._schema_keys_cache[signature] = schema_keys
+        else:
+            SCHEMA_CACHE_HIT.inc()
+        return schema_keys
+
+    def _compute_schema_keys(self, config):
         try:
             input_schema = self.graph.get_input_jsonschema(config)
             output_schema = self.graph.get_output_jsonschema(config)
@@ -411,16 +614,19 @@ class LangGraphAgent:
                 "context": [],
             }
         
-    def langgraph_default_merge_state(self, state: State, messages: List[BaseMessage], input: RunAgentInput) -> State:
-        
-        if messages and isinstance(messages[0], SystemMessage):
-            messages = messages[1:]
-
-        existing_messages = state.get("messages", [])
-        existing_message_ids = {msg.id for msg in existing_messages}
-
-        new_messages = [msg for msg in messages if msg.id not in existing_message_ids]
+    @staticmethod
+    def _select_new_messages(input: RunAgentInput, existing_messages: List[BaseMessage]):
+        """按 history_mode 从请求消息中选出要追加的部分（见 api/history.py）"""
+        forwarded_props = input.forwarded_props or {}
+        return select_new_messages(
+            input.messages or [],
+            existing_messages,
+            forwarded_props.get("history_mode"),
+            forwarded_props.get("last_message_id"),
+        )
 
+    def langgraph_default_merge_state(self, state: State, messages: List[BaseMessage], input: RunAgentInput) -> State:
+        # messages 已由 _select_new_messages 去掉首条 system 消息并按检查点去重
         tools = input.tools or []
         tools_as_dicts = []
         if tools:
@@ -448,7 +654,7 @@ class LangGraphAgent:
         
         return {
             **state,
-            "messages": new_messages,
+            "messages": messages,
             "tools": unique_tools,
         }
     def get_stream_kwargs(
@@ -459,16 +665,19 @@ class LangGraphAgent:
             config: Optional[RunnableConfig] = None,
             context: Optional[Dict[str, Any]] = None,
             fork: Optional[Any] = None,
+            exclude_types: Optional[List[str]] = None,
     ):
         kwargs = dict(
             input=input,
             subgraphs=subgraphs,
             version=version,
         )
+        # 客户端不需要的运行类型不产生事件（见 api/event_filter.py）
+        if exclude_types:
+            kwargs['exclude_types'] = exclude_types
 
         # Only add context if supported
-        sig = inspect.signature(self.graph.astream_events)
-        if 'context' in sig.parameters:
+        if self._accepts_context():
             base_context = {}
             if isinstance(config, dict) and 'configurable' in config and isinstance(config['configurable'], dict):
                 base_context.update(config['configurable'])
@@ -484,3 +693,10 @@ class LangGraphAgent:
             kwargs.update(fork)
 
         return kwargs
+
+    def _accepts_context(self) -> bool:
+        """astream_events 是否支持 context 参数（结果缓存）"""
+        if self._stream_accepts_context is None:
+            sig = inspect.signature(self.graph.astream_events)
+            self._stream_accepts_context = 'context' in sig.parameters
+        return self._stream_accepts_context
@@ -0,0 +1,206 @@
+"""
+多图注册表：按 langgraph.json 中声明的 graphs 为每个图挂载一组路由（POST /{name}、/{name}/runs/...、/{name}/health）
+
+- 图在第一次被请求时才导入模块并构建 LangGraphAgent，只部署 web_agent 时不会导入编排 agent 及其模型 / 中间件
+- GRAPHS 环境变量（逗号分隔）选择要挂载的图，默认全部；DEFAULT_GRAPH 额外挂载到根路径 "/"，兼容原有客户端
+- GRAPH_WARM_UP=true 时在应用启动阶段预先加载全部已挂载的图
+- 同一个图的并发首次请求只加载一次；导入在线程中执行，不阻塞事件循环
+"""
+import asyncio
+import importlib
+import json
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI
+from langgraph.pregel import Pregel
+
+from agents.checkpointer import get_checkpointer
+from api.event_handler import LangGraphAgent
+from config.settings import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class GraphLoadError(Exception):
+    def __init__(self, name: str, message: str):
+        super().__init__(f"Graph '{name}' failed to load: {message}")
+        self.name = name
+
+
+@dataclass(frozen=True)
+class GraphSpec:
+    """langgraph.json 中的一项，如 "./agents/agent.py:agent" -> module="agents.agent", attr="agent" """
+    name: str
+    module: str
+    attr: str
+
+
+def parse_graph_ref(name: str, ref: str, base_dir: Path) -> GraphSpec:
+    path, sep, attr = ref.rpartition(":")
+    if not sep or not path or not attr:
+        raise ValueError(f"Invalid graph reference for '{name}': {ref!r}, expected 'path/to/file.py:variable'")
+    if path.endswith(".py"):
+        # 文件路径转换为相对 base_dir 的模块名，保证和其他地方 import 的是同一个模块对象
+        file_path = (base_dir / path).resolve()
+        try:
+            relative = file_path.relative_to(base_dir.resolve())
+        except ValueError:
+            raise ValueError(f"Graph '{name}' must live under {base_dir}: {ref!r}")
+        module = ".".join(relative.with_suffix("").parts)
+    else:
+        module = path
+    return GraphSpec(name=name, module=module, attr=attr)
+
+
+def load_langgraph_config(config_path: Path) -> Dict[str, Any]:
+    with open(config_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class LazyGraphAgent:
+    """路由持有的占位对象，第一次 get() 时才真正加载图"""
+
+    def __init__(self, registry: "GraphRegistry", name: str):
+        self.registry = registry
+        self.name = name
+
+    @property
+    def loaded(self) -> bool:
+        return self.name in self.registry._agents
+
+    async def get(self) -> LangGraphAgent:
+        return await self.registry.get_agent(self.name)
+
+
+class GraphRegistry:
+    def __init__(
+        self,
+        config_path: Path = settings.LANGGRAPH_CONFIG,
+        enabled: Optional[List[str]] = None,
+    ):
+        self.config_path = Path(config_path)
+        self.base_dir = self.config_path.parent
+        config = load_langgraph_config(self.config_path)
+
+        self.specs: Dict[str, GraphSpec] = {
+            name: parse_graph_ref(name, ref, self.base_dir)
+            for name, ref in (config.get("graphs") or {}).items()
+        }
+        enabled = enabled if enabled is not None else settings.GRAPHS
+        unknown = [name for name in enabled if name not in self.specs]
+        if unknown:
+            raise ValueError(f"Unknown graphs in GRAPHS: {unknown}, available: {list(self.specs)}")
+        self.enabled: List[str] = list(enabled) or list(self.specs)
+
+        self._env_file = config.get("env") if isinstance(config.get("env"), str) else None
+        self._dependencies = [str((self.base_dir / dep).resolve()) for dep in config.get("dependencies") or []]
+        self._agents: Dict[str, LangGraphAgent] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        self._prepared = False
+
+    def lazy_agent(self, name: str) -> LazyGraphAgent:
+        return LazyGraphAgent(self, name)
+
+    async def get_agent(self, name: str) -> LangGraphAgent:
+        agent = self._agents.get(name)
+        if agent is not None:
+            return agent
+        if name not in self.enabled:
+            raise GraphLoadError(name, "graph is not enabled")
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            agent = self._agents.get(name)
+            if agent is None:
+                agent = await asyncio.to_thread(self._load, name)
+                self._agents[name] = agent
+        return agent
+
+    async def warm_up(self, names: Optional[List[str]] = None) -> None:
+        """预先加载图；失败只记录日志，首个请求时会再次尝试"""
+        for name in names or self.enabled:
+            try:
+                await self.get_agent(name)
+            except GraphLoadError as e:
+                logger.error(f"[GraphRegistry] warm-up skipped {name}: {e}")
+
+    def mount(self, app: FastAPI, default: Optional[str] = settings.DEFAULT_GRAPH) -> None:
+        """为每个启用的图挂载 /{name} 路由，默认图额外挂载到根路径"""
+        from api.endpoint import add_langgraph_fastapi_endpoint
+
+        for name in self.enabled:
+            add_langgraph_fastapi_endpoint(app, self.lazy_agent(name), path=f"/{name}")
+        if default and default in self.enabled:
+            add_langgraph_fastapi_endpoint(app, self.lazy_agent(default), path="/")
+
+        @app.get("/graphs")
+        def list_graphs():
+            """列出已挂载的图及其加载状态"""
+            return {"default": default if default in self.enabled else None, "graphs": self.stats()}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "loaded": name in self._agents,
+                "load_seconds": round(self._load_seconds[name], 3) if name in self._load_seconds else None,
+                "error": self._errors.get(name),
+            }
+            for name in self.enabled
+        }
+
+    def _prepare(self) -> None:
+        # 与 langgraph dev 一致：加载 env 文件，并把 dependencies 加入 sys.path
+        if self._prepared:
+            return
+        if self._env_file:
+            from dotenv import load_dotenv
+
+            load_dotenv(self.base_dir / self._env_file, override=True)
+        for dep in self._dependencies:
+            if dep not in sys.path:
+                sys.path.insert(0, dep)
+        self._prepared = True
+
+    def _load(self, name: str) -> LangGraphAgent:
+        spec = self.specs[name]
+        started = time.perf_counter()
+        try:
+            self._prepare()
+            graph = getattr(importlib.import_module(spec.module), spec.attr)
+            if not isinstance(graph, Pregel) and callable(graph):
+                # langgraph.json 也允许指向返回图的工厂函数
+                graph = graph()
+            if not isinstance(graph, Pregel):
+                raise TypeError(f"{spec.module}:{spec.attr} is {type(graph).__name__}, not a compiled graph")
+            if graph.checkpointer is None:
+                # 端点依赖 aget_state 读取线程状态；未自带 checkpointer 的图（如 web_agent）在副本上补一个
+                # 按 CHECKPOINTER_BACKEND 配置的存储，不修改被其他图作为子图引用的原对象
+                graph = graph.copy(update={"checkpointer": get_checkpointer()})
+            agent = LangGraphAgent(name=name, graph=graph)
+            agent.warm_up()
+        except Exception as e:
+            self._errors[name] = f"{type(e).__name__}: {e}"
+            logger.exception(f"[GraphRegistry] failed to load {name} from {spec.module}:{spec.attr}")
+            raise GraphLoadError(name, str(e)) from e
+
+        self._errors.pop(name, None)
+        self._load_seconds[name] = time.perf_counter() - started
+        logger.info(f"[GraphRegistry] loaded {name} from {spec.module}:{spec.attr} in {self._load_seconds[name]:.2f}s")
+        return agent
+
+
+_default_registry: Optional[GraphRegistry] = None
+
+
+def get_graph_registry() -> GraphRegistry:
+    """进程级默认注册表，首次使用时读取 langgraph.json（不导入任何图）"""
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = GraphRegistry()
+    return _default_registry
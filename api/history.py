@@ -0,0 +1,123 @@
+"""
+服务端权威的消息历史：长会话只上传新增消息
+
+默认（full）模式下客户端每轮都上传完整的 AG-UI 历史，请求体大小、校验和转换开销都随会话长度线性增长。
+delta 模式下以检查点为准重建历史：
+
+- 客户端只发送本轮新增的消息，并通过 forwarded_props.last_message_id 给出它已确认的最后一条消息 ID
+  （上一轮 RUN_FINISHED 摘要中的 last_message.id，或最后一个 TEXT_MESSAGE_START 的 messageId；新线程不传）
+- last_message_id 必须与检查点中最后一条消息一致，否则说明客户端视图已过期（其他端继续了对话、检查点被回滚等），
+  运行以 RUN_ERROR(code=HISTORY_MISMATCH) 结束，客户端同步后重试，或改用 full 模式上传完整历史
+- 模式由请求头 X-AGUI-History 或 forwarded_props.history_mode 指定，默认 full
+
+full 模式保持原有语义，但只转换检查点中还没有的消息，已有的历史只做 ID 比对
+"""
+from typing import Any, List, Mapping, Optional
+
+from langchain_core.messages import BaseMessage
+
+from api.models.types import Message as AGUIMessage
+
+HISTORY_MODE_FULL = "full"
+HISTORY_MODE_DELTA = "delta"
+HISTORY_MODE_HEADER = "x-agui-history"
+HISTORY_MISMATCH = "HISTORY_MISMATCH"
+
+
+def resolve_history_mode(forwarded_props: Optional[Mapping[str, Any]], headers: Optional[Mapping[str, str]] = None) -> str:
+    """请求头 X-AGUI-History 优先，其次 forwarded_props.history_mode，默认 full"""
+    mode = None
+    if headers is not None:
+        mode = headers.get(HISTORY_MODE_HEADER)
+    if not mode and forwarded_props:
+        mode = forwarded_props.get("history_mode")
+    if isinstance(mode, str) and mode.strip().lower() == HISTORY_MODE_DELTA:
+        return HISTORY_MODE_DELTA
+    return HISTORY_MODE_FULL
+
+
+class HistoryMismatch(Exception):
+    def __init__(self, last_message_id: Optional[str], server_last_message_id: Optional[str]):
+        super().__init__(
+            f"Client history is out of sync: last_message_id={last_message_id!r}, "
+            f"server last message is {server_last_message_id!r}"
+        )
+        self.last_message_id = last_message_id
+        self.server_last_message_id = server_last_message_id
+
+
+def select_new_messages(
+    messages: List[AGUIMessage],
+    existing: List[BaseMessage],
+    history_mode: Optional[str] = HISTORY_MODE_FULL,
+    last_message_id: Optional[str] = None,
+) -> List[AGUIMessage]:
+    """
+    从请求消息中挑出需要追加到检查点的部分（转换为 LangChain 消息之前调用）。
+    与原有合并逻辑一致：首条 system 消息由图自身负责，不写入状态
+    """
+    if messages and messages[0].role == "system":
+        messages = messages[1:]
+
+    if history_mode == HISTORY_MODE_DELTA:
+        # 只比对最后一条消息，不遍历历史
+        server_last_id = existing[-1].id if existing else None
+        if (last_message_id or None) != server_last_id:
+            raise HistoryMismatch(last_message_id, server_last_id)
+        return list(messages)
+
+    if not existing:
+        return list(messages)
+    existing_ids = {message.id for message in existing}
+    return [message for message in messages if message.id not in existing_ids]
+
+
+if __name__ == "__main__":
+    # 基准：线程增长到 N 轮时，每轮请求的 JSON 大小与 解析 + 校验 + 转换 耗时（full vs delta）
+    import json
+    import time
+    import uuid
+
+    from api.models.types import RunAgentInput
+    from api.utils import agui_messages_to_langchain
+
+    def turn(i: int):
+        return [
+            {"id": str(uuid.uuid4()), "role": "user", "content": f"第 {i} 个问题：帮我查一下长沙明天的天气和出行建议"},
+            {"id": str(uuid.uuid4()), "role": "assistant", "content": "长沙明天多云转小雨，气温 18-24℃，建议带伞。" * 8},
+        ]
+
+    history: List[dict] = []
+    checkpoint: List[BaseMessage] = []
+    for turns in range(1, 201):
+        new_messages = turn(turns)
+        for mode in (HISTORY_MODE_FULL, HISTORY_MODE_DELTA):
+            body = {
+                "threadId": "t", "runId": str(turns), "state": {}, "tools": [], "context": [],
+                "messages": history + new_messages[:1] if mode == HISTORY_MODE_FULL else new_messages[:1],
+                "forwardedProps": {
+                    "history_mode": mode,
+                    "last_message_id": checkpoint[-1].id if checkpoint else None,
+                },
+            }
+            raw = json.dumps(body, ensure_ascii=False).encode()
+            t0 = time.perf_counter()
+            input_data = RunAgentInput.model_validate_json(raw)
+            props = input_data.forwarded_props
+            selected = select_new_messages(input_data.messages, checkpoint, props["history_mode"], props["last_message_id"])
+            converted = agui_messages_to_langchain(selected)
+            elapsed = (time.perf_counter() - t0) * 1000
+            assert len(converted) == 1
+            if turns in (1, 50, 200):
+                print(f"turn {turns:3d} {mode:5s}: request {len(raw) / 1024:6.1f} KiB, parse+select+convert {elapsed:6.2f} ms")
+        # 本轮结束：检查点写入用户消息和回复，客户端历史同步增长
+        history += new_messages
+        checkpoint += agui_messages_to_langchain(RunAgentInput.model_validate({
+            "threadId": "t", "runId": "x", "state": {}, "tools": [], "context": [], "forwardedProps": {},
+            "messages": new_messages,
+        }).messages)
+
+    try:
+        select_new_messages([], checkpoint, HISTORY_MODE_DELTA, history[-3]["id"])
+    except HistoryMismatch as e:
+        print(f"stale client rejected: {e}")
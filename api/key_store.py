@@ -0,0 +1,270 @@
+"""
+API key 校验：
+
+- 本地 SQLite 存储，只保存 HMAC-SHA256(pepper, key) 的摘要，不落盘明文 key
+- CachedApiKeyVerifier 在进程内按摘要缓存校验结果（TTL + LRU），无效 key 也做短时负缓存；
+  同一个 key 的并发未命中只查一次库
+- 校验器是可插拔的：任何实现了 `async verify(api_key) -> Optional[ApiKeyIdentity]` 的对象都可以
+  传给 AuthMiddleware
+
+命令行：
+    python -m api.key_store add <user_id> [--type api_user] [--label xxx]
+    python -m api.key_store revoke <api_key>
+    python -m api.key_store list [user_id]
+    python -m api.key_store bench
+"""
+import asyncio
+import hashlib
+import hmac
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Protocol, Tuple
+
+from config.settings import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+API_KEY_PREFIX = "sk-"
+
+
+@dataclass(frozen=True)
+class ApiKeyIdentity:
+    user_id: str
+    user_type: str = "api_user"
+    key_id: str = ""
+
+
+class ApiKeyVerifier(Protocol):
+    async def verify(self, api_key: str) -> Optional[ApiKeyIdentity]:
+        ...
+
+
+def hash_api_key(api_key: str, pepper: str = settings.API_KEY_PEPPER) -> str:
+    return hmac.new(pepper.encode(), api_key.encode(), hashlib.sha256).hexdigest()
+
+
+class SqliteKeyStore:
+    """只保存 key 摘要的本地 key 库；sqlite3 是同步接口，异步场景下通过线程调用"""
+
+    def __init__(self, path: str = settings.API_KEY_STORE_PATH, pepper: str = settings.API_KEY_PEPPER):
+        self.path = path
+        self.pepper = pepper
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程共享，每个线程各用一个
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connection()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS api_keys (
+                key_hash TEXT PRIMARY KEY,
+                key_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                user_type TEXT NOT NULL DEFAULT 'api_user',
+                label TEXT,
+                created_at REAL NOT NULL,
+                revoked_at REAL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_user ON api_keys (user_id)")
+        conn.commit()
+
+    def add_key(self, user_id: str, user_type: str = "api_user", label: Optional[str] = None) -> str:
+        """生成并登记一个新 key，返回明文（只在此时可见）"""
+        api_key = API_KEY_PREFIX + secrets.token_urlsafe(32)
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO api_keys (key_hash, key_id, user_id, user_type, label, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (hash_api_key(api_key, self.pepper), api_key[:10], user_id, user_type, label, time.time()),
+        )
+        conn.commit()
+        return api_key
+
+    def revoke(self, api_key: str) -> bool:
+        conn = self._connection()
+        cursor = conn.execute(
+            "UPDATE api_keys SET revoked_at = ? WHERE key_hash = ? AND revoked_at IS NULL",
+            (time.time(), hash_api_key(api_key, self.pepper)),
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+
+    def lookup(self, key_hash: str) -> Optional[ApiKeyIdentity]:
+        row = self._connection().execute(
+            "SELECT user_id, user_type, key_id FROM api_keys WHERE key_hash = ? AND revoked_at IS NULL",
+            (key_hash,),
+        ).fetchone()
+        if row is None:
+            return None
+        return ApiKeyIdentity(user_id=row[0], user_type=row[1], key_id=row[2])
+
+    def list_keys(self, user_id: Optional[str] = None) -> List[Dict]:
+        query = "SELECT key_id, user_id, user_type, label, created_at, revoked_at FROM api_keys"
+        params: Tuple = ()
+        if user_id:
+            query += " WHERE user_id = ?"
+            params = (user_id,)
+        columns = ("key_id", "user_id", "user_type", "label", "created_at", "revoked_at")
+        return [dict(zip(columns, row)) for row in self._connection().execute(query, params)]
+
+
+class CachedApiKeyVerifier:
+    def __init__(
+        self,
+        store: SqliteKeyStore,
+        ttl: float = settings.API_KEY_CACHE_TTL,
+        negative_ttl: float = settings.API_KEY_NEGATIVE_CACHE_TTL,
+        maxsize: int = settings.API_KEY_CACHE_SIZE,
+    ):
+        self.store = store
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = max(1, maxsize)
+        # key 摘要 -> (过期时间, 身份或 None)；缓存里同样不出现明文 key
+        self._cache: "OrderedDict[str, Tuple[float, Optional[ApiKeyIdentity]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def verify(self, api_key: str) -> Optional[ApiKeyIdentity]:
+        key_hash = hash_api_key(api_key, self.store.pepper)
+        cached = self._cache.get(key_hash)
+        if cached is not None and cached[0] > time.monotonic():
+            self._cache.move_to_end(key_hash)
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        while True:
+            inflight = self._inflight.get(key_hash)
+            if inflight is None:
+                return await self._lookup(key_hash)
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # 发起查询的请求被取消（如客户端断开）时 future 随之取消：自己没有被取消就重新查询
+                if inflight.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+    async def _lookup(self, key_hash: str) -> Optional[ApiKeyIdentity]:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key_hash] = future
+        try:
+            identity = await asyncio.to_thread(self.store.lookup, key_hash)
+        except asyncio.CancelledError:
+            # 取消只属于当前请求，不传给等待同一查询的其他请求
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 已由当前调用方处理，避免 "never retrieved" 警告
+            raise
+        else:
+            future.set_result(identity)
+            self._remember(key_hash, identity)
+            return identity
+        finally:
+            self._inflight.pop(key_hash, None)
+
+    def invalidate(self, api_key: Optional[str] = None) -> None:
+        """吊销 key 后调用，立即让缓存失效（不传则清空全部缓存）"""
+        if api_key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(hash_api_key(api_key, self.store.pepper), None)
+
+    def stats(self) -> Dict:
+        return {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+    def _remember(self, key_hash: str, identity: Optional[ApiKeyIdentity]) -> None:
+        ttl = self.ttl if identity is not None else self.negative_ttl
+        self._cache[key_hash] = (time.monotonic() + ttl, identity)
+        self._cache.move_to_end(key_hash)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+
+_default_verifier: Optional[CachedApiKeyVerifier] = None
+
+
+def get_api_key_verifier() -> CachedApiKeyVerifier:
+    """进程级默认校验器，首次使用时才打开 key 库"""
+    global _default_verifier
+    if _default_verifier is None:
+        _default_verifier = CachedApiKeyVerifier(SqliteKeyStore())
+    return _default_verifier
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="管理本地 API key 库")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add_parser = sub.add_parser("add", help="为用户生成新 key")
+    add_parser.add_argument("user_id")
+    add_parser.add_argument("--type", default="api_user")
+    add_parser.add_argument("--label")
+    revoke_parser = sub.add_parser("revoke", help="吊销 key")
+    revoke_parser.add_argument("api_key")
+    list_parser = sub.add_parser("list", help="列出 key（只显示前缀）")
+    list_parser.add_argument("user_id", nargs="?")
+    sub.add_parser("bench", help="基准测试：缓存命中 / 未命中 / 无效 key 的校验耗时")
+    args = parser.parse_args()
+
+    if args.command == "add":
+        print(SqliteKeyStore().add_key(args.user_id, args.type, args.label))
+    elif args.command == "revoke":
+        print("revoked" if SqliteKeyStore().revoke(args.api_key) else "not found")
+    elif args.command == "list":
+        for row in SqliteKeyStore().list_keys(args.user_id):
+            print(row)
+    elif args.command == "bench":
+        import tempfile
+
+        async def bench():
+            N = 20_000
+            with tempfile.TemporaryDirectory() as tmp:
+                store = SqliteKeyStore(str(Path(tmp) / "keys.db"), pepper="bench")
+                keys = [store.add_key(f"user-{i}") for i in range(1000)]
+                verifier = CachedApiKeyVerifier(store)
+
+                t0 = time.perf_counter()
+                for key in keys:
+                    assert (await verifier.verify(key)) is not None
+                miss_us = (time.perf_counter() - t0) / len(keys) * 1e6
+
+                t0 = time.perf_counter()
+                for i in range(N):
+                    await verifier.verify(keys[i % len(keys)])
+                hit_us = (time.perf_counter() - t0) / N * 1e6
+
+                bad = API_KEY_PREFIX + "not-a-real-key"
+                assert (await verifier.verify(bad)) is None
+                t0 = time.perf_counter()
+                for _ in range(N):
+                    await verifier.verify(bad)
+                negative_us = (time.perf_counter() - t0) / N * 1e6
+
+                print(f"cache miss (sqlite lookup): {miss_us:.1f} us/verify")
+                print(f"cache hit:                  {hit_us:.2f} us/verify")
+                print(f"negative cache hit:         {negative_us:.2f} us/verify")
+                print(verifier.stats())
+
+        asyncio.run(bench())
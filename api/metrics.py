@@ -0,0 +1,273 @@
+"""
+Agent 运行指标（Prometheus），由 create_app 挂载的 /metrics 导出
+
+推送型指标（在事件路径上记录，每次只是一次字典查找和几次加法）：
+- 运行：agent_runs_total{graph,status}、运行时长、首 token 时间（TTFT），在 LangGraphAgent._handle_stream_events 中记录
+- 模型调用：时长、token 用量（含 prompt 缓存读写）、错误数；工具：时长、错误数。
+  由每个运行挂到 config["callbacks"] 的 MetricsCallbackHandler 记录，子 agent 内部的调用也会计入，
+  且不依赖 astream_events：事件过滤排除 chat_model / tool 运行时指标照样完整
+- 传输：SSE / WebSocket 下发的事件帧数与字节数、单个流的总字节数
+- 缓存：agent_cache_requests_total{cache,result}，与 API key 缓存一起可算命中率
+
+拉取型指标：调度器、运行登记表、过载状态、检查点连接池、浏览器池等已有 stats() 的组件在抓取时读取，不改动它们的热路径
+"""
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import ToolMessage
+
+from agents.checkpointer import checkpointer_manager
+from api import key_store
+from api.middleware.sse_compression import sse_compression_stats
+from api.overload import overload_controller
+from api.run_registry import run_registry
+from api.scheduler import run_scheduler
+from api.streaming import stream_stats
+from memory.memos_client import memos_stats
+from utils.metrics import MetricFamily, registry
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+RUN_STATUS_FINISHED = "finished"
+RUN_STATUS_ERROR = "error"
+RUN_STATUS_CANCELLED = "cancelled"
+
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 20.0, 60.0)
+STREAM_BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+RUNS = registry.counter("agent_runs_total", "Agent runs by final status.", ("graph", "status"))
+RUN_DURATION = registry.histogram("agent_run_duration_seconds", "Wall time of agent runs.", ("graph",))
+RUN_TTFT = registry.histogram(
+    "agent_run_ttft_seconds", "Time from run start to the first streamed text token.", ("graph",), TTFT_BUCKETS
+)
+
+LLM_DURATION = registry.histogram("agent_llm_call_duration_seconds", "Latency of chat model calls.", ("graph", "model"))
+LLM_TOKENS = registry.counter(
+    "agent_llm_tokens_total",
+    "Tokens used by chat model calls (kind: input, output, cache_read, cache_creation).",
+    ("graph", "model", "kind"),
+)
+LLM_ERRORS = registry.counter("agent_llm_errors_total", "Failed chat model calls.", ("graph", "model"))
+
+TOOL_DURATION = registry.histogram("agent_tool_duration_seconds", "Latency of tool calls.", ("graph", "tool"))
+TOOL_ERRORS = registry.counter(
+    "agent_tool_errors_total", "Tool calls that raised or returned an error ToolMessage.", ("graph", "tool")
+)
+
+STREAM_FRAMES = registry.counter("agent_stream_frames_total", "Event frames written to clients.", ("transport",))
+STREAM_BYTES = registry.counter("agent_stream_bytes_total", "Bytes of event frames written to clients (before compression).", ("transport",))
+STREAM_SIZE = registry.histogram(
+    "agent_stream_size_bytes", "Total bytes written per event stream.", ("transport",), STREAM_BYTES_BUCKETS
+)
+
+CACHE_REQUESTS = registry.counter("agent_cache_requests_total", "In-process cache lookups.", ("cache", "result"))
+SCHEMA_CACHE_HIT = CACHE_REQUESTS.labels("schema_keys", "hit")
+SCHEMA_CACHE_MISS = CACHE_REQUESTS.labels("schema_keys", "miss")
+
+# usage_metadata.input_token_details 中的 prompt 缓存字段 -> kind 标签
+_CACHE_TOKEN_KINDS = (("cache_read", "cache_read"), ("cache_creation", "cache_creation"))
+
+
+def stream_counters(transport: str) -> Tuple[Any, Any]:
+    """预先取出某个传输方式的 (帧数, 字节数) 子指标，流内逐帧记录时免去标签查找"""
+    return STREAM_FRAMES.labels(transport), STREAM_BYTES.labels(transport)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    每个运行一个实例，按 LangChain run_id 配对 start / end 计时。
+    run_inline：在事件循环中同步执行，不为每次回调调度到线程池
+    """
+
+    run_inline = True
+
+    def __init__(self, graph: str):
+        self.graph = graph
+        self._llm_calls: Dict[UUID, Tuple[float, str]] = {}
+        self._tool_calls: Dict[UUID, Tuple[float, str]] = {}
+
+    def _start_llm(self, run_id: UUID, serialized: Optional[Dict[str, Any]], metadata: Optional[Dict[str, Any]], kwargs) -> None:
+        model = (metadata or {}).get("ls_model_name") or (kwargs.get("invocation_params") or {}).get("model") \
+            or (serialized or {}).get("name") or "unknown"
+        self._llm_calls[run_id] = (time.perf_counter(), str(model))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs: Any) -> None:
+        self._start_llm(run_id, serialized, metadata, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, metadata=None, **kwargs: Any) -> None:
+        self._start_llm(run_id, serialized, metadata, kwargs)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._llm_calls.pop(run_id, None)
+        if started is None:
+            return
+        LLM_DURATION.labels(self.graph, started[1]).observe(time.perf_counter() - started[0])
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self._record_usage(started[1], usage)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._llm_calls.pop(run_id, None)
+        if started is not None:
+            LLM_DURATION.labels(self.graph, started[1]).observe(time.perf_counter() - started[0])
+            LLM_ERRORS.labels(self.graph, started[1]).inc()
+
+    def _record_usage(self, model: str, usage: Dict[str, Any]) -> None:
+        LLM_TOKENS.labels(self.graph, model, "input").inc(usage.get("input_tokens") or 0)
+        LLM_TOKENS.labels(self.graph, model, "output").inc(usage.get("output_tokens") or 0)
+        details = usage.get("input_token_details") or {}
+        for key, kind in _CACHE_TOKEN_KINDS:
+            if details.get(key):
+                LLM_TOKENS.labels(self.graph, model, kind).inc(details[key])
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs: Any) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("name") or "unknown"
+        self._tool_calls[run_id] = (time.perf_counter(), str(name))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._tool_calls.pop(run_id, None)
+        if started is None:
+            return
+        TOOL_DURATION.labels(self.graph, started[1]).observe(time.perf_counter() - started[0])
+        # ToolNode 捕获异常后以 status="error" 的 ToolMessage 返回给模型，同样计为错误
+        if isinstance(output, ToolMessage) and output.status == "error":
+            TOOL_ERRORS.labels(self.graph, started[1]).inc()
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._tool_calls.pop(run_id, None)
+        if started is not None:
+            TOOL_DURATION.labels(self.graph, started[1]).observe(time.perf_counter() - started[0])
+            TOOL_ERRORS.labels(self.graph, started[1]).inc()
+
+
+def _component_families() -> Iterable[MetricFamily]:
+    """抓取时读取各组件的 stats()，不在它们的热路径上额外计数"""
+    scheduler = run_scheduler.stats()
+    yield "agent_scheduler_busy_workers", "gauge", "Runs currently holding a scheduler worker.", [({}, scheduler["busy"])]
+    yield "agent_scheduler_queued_runs", "gauge", "Runs waiting for a scheduler worker.", [
+        ({"priority": priority}, size) for priority, size in scheduler["queued"].items()
+    ]
+    yield "agent_scheduler_rejected_total", "counter", "Runs rejected because the scheduler queue was full.", [
+        ({"priority": priority}, count) for priority, count in scheduler["rejected"].items()
+    ]
+
+    runs = run_registry.stats()
+    yield "agent_registry_runs", "gauge", "Runs retained by the run registry.", [
+        ({"state": state}, runs[state]) for state in ("queued", "running", "retained")
+    ]
+
+    overload = overload_controller.stats()
+    yield "agent_event_loop_lag_seconds", "gauge", "Sampled event loop lag.", [({}, overload["loop_lag_ms"] / 1000)]
+    yield "agent_inflight_runs", "gauge", "Runs executing or queued in the scheduler on this worker.", [({}, overload["inflight_runs"])]
+
+    yield "agent_streams_active", "gauge", "Open event streams.", [({}, stream_stats.active)]
+    yield "agent_streams_cancelled_total", "counter", "Event streams cancelled, by reason.", [
+        ({"reason": reason}, count) for reason, count in stream_stats.cancelled.items()
+    ]
+    yield "agent_sse_compression_bytes_total", "counter", "SSE bytes before (in) and after (out) gzip.", [
+        ({"direction": "in"}, sse_compression_stats.bytes_in),
+        ({"direction": "out"}, sse_compression_stats.bytes_out),
+    ]
+
+    verifier = key_store._default_verifier
+    if verifier is not None:
+        yield CACHE_REQUESTS.name, "counter", CACHE_REQUESTS.documentation, [
+            ({"cache": "api_key", "result": "hit"}, verifier.hits),
+            ({"cache": "api_key", "result": "miss"}, verifier.misses),
+        ]
+
+    checkpointer_stats = checkpointer_manager.stats()
+    retention = checkpointer_stats["retention"]
+    yield "agent_checkpoints_pruned_total", "counter", "Old checkpoints deleted by retention pruning.", [
+        ({}, retention["pruned_checkpoints"])
+    ]
+    yield "agent_checkpoint_prune_failures_total", "counter", "Failed checkpoint pruning passes.", [
+        ({}, retention["failures"])
+    ]
+    checkpointer_pool = checkpointer_stats.get("pool")
+    if checkpointer_pool is not None:
+        yield "agent_checkpointer_pool_connections", "gauge", "Checkpointer pool connections (size, available).", [
+            ({"state": "size"}, checkpointer_pool["size"]),
+            ({"state": "available"}, checkpointer_pool["available"]),
+        ]
+        yield "agent_checkpointer_pool_waiting", "gauge", "Requests waiting for a checkpointer connection.", [
+            ({}, checkpointer_pool["waiting"])
+        ]
+
+    memos = memos_stats.snapshot()
+    yield "agent_memos_requests_total", "counter", "Requests sent to MemOS.", [({}, memos["requests"])]
+    yield "agent_memos_failures_total", "counter", "Failed MemOS requests.", [({}, memos["failures"])]
+
+    try:
+        # 浏览器池依赖 crawl4ai，抓取时才导入，event_handler 引入本模块时不会带上浏览器依赖
+        from agents.web_agent.tools.browser_pool import browser_pool
+    except ImportError:
+        return
+    pool = browser_pool.stats()
+    yield "agent_browser_pages", "gauge", "Browser pages leased (active) and the pool capacity.", [
+        ({"state": "active"}, pool["active_pages"]),
+        ({"state": "capacity"}, pool["capacity"]),
+    ]
+    yield "agent_browser_waiting", "gauge", "Requests waiting for a browser page.", [({}, pool["waiting"])]
+
+
+registry.register_collector(_component_families)
+
+
+def render_metrics() -> str:
+    return registry.render()
+
+
+if __name__ == "__main__":
+    # 基准：热路径上每次记录的开销
+    from utils.metrics import MetricsRegistry
+
+    bench = MetricsRegistry()
+    counter = bench.counter("bench_total", "bench", ("graph", "status"))
+    histogram = bench.histogram("bench_seconds", "bench", ("graph",))
+    frames, frame_bytes = stream_counters("sse")
+    n = 1_000_000
+
+    def timed(label, fn):
+        t0 = time.perf_counter()
+        fn()
+        print(f"{label:40s}: {(time.perf_counter() - t0) / n * 1e9:6.0f} ns/op")
+
+    def counter_labels():
+        for _ in range(n):
+            counter.labels("bench", "finished").inc()
+
+    def histogram_labels():
+        for i in range(n):
+            histogram.labels("bench").observe(i * 1e-6)
+
+    def prebound_frame():
+        for _ in range(n):
+            frames.inc()
+            frame_bytes.inc(180)
+
+    timed("counter.labels(...).inc()", counter_labels)
+    timed("histogram.labels(...).observe()", histogram_labels)
+    timed("prebound SSE frame (frames + bytes)", prebound_frame)
+
+    handler = MetricsCallbackHandler("bench")
+    from uuid import uuid4
+
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, LLMResult
+
+    result = LLMResult(generations=[[ChatGeneration(message=AIMessage(
+        content="ok", usage_metadata={"input_tokens": 1200, "output_tokens": 80, "total_tokens": 1280,
+                                      "input_token_details": {"cache_read": 1024}},
+    ))]])
+    run_ids = [uuid4() for _ in range(100_000)]
+    t0 = time.perf_counter()
+    for run_id in run_ids:
+        handler.on_chat_model_start({}, [], run_id=run_id, metadata={"ls_model_name": "qwen-plus"})
+        handler.on_llm_end(result, run_id=run_id)
+    print(f"{'chat model start + end (with usage)':40s}: {(time.perf_counter() - t0) / len(run_ids) * 1e9:6.0f} ns/call")
+    print(render_metrics()[:1200])
@@ -1,70 +1,118 @@
 """
 认证中间件，用于验证API key并提取用户信息
+
+纯 ASGI 实现：只读取请求头，请求体和响应流原样透传，
+不像 BaseHTTPMiddleware 那样为每个请求额外创建任务和内存流
 """
 
-from fastapi import Request, Response, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi.security import HTTPBearer
-from typing import Optional
+from typing import Optional, Set
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
 
+from api.key_store import ApiKeyVerifier, get_api_key_verifier
 from config.settings import settings
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
-# 使用HTTP Bearer认证
-security = HTTPBearer(auto_error=False)
+# 不要求 API key 的路径（负载均衡 / 探活 / 指标抓取使用）：挂载探针路由时按完整路径登记，
+# 只做精确匹配，/agent/runs/health 这类数据路由不会因为后缀相同而跳过认证
+PUBLIC_PATHS: Set[str] = set()
+
+
+def register_public_path(path: str) -> None:
+    PUBLIC_PATHS.add(path)
+
 
-class AuthMiddleware(BaseHTTPMiddleware):
+def get_header(scope: Scope, name: bytes) -> Optional[str]:
+    """从 ASGI scope 中读取请求头（name 需为小写 bytes）"""
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class AuthMiddleware:
     """
     认证中间件，验证API key并提取用户信息
+
+    - 携带 Bearer key：交给 verifier 校验（默认是带缓存的本地 key 库），通过后使用 key 绑定的用户
+    - 未携带或 key 无效：API_KEY_REQUIRED 时返回 401，否则按默认用户匿名访问
+    - 健康检查等公开路径不要求 key
     """
-    
-    async def dispatch(self, request: Request, call_next):
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        verifier: Optional[ApiKeyVerifier] = None,
+        required: bool = settings.API_KEY_REQUIRED,
+    ):
+        self.app = app
+        self.verifier = verifier
+        self.required = required
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
         # 尝试从请求头中获取API key
         user_id = None
         user_type = "anonymous"
-        
+        error = None
+
         try:
             # 获取Authorization头
-            authorization = request.headers.get("authorization")
+            authorization = get_header(scope, b"authorization")
+            identity = None
             if authorization and authorization.startswith("Bearer "):
-                # 提取API key（暂时不验证，直接使用默认值）
-                # TODO: 实现真实的API key验证逻辑
                 api_key = authorization[7:]  # 去掉"Bearer "前缀
-                
-                # 暂时返回默认user_id，后续可以实现真实的API key验证逻辑
-                user_id = settings.DEFAULT_USER_ID
-                user_type = "api_user"
-                
+                if self.verifier is None:
+                    self.verifier = get_api_key_verifier()
+                identity = await self.verifier.verify(api_key)
+                if identity is None:
+                    logger.warning("API key无效")
+                    error = "Invalid API key"
+
+            if identity is not None:
+                user_id = identity.user_id
+                user_type = identity.user_type
                 logger.debug(f"API key认证成功，user_id: {user_id}")
             else:
-                # 没有提供API key，使用默认值
+                # 没有提供（或提供了无效的）API key，使用默认值
                 user_id = settings.DEFAULT_USER_ID
                 user_type = "anonymous"
-                logger.debug("未提供API key，使用默认用户")
-                
+                error = error or "API key required"
+                logger.debug("未提供有效API key，使用默认用户")
+
+            if not self.required or identity is not None or scope["path"] in PUBLIC_PATHS:
+                error = None
+
         except Exception as e:
             logger.error(f"认证过程中发生错误: {e}")
-            # 认证失败，返回401错误
-            return Response(
-                content='{"error": "Authentication failed"}',
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                media_type="application/json"
-            )
-        
-        # 将用户信息存储在request.state中，供后续中间件和endpoint使用
-        request.state.user_id = user_id
-        request.state.user_type = user_type
-        
+            error = "Authentication failed"
+
+        if error:
+            # 认证失败，返回401错误（WebSocket 则以 1008 关闭）
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": 1008})
+                return
+            response = JSONResponse({"error": error}, status_code=401)
+            await response(scope, receive, send)
+            return
+
+        # 将用户信息存储在 scope["state"] 中（即 request.state），供后续中间件和endpoint使用
+        state = scope.setdefault("state", {})
+        state["user_id"] = user_id
+        state["user_type"] = user_type
+
         # 继续处理请求
-        response = await call_next(request)
-        
-        return response
+        await self.app(scope, receive, send)
 
 
 def setup_auth_middleware(app):
     """
     为FastAPI应用添加认证中间件的便捷函数
     """
-    app.add_middleware(AuthMiddleware)
\ No newline at end of file
+    app.add_middleware(AuthMiddleware)
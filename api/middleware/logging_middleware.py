@@ -1,65 +1,124 @@
 """
 FastAPI中间件，用于自动设置日志上下文中的API路径和组合trace_id
+
+纯 ASGI 实现，请求体原样透传给下游：
+- thread_id / run_id 优先取 X-Thread-Id / X-Run-Id 请求头
+- 否则只对请求体的前 LOG_BODY_SCAN_BYTES 字节做正则扫描（AG-UI 客户端把 threadId/runId 放在最前面），
+  扫描过的消息块会重放给下游，不解析、不缓存完整的对话历史
 """
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from utils.context import LogContext, set_log_context
-from utils.logger import get_logger
+import re
 import time
 import uuid
-import json
+from collections import deque
+from typing import Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from api.middleware.auth_middleware import get_header
+from config.settings import settings
+from utils.context import LogContext
+from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
-class LoggingContextMiddleware(BaseHTTPMiddleware):
+# 顶层 JSON 字段（支持驼峰、下划线和连字符格式）；(?<!\\) 排除转义在字符串内容里的同名字段
+_THREAD_ID_RE = re.compile(rb'(?<!\\)"(?:threadId|thread_id|thread-id)"\s*:\s*"([^"\\]{1,256})"')
+_RUN_ID_RE = re.compile(rb'(?<!\\)"(?:runId|run_id|run-id)"\s*:\s*"([^"\\]{1,256})"')
+
+
+async def scan_body_prefix(receive: Receive, limit: int) -> Tuple[Receive, bytes]:
+    """
+    读取请求体的前 limit 字节（最多多读一个消息块），返回可重放这些消息块的 receive 和读到的前缀
+    """
+    messages = deque()
+    parts = []
+    size = 0
+    while size < limit:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            break
+        body = message.get("body", b"")
+        parts.append(body)
+        size += len(body)
+        if not message.get("more_body", False):
+            break
+
+    async def replay_receive() -> Message:
+        if messages:
+            return messages.popleft()
+        return await receive()
+
+    return replay_receive, b"".join(parts)[:limit]
+
+
+def extract_ids(prefix: bytes) -> Tuple[Optional[str], Optional[str]]:
+    thread_match = _THREAD_ID_RE.search(prefix)
+    run_match = _RUN_ID_RE.search(prefix)
+    return (
+        thread_match.group(1).decode("utf-8", "replace") if thread_match else None,
+        run_match.group(1).decode("utf-8", "replace") if run_match else None,
+    )
+
+
+class LoggingContextMiddleware:
     """
     自动为每个请求设置日志上下文的中间件
     使用组合trace_id: thread_id-run_id
     """
-    async def dispatch(self, request: Request, call_next):
+
+    def __init__(self, app: ASGIApp, scan_limit: int = settings.LOG_BODY_SCAN_BYTES):
+        self.app = app
+        self.scan_limit = scan_limit
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         # 获取请求路径信息
-        api_path = f"{request.method} {request.url.path}"
-        
-        # 从request.state中获取用户信息（由AuthMiddleware设置）
-        user_id = getattr(request.state, 'user_id', None)
-        user_type = getattr(request.state, 'user_type', 'anonymous')
-        
-        # 对于POST请求，尝试从请求体中提取thread_id和run_id
+        api_path = f"{scope['method']} {scope['path']}"
+
+        # 从 scope["state"]（即 request.state）中获取用户信息（由AuthMiddleware设置）
+        state = scope.get("state") or {}
+        user_id = state.get("user_id")
+        user_type = state.get("user_type", "anonymous")
+
+        # 优先使用请求头；POST 请求再从请求体前缀中补全 thread_id 和 run_id
+        thread_id = get_header(scope, b"x-thread-id")
+        run_id = get_header(scope, b"x-run-id")
+        if scope["method"] == "POST" and not (thread_id and run_id) and self.scan_limit > 0:
+            receive, prefix = await scan_body_prefix(receive, self.scan_limit)
+            body_thread_id, body_run_id = extract_ids(prefix)
+            thread_id = thread_id or body_thread_id
+            run_id = run_id or body_run_id
+
         combined_trace_id = None
-        if request.method == "POST":
-            try:
-                # 读取请求体
-                body = await request.body()
-                if body:
-                    request_data = json.loads(body.decode())
-                    # 提取thread_id和run_id（支持驼峰和下划线格式）
-                    thread_id = (request_data.get("threadId") or
-                               request_data.get("thread_id") or
-                               request_data.get("thread-id"))
-                    run_id = (request_data.get("runId") or
-                             request_data.get("run_id") or
-                             request_data.get("run-id"))
-                   
-                    if thread_id and run_id:
-                        # 使用组合ID作为trace_id
-                        combined_trace_id = f"{thread_id}-{run_id}"
-                        logger.info(f"使用客户端提供的组合trace_id: {combined_trace_id}")
-                    elif thread_id:
-                        # 如果只有thread_id，使用thread_id作为trace_id
-                        combined_trace_id = thread_id
-                        logger.info(f"使用客户端提供的thread_id作为trace_id: {combined_trace_id}")
-                    else:
-                        logger.debug("请求中未找到thread_id或run_id")
-            except json.JSONDecodeError as e:
-                logger.debug(f"无法解析请求体JSON: {e}")
-            except Exception as e:
-                logger.debug(f"提取trace_id时发生错误: {e}")
-        
-        # 如果无法从请求体获取，则生成一个临时的trace_id
+        if thread_id and run_id:
+            # 使用组合ID作为trace_id
+            combined_trace_id = f"{thread_id}-{run_id}"
+            logger.info(f"使用客户端提供的组合trace_id: {combined_trace_id}")
+        elif thread_id:
+            # 如果只有thread_id，使用thread_id作为trace_id
+            combined_trace_id = thread_id
+            logger.info(f"使用客户端提供的thread_id作为trace_id: {combined_trace_id}")
+
+        # 如果无法从请求获取，则生成一个临时的trace_id
         if not combined_trace_id:
             combined_trace_id = str(uuid.uuid4())
             logger.warning(f"无法从请求获取会话ID，生成临时trace_id: {combined_trace_id}")
-        
+
+        trace_header = (b"x-trace-id", combined_trace_id.encode("latin-1", "replace"))
+        status_code = None
+
+        async def send_with_trace_id(message: Message):
+            nonlocal status_code
+            # 将trace_id添加到响应头中，方便前端跟踪
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", ()), trace_header]}
+            await send(message)
+
         # 使用LogContext上下文管理器设置日志上下文
         # 使用从AuthMiddleware获取的user_id和user_type
         with LogContext(
@@ -70,30 +129,103 @@ class LoggingContextMiddleware(BaseHTTPMiddleware):
             env="prod"  # 可以根据环境变量设置
         ):
             # 记录请求开始
-            start_time = time.time()
+            start_time = time.perf_counter()
             logger.info(f"请求开始: {api_path}")
-            
-            # 处理请求
-            response = await call_next(request)
-            
-            # 计算处理时间
-            process_time = time.time() - start_time
-            
-            # 记录请求完成
-            logger.info(
-                f"请求完成: {api_path} - "
-                f"状态码: {response.status_code} - "
-                f"处理时间: {process_time:.3f}s"
-            )
-            
-            # 将trace_id添加到响应头中，方便前端跟踪
-            response.headers["X-Trace-ID"] = combined_trace_id
-            
-            return response
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                # 记录请求完成（流式响应在最后一帧写出后才算完成）
+                process_time = time.perf_counter() - start_time
+                logger.info(
+                    f"请求完成: {api_path} - "
+                    f"状态码: {status_code} - "
+                    f"处理时间: {process_time:.3f}s"
+                )
 
 
 def setup_logging_middleware(app):
     """
     为FastAPI应用添加日志中间件的便捷函数
     """
-    app.add_middleware(LoggingContextMiddleware)
\ No newline at end of file
+    app.add_middleware(LoggingContextMiddleware)
+
+
+if __name__ == "__main__":
+    # 基准测试：不同长度的对话历史下，认证 + 日志中间件给每个请求带来的额外开销
+    import asyncio
+    import json
+
+    from loguru import logger as loguru_logger
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse
+
+    from api.middleware.auth_middleware import AuthMiddleware
+
+    loguru_logger.remove()  # 只测中间件本身，不计日志输出的 I/O
+    N_REQUESTS = 300
+    CHUNK = 65536
+
+    async def endpoint(scope: Scope, receive: Receive, send: Send):
+        request = Request(scope, receive)
+        body = await request.body()
+        await JSONResponse({"size": len(body), "user": request.state.user_id if "state" in scope else None})(scope, receive, send)
+
+    def build_body(n_messages: int) -> bytes:
+        return json.dumps({
+            "threadId": "thread-1",
+            "runId": "run-1",
+            "state": {},
+            "messages": [
+                {"id": f"m{i}", "role": "user" if i % 2 else "assistant", "content": "北京明天天气如何？" * 20}
+                for i in range(n_messages)
+            ],
+            "tools": [],
+            "context": [],
+            "forwardedProps": {},
+        }, ensure_ascii=False).encode()
+
+    async def call(app: ASGIApp, body: bytes):
+        chunks = [body[i:i + CHUNK] for i in range(0, len(body), CHUNK)] or [b""]
+        queue = deque(
+            {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+            for i, chunk in enumerate(chunks)
+        )
+        scope = {
+            "type": "http", "method": "POST", "path": "/", "headers": [(b"content-type", b"application/json")],
+            "query_string": b"", "http_version": "1.1", "scheme": "http", "server": ("t", 80), "client": ("c", 1),
+        }
+
+        async def receive():
+            return queue.popleft() if queue else {"type": "http.disconnect"}
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await app(scope, receive, send)
+        return sent
+
+    async def bench(app: ASGIApp, body: bytes) -> float:
+        await call(app, body)
+        t0 = time.perf_counter()
+        for _ in range(N_REQUESTS):
+            await call(app, body)
+        return (time.perf_counter() - t0) / N_REQUESTS * 1e6
+
+    async def main():
+        wrapped = LoggingContextMiddleware(AuthMiddleware(endpoint))
+        sent = await call(wrapped, build_body(3))
+        headers = dict(sent[0]["headers"])
+        assert headers[b"x-trace-id"] == b"thread-1-run-1", headers
+        for n_messages in (10, 500, 5000):
+            body = build_body(n_messages)
+            bare = await bench(endpoint, body)
+            with_middleware = await bench(wrapped, body)
+            print(
+                f"{n_messages:>5} messages ({len(body) / 1024:>7.0f} KiB): "
+                f"bare {bare:>8.1f} us, with middleware {with_middleware:>8.1f} us, "
+                f"overhead {with_middleware - bare:>7.1f} us/request"
+            )
+
+    asyncio.run(main())
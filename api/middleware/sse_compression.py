@@ -0,0 +1,182 @@
+"""
+text/event-stream 的流式压缩中间件（纯 ASGI）
+
+通用的 GZipMiddleware 会缓冲输出、攒够数据再压缩，会破坏逐事件的流式延迟（Starlette 默认也排除了 SSE）。
+这里整条流共用一个 gzip 压缩上下文，StreamingResponse 每写出一个事件帧就以 Z_SYNC_FLUSH 结束一个压缩块：
+客户端收到的每个块都能立即完整解压出对应的事件，同时后续事件可以引用前面出现过的内容
+（重复的字段名、工具结果里的长文本），大块的工具结果压缩效果最明显。
+
+- 只处理响应类型为 text/event-stream、且请求 Accept-Encoding 接受 gzip 的请求
+- 需要通过 SSE_COMPRESSION_ENABLED 开启
+"""
+import zlib
+from typing import Dict, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from api.middleware.auth_middleware import get_header
+from config.settings import settings
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """解析 Accept-Encoding（支持 q 值，gzip;q=0 表示不接受）"""
+    if not accept_encoding:
+        return False
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() not in ("gzip", "*"):
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        return q > 0
+    return False
+
+
+class SSECompressionStats:
+    def __init__(self):
+        self.streams = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "streams": self.streams,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.bytes_in / self.bytes_out, 2) if self.bytes_out else None,
+        }
+
+
+sse_compression_stats = SSECompressionStats()
+
+
+class SSECompressionMiddleware:
+    def __init__(self, app: ASGIApp, level: int = settings.SSE_COMPRESSION_LEVEL, stats: SSECompressionStats = sse_compression_stats):
+        self.app = app
+        self.level = level
+        self.stats = stats
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not accepts_gzip(get_header(scope, b"accept-encoding")):
+            await self.app(scope, receive, send)
+            return
+
+        compressor = None
+        stats = self.stats
+
+        async def send_compressed(message: Message):
+            nonlocal compressor
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", ())
+                content_type = b""
+                encoded = False
+                for key, value in headers:
+                    if key == b"content-type":
+                        content_type = value
+                    elif key == b"content-encoding":
+                        encoded = True
+                if content_type.startswith(b"text/event-stream") and not encoded:
+                    # wbits=31：gzip 格式
+                    compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+                    stats.streams += 1
+                    headers = [(key, value) for key, value in headers if key != b"content-length"]
+                    headers += [(b"content-encoding", b"gzip"), (b"vary", b"Accept-Encoding")]
+                    message = {**message, "headers": headers}
+                await send(message)
+                return
+
+            if message["type"] == "http.response.body" and compressor is not None:
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                stats.bytes_in += len(body)
+                # 每个事件帧结束一个压缩块，客户端收到即可解压，不会被压缩器缓冲
+                data = compressor.compress(body) + compressor.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+                stats.bytes_out += len(data)
+                message = {**message, "body": data}
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+
+def setup_sse_compression_middleware(app):
+    """开启 SSE_COMPRESSION_ENABLED 时为FastAPI应用添加 SSE 流式压缩"""
+    if settings.SSE_COMPRESSION_ENABLED:
+        app.add_middleware(SSECompressionMiddleware)
+
+
+if __name__ == "__main__":
+    # 基准测试：一次带大工具结果的运行，对比 不压缩 / 逐事件 sync flush 压缩 / 整体 gzip（不可流式，仅作下限参考）
+    import asyncio
+    import random
+    import time
+
+    from api.encoder import EventEncoder
+    from api.models.events import (
+        RunFinishedEvent,
+        RunStartedEvent,
+        TextMessageContentEvent,
+        ToolCallArgsEvent,
+        ToolCallEndEvent,
+        ToolCallResultEvent,
+        ToolCallStartEvent,
+    )
+
+    encoder = EventEncoder("lean")
+    # 模拟抓取到的网页 markdown：词汇有限但顺序随机，比重复同一句话更接近真实页面
+    rng = random.Random(0)
+    words = "长沙 天气 气温 降水 风力 湿度 预报 城区 郊区 白天 夜间 多云 小雨 晴 最高 最低 空气质量 良 出行 建议".split()
+    page = "\n".join(
+        f"## {rng.choice(words)}{i}\n" + "，".join(rng.choice(words) for _ in range(40)) + f"。[来源](https://example.com/p/{rng.randrange(10**6)})"
+        for i in range(300)
+    )
+    frames = [encoder.encode_sse(RunStartedEvent(run_id="run-1", thread_id="t-1"), event_id=1).encode()]
+    frames += [encoder.encode_sse(ToolCallStartEvent(tool_call_id="call-1", tool_call_name="web_fetch")).encode()]
+    frames += [encoder.encode_sse(ToolCallArgsEvent(tool_call_id="call-1", delta='{"url": "https://example.com"}')).encode()]
+    frames += [encoder.encode_sse(ToolCallEndEvent(tool_call_id="call-1")).encode()]
+    frames += [encoder.encode_sse(ToolCallResultEvent(message_id="t1", tool_call_id="call-1", content=page, role="tool")).encode()]
+    frames += [
+        encoder.encode_sse(TextMessageContentEvent(message_id="msg-1", delta="长沙今天晴"), event_id=i).encode()
+        for i in range(2, 402)
+    ]
+    frames += [encoder.encode_sse(RunFinishedEvent(run_id="run-1", thread_id="t-1")).encode()]
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+        for frame in frames:
+            await send({"type": "http.response.body", "body": frame, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def run(level: int):
+        chunks = []
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                chunks.append(message["body"])
+
+        scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip, deflate, br")]}
+        middleware = SSECompressionMiddleware(app, level=level, stats=SSECompressionStats())
+        t0 = time.perf_counter()
+        await middleware(scope, None, send)
+        return chunks, (time.perf_counter() - t0) / len(frames) * 1e6
+
+    async def main():
+        raw = sum(len(frame) for frame in frames)
+        print(f"{len(frames)} events, uncompressed {raw / 1024:.1f} KiB")
+        for level in (1, 6):
+            chunks, us = await run(level)
+            # 每个块都必须能立即解压出对应的完整事件
+            decompressor = zlib.decompressobj(31)
+            for frame, chunk in zip(frames, chunks):
+                assert decompressor.decompress(chunk) == frame
+            size = sum(len(chunk) for chunk in chunks)
+            print(f"sync flush level {level}: {size / 1024:.1f} KiB (x{raw / size:.1f}), {us:.1f} us/event, every event decodable on arrival")
+        whole = len(zlib.compress(b"".join(frames), 6))
+        print(f"whole-stream gzip (buffered, not streamable): {whole / 1024:.1f} KiB (x{raw / whole:.1f})")
+
+    asyncio.run(main())
@@ -2,27 +2,73 @@
 示例：如何在FastAPI应用中设置中间件的顺序
 """
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from api.middleware.auth_middleware import setup_auth_middleware
+from fastapi.responses import Response
+from api.middleware.auth_middleware import register_public_path, setup_auth_middleware
 from api.middleware.logging_middleware import setup_logging_middleware
-from api.endpoint import add_langgraph_fastapi_endpoint
-from api.event_handler import LangGraphAgent
-from agents.agent import agent
+from api.middleware.sse_compression import setup_sse_compression_middleware
+from api.graph_registry import get_graph_registry
+from agents.checkpointer import checkpointer_manager
+from agents.web_agent.tools.browser_pool import browser_pool
+from api.overload import overload_controller
+from api.scheduler import run_scheduler
+from api.batch import batch_manager
+from api.metrics import METRICS_CONTENT_TYPE, render_metrics
+from config.settings import settings
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：统一管理常驻资源（浏览器池等）的启动与释放"""
+    await browser_pool.start()
+    # 检查点存储的连接池 / 连接（sqlite、postgres），需在任何图运行之前打开
+    await checkpointer_manager.start()
+    # 采样事件循环延迟 / 进行中运行数，驱动全局过载保护与降级
+    await overload_controller.start()
+    # 图默认在首个请求时才加载；开启 GRAPH_WARM_UP 则在启动阶段预先导入并预热 schema / 签名缓存
+    if settings.GRAPH_WARM_UP:
+        await app.state.graph_registry.warm_up()
+    # 继续执行上次进程退出时未完成的批量运行
+    await batch_manager.resume()
+    try:
+        yield
+    finally:
+        # 批量运行停在当前进度（重启后继续）；取消仍在排队的运行，进行中的运行随进程退出
+        await batch_manager.stop()
+        await run_scheduler.stop()
+        await overload_controller.stop()
+        await checkpointer_manager.close()
+        await browser_pool.close()
+
 
 def create_app():
     """创建并配置FastAPI应用"""
-    app = FastAPI(title="LangGraph Agents API")
-    
-    # 重要：中间件的添加顺序很重要！
-    # 1. 首先添加认证中间件，它会验证API key并设置用户信息
-    setup_auth_middleware(app)
+    app = FastAPI(title="LangGraph Agents API", lifespan=lifespan)
     
-    # 2. 然后添加日志中间件，它会使用认证中间件设置的用户信息
+    # 重要：中间件的添加顺序很重要！Starlette 中后添加的中间件位于外层、先执行
+    # 0. SSE 流式压缩放在最内层，只改写响应体（需开启 SSE_COMPRESSION_ENABLED）
+    setup_sse_compression_middleware(app)
+
+    # 1. 先添加日志中间件（内层），它会使用认证中间件设置的用户信息
     setup_logging_middleware(app)
     
-    # 3. 最后添加API端点
-    langgraph_agent = LangGraphAgent(name="langgraph-agent", graph=agent)
-    add_langgraph_fastapi_endpoint(app, langgraph_agent)
+    # 2. 再添加认证中间件（外层），它会先验证API key并设置用户信息
+    setup_auth_middleware(app)
+    
+    # 3. 最后按 langgraph.json 为每个图添加API端点（图在首次使用时才加载）
+    graph_registry = get_graph_registry()
+    graph_registry.mount(app)
+    app.state.graph_registry = graph_registry
+
+    # 4. 进程级的 Prometheus 指标（所有图共用），需开启 METRICS_ENABLED
+    if settings.METRICS_ENABLED:
+        register_public_path("/metrics")
+
+        @app.get("/metrics", include_in_schema=False)
+        def metrics():
+            return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
     
     return app
 
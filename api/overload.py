@@ -0,0 +1,266 @@
+"""
+全局过载控制：
+
+- 后台周期性采样事件循环延迟（sleep 的实际唤醒时间 - 预期时间）、进行中的运行数
+  （调度器中正在执行与排队的运行，含批量任务）、默认线程池执行器的排队任务数
+- 任一指标超过降级阈值 -> 进入 degraded：下游跳过可选工作（MemOS 记忆写入、web_fetch 的渲染等待缩短）
+- 任一指标超过拒绝阈值 -> 进入 overloaded：新运行先短暂延后等待负载回落，仍未回落则返回 503
+- 回到正常需要指标低于阈值的一定比例（滞回），避免状态来回抖动
+"""
+import asyncio
+import math
+import time
+from typing import Any, Callable, Dict, Optional
+
+from config.settings import settings
+from utils.load_state import set_degraded
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+STATE_NORMAL = "normal"
+STATE_DEGRADED = "degraded"
+STATE_OVERLOADED = "overloaded"
+
+# 指标需要回落到阈值的这个比例以下才解除对应状态
+_RECOVERY_RATIO = 0.7
+# 延迟的指数滑动平均系数
+_LAG_ALPHA = 0.3
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.retry_after = retry_after
+        self.detail = detail
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def default_executor_queue_depth() -> int:
+    """默认 ThreadPoolExecutor 中排队未执行的任务数（asyncio.to_thread / run_in_executor 使用）"""
+    loop = asyncio.get_running_loop()
+    executor = getattr(loop, "_default_executor", None)
+    work_queue = getattr(executor, "_work_queue", None)
+    return work_queue.qsize() if work_queue is not None else 0
+
+
+class OverloadController:
+    def __init__(
+        self,
+        inflight_runs: Callable[[], int] = lambda: 0,
+        inflight_capacity: Callable[[], int] = lambda: 0,
+        sample_interval: float = settings.OVERLOAD_SAMPLE_INTERVAL,
+        lag_degrade_ms: float = settings.OVERLOAD_LAG_DEGRADE_MS,
+        lag_reject_ms: float = settings.OVERLOAD_LAG_REJECT_MS,
+        max_inflight_runs: int = settings.OVERLOAD_MAX_INFLIGHT_RUNS,
+        executor_queue_reject: int = settings.OVERLOAD_EXECUTOR_QUEUE_REJECT,
+        defer_seconds: float = settings.OVERLOAD_DEFER_SECONDS,
+    ):
+        self.inflight_runs = inflight_runs
+        # 进行中运行数可能达到的上限（0 为未知），启动时据此检查阈值是否可达
+        self.inflight_capacity = inflight_capacity
+        self.sample_interval = sample_interval
+        self.lag_degrade_ms = lag_degrade_ms
+        self.lag_reject_ms = lag_reject_ms
+        self.max_inflight_runs = max_inflight_runs
+        self.executor_queue_reject = executor_queue_reject
+        self.defer_seconds = defer_seconds
+
+        self.state = STATE_NORMAL
+        self.lag_ms = 0.0
+        self.lag_max_ms = 0.0
+        self.inflight = 0
+        self.executor_queue = 0
+
+        self._task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._rejected = 0
+        self._deferred = 0
+        self._transitions: Dict[str, int] = {}
+
+    async def start(self):
+        self._check_thresholds()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sample_loop(), name="overload-sampler")
+            logger.info("[Overload] sampler started")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._set_state(STATE_NORMAL)
+
+    def _check_thresholds(self) -> None:
+        capacity = self.inflight_capacity()
+        if not self.max_inflight_runs or not capacity:
+            return
+        if self.max_inflight_runs > capacity:
+            logger.warning(
+                f"[Overload] OVERLOAD_MAX_INFLIGHT_RUNS={self.max_inflight_runs} exceeds the {capacity} runs the scheduler "
+                f"can hold (workers + queues); in-flight shedding will never trigger"
+            )
+        elif self.max_inflight_runs * 0.8 > capacity:
+            logger.warning(
+                f"[Overload] degrade threshold {self.max_inflight_runs * 0.8:.0f} exceeds the {capacity} runs the scheduler "
+                f"can hold; in-flight degradation will never trigger"
+            )
+
+    async def admit(self) -> None:
+        """
+        新运行的全局准入：过载时最多延后 defer_seconds 等待负载回落，仍过载则抛出 Overloaded
+        """
+        self._refresh_inflight()
+        if self.state != STATE_OVERLOADED:
+            return
+        self._deferred += 1
+        deadline = time.monotonic() + self.defer_seconds
+        while self.state == STATE_OVERLOADED:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                self._rejected += 1
+                raise Overloaded(self.defer_seconds or self.sample_interval, self._describe())
+            changed = self._changed
+            try:
+                async with asyncio.timeout(timeout):
+                    await changed.wait()
+            except TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "loop_lag_ms": round(self.lag_ms, 1),
+            "loop_lag_max_ms": round(self.lag_max_ms, 1),
+            "inflight_runs": self.inflight,
+            "executor_queue": self.executor_queue,
+            "deferred": self._deferred,
+            "rejected": self._rejected,
+            "transitions": dict(self._transitions),
+            "thresholds": {
+                "lag_degrade_ms": self.lag_degrade_ms,
+                "lag_reject_ms": self.lag_reject_ms,
+                "max_inflight_runs": self.max_inflight_runs,
+                "executor_queue_reject": self.executor_queue_reject,
+            },
+        }
+
+    async def _sample_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.sample_interval
+            await asyncio.sleep(self.sample_interval)
+            lag_ms = max(0.0, (loop.time() - expected) * 1000)
+            self.lag_ms = lag_ms if self.lag_ms == 0 else _LAG_ALPHA * lag_ms + (1 - _LAG_ALPHA) * self.lag_ms
+            self.lag_max_ms = max(lag_ms, self.lag_max_ms * 0.99)
+            self.executor_queue = default_executor_queue_depth()
+            self._refresh_inflight()
+
+    def _refresh_inflight(self) -> None:
+        try:
+            self.inflight = self.inflight_runs()
+        except Exception:
+            pass
+        self._evaluate()
+
+    def _evaluate(self) -> None:
+        # 拒绝：任一指标超过拒绝阈值；解除拒绝需要全部回落到阈值的 _RECOVERY_RATIO 以下
+        over_reject = (
+            self.lag_ms > self.lag_reject_ms
+            or (self.max_inflight_runs and self.inflight >= self.max_inflight_runs)
+            or (self.executor_queue_reject and self.executor_queue >= self.executor_queue_reject)
+        )
+        under_reject = (
+            self.lag_ms < self.lag_reject_ms * _RECOVERY_RATIO
+            and (not self.max_inflight_runs or self.inflight < self.max_inflight_runs * _RECOVERY_RATIO)
+            and (not self.executor_queue_reject or self.executor_queue < self.executor_queue_reject * _RECOVERY_RATIO)
+        )
+        # 降级：延迟超过降级阈值，或已接近拒绝阈值
+        over_degrade = over_reject or self.lag_ms > self.lag_degrade_ms or (
+            self.max_inflight_runs and self.inflight >= self.max_inflight_runs * 0.8
+        )
+        under_degrade = under_reject and self.lag_ms < self.lag_degrade_ms * _RECOVERY_RATIO and (
+            not self.max_inflight_runs or self.inflight < self.max_inflight_runs * 0.8 * _RECOVERY_RATIO
+        )
+
+        state = self.state
+        if over_reject:
+            state = STATE_OVERLOADED
+        elif self.state == STATE_OVERLOADED and under_reject:
+            state = STATE_DEGRADED
+        if state != STATE_OVERLOADED:
+            if over_degrade:
+                state = STATE_DEGRADED
+            elif state == STATE_DEGRADED and under_degrade:
+                state = STATE_NORMAL
+        self._set_state(state)
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"[Overload] {self.state} -> {state} ({self._describe()})")
+        self.state = state
+        self._transitions[state] = self._transitions.get(state, 0) + 1
+        set_degraded(state != STATE_NORMAL)
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def _describe(self) -> str:
+        return f"loop lag {self.lag_ms:.0f}ms, {self.inflight} runs in flight, executor queue {self.executor_queue}"
+
+
+def _scheduler_inflight_runs() -> int:
+    # 流式运行与批量任务都经过调度器：执行中的 worker 数受 SCHEDULER_MAX_WORKERS 限制，积压体现在排队数上
+    from api.scheduler import run_scheduler
+
+    stats = run_scheduler.stats()
+    return stats["busy"] + sum(stats["queued"].values())
+
+
+def _scheduler_capacity() -> int:
+    from api.scheduler import PRIORITIES, run_scheduler
+
+    if not run_scheduler.max_queue:
+        return 0
+    return run_scheduler.max_workers + run_scheduler.max_queue * len(PRIORITIES)
+
+
+overload_controller = OverloadController(inflight_runs=_scheduler_inflight_runs, inflight_capacity=_scheduler_capacity)
+
+
+if __name__ == "__main__":
+    # 演示：用阻塞事件循环的 CPU 任务制造延迟，观察状态切换与新运行被拒绝
+    from utils.load_state import is_degraded
+
+    async def main():
+        controller = OverloadController(sample_interval=0.05, lag_degrade_ms=20, lag_reject_ms=80, defer_seconds=0.2)
+        await controller.start()
+
+        async def hog(block_ms: float, duration: float):
+            end = time.monotonic() + duration
+            while time.monotonic() < end:
+                t = time.perf_counter()
+                while (time.perf_counter() - t) * 1000 < block_ms:
+                    pass
+                await asyncio.sleep(0)
+
+        for block_ms in (0, 40, 150, 0):
+            await hog(block_ms, 1.0)
+            try:
+                await controller.admit()
+                verdict = "admitted"
+            except Overloaded as e:
+                verdict = f"503 Retry-After {e.retry_after_header}"
+            print(f"blocking {block_ms:>3}ms: state={controller.state:<10} degraded={is_degraded()!s:<5} lag={controller.lag_ms:6.1f}ms new run -> {verdict}")
+            if block_ms == 0:
+                await asyncio.sleep(1.0)
+        await controller.stop()
+        print(controller.stats())
+
+    asyncio.run(main())
@@ -0,0 +1,195 @@
+"""
+就绪探针（/ready）：/health 只说明进程还活着，/ready 说明这个 worker 现在是否适合接收新流量
+
+检查项（critical 的检查失败时返回 503，负载均衡应暂时摘除该 worker）：
+- load：全局过载状态（事件循环延迟、进行中的运行数、默认线程池排队数），overloaded 时不就绪
+- scheduler：任一优先级通道的排队数超过上限的 READY_MAX_QUEUE_RATIO
+- browser_pool：已关闭、等待租用页面的请求过多，或浏览器连续启动失败
+- checkpointer：对已加载图的 checkpointer 做一次 aget_tuple，超时或报错即不就绪（图尚未加载时跳过）
+- memos：MemOS 客户端连续失败次数，只报告不影响就绪（记忆是可选功能）
+
+结果按 READY_CACHE_SECONDS 缓存，并发的探测请求共享同一次检查，每秒轮询也不会给检查点存储带来额外压力
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from agents.web_agent.tools.browser_pool import browser_pool
+from api.overload import STATE_OVERLOADED, default_executor_queue_depth, overload_controller
+from api.scheduler import run_scheduler
+from config.settings import settings
+from memory.memos_client import memos_stats
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 探测用的线程 ID，只读，不会写入检查点
+READY_PROBE_THREAD_ID = "__ready_probe__"
+
+
+class ReadinessChecker:
+    def __init__(
+        self,
+        cache_seconds: float = settings.READY_CACHE_SECONDS,
+        checkpointer_timeout: float = settings.READY_CHECKPOINTER_TIMEOUT,
+        max_queue_ratio: float = settings.READY_MAX_QUEUE_RATIO,
+        browser_max_waiting: int = settings.READY_BROWSER_MAX_WAITING,
+        browser_max_launch_failures: int = settings.READY_BROWSER_MAX_LAUNCH_FAILURES,
+        memos_max_failures: int = settings.READY_MEMOS_MAX_FAILURES,
+    ):
+        self.cache_seconds = cache_seconds
+        self.checkpointer_timeout = checkpointer_timeout
+        self.max_queue_ratio = max_queue_ratio
+        self.browser_max_waiting = browser_max_waiting
+        self.browser_max_launch_failures = browser_max_launch_failures
+        self.memos_max_failures = memos_max_failures
+
+        # 按 agent 缓存（各图的 checkpointer 不同），其余检查项是进程级的
+        self._cache: Dict[Optional[int], Tuple[float, Dict[str, Any]]] = {}
+        self._pending: Dict[Optional[int], asyncio.Future] = {}
+
+    async def check(self, agent=None) -> Dict[str, Any]:
+        key = id(agent) if agent is not None else None
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_seconds:
+            return cached[1]
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = asyncio.ensure_future(self._evaluate(key, agent))
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        # 某个探测请求断开不应取消其他请求共享的检查
+        return await asyncio.shield(pending)
+
+    async def _evaluate(self, key: Optional[int], agent) -> Dict[str, Any]:
+        checks = {
+            "load": self._check_load(),
+            "scheduler": self._check_scheduler(),
+            "browser_pool": self._check_browser_pool(),
+            "checkpointer": await self._check_checkpointer(agent),
+            "memos": self._check_memos(),
+        }
+        failing = [name for name, check in checks.items() if not check["ok"] and check.get("critical", True)]
+        report = {"ready": not failing, "failing": failing, "checked_at": time.time(), "checks": checks}
+        if failing:
+            logger.warning(f"[Readiness] not ready: {failing}")
+        self._cache[key] = (time.monotonic(), report)
+        return report
+
+    @staticmethod
+    def _check_load() -> Dict[str, Any]:
+        return {
+            "ok": overload_controller.state != STATE_OVERLOADED,
+            "state": overload_controller.state,
+            "loop_lag_ms": round(overload_controller.lag_ms, 1),
+            "inflight_runs": overload_controller.inflight,
+            "executor_queue": default_executor_queue_depth(),
+        }
+
+    def _check_scheduler(self) -> Dict[str, Any]:
+        stats = run_scheduler.stats()
+        limit = run_scheduler.max_queue * self.max_queue_ratio
+        return {
+            "ok": not run_scheduler.max_queue or all(size < limit for size in stats["queued"].values()),
+            "busy": stats["busy"],
+            "workers": stats["workers"],
+            "queued": stats["queued"],
+        }
+
+    def _check_browser_pool(self) -> Dict[str, Any]:
+        stats = browser_pool.stats()
+        return {
+            "ok": (
+                not stats["closed"]
+                and stats["waiting"] < self.browser_max_waiting
+                and stats["consecutive_launch_failures"] < self.browser_max_launch_failures
+            ),
+            "running": sum(1 for browser in stats["browsers"] if browser["running"]),
+            "size": stats["size"],
+            "active_pages": stats["active_pages"],
+            "capacity": stats["capacity"],
+            "waiting": stats["waiting"],
+            "consecutive_launch_failures": stats["consecutive_launch_failures"],
+            "closed": stats["closed"],
+        }
+
+    async def _check_checkpointer(self, agent) -> Dict[str, Any]:
+        if agent is None:
+            return {"ok": True, "status": "skipped"}
+        if not getattr(agent, "loaded", True):
+            # 图按需加载，未加载时不为了探测而导入
+            return {"ok": True, "status": "not_loaded"}
+        if hasattr(agent, "get"):
+            agent = await agent.get()
+        checkpointer = getattr(agent.graph, "checkpointer", None)
+        if checkpointer is None or isinstance(checkpointer, bool):
+            return {"ok": True, "status": "none"}
+
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.checkpointer_timeout):
+                await checkpointer.aget_tuple({"configurable": {"thread_id": READY_PROBE_THREAD_ID, "checkpoint_ns": ""}})
+        except TimeoutError:
+            return {"ok": False, "status": "timeout", "timeout_ms": self.checkpointer_timeout * 1000}
+        except Exception as e:
+            return {"ok": False, "status": "error", "error": f"{type(e).__name__}: {e}"}
+        return {
+            "ok": True,
+            "status": "reachable",
+            "type": type(checkpointer).__name__,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    def _check_memos(self) -> Dict[str, Any]:
+        stats = memos_stats.snapshot()
+        return {"ok": stats["consecutive_failures"] < self.memos_max_failures, "critical": False, **stats}
+
+
+readiness_checker = ReadinessChecker()
+
+
+if __name__ == "__main__":
+    # 演示：1000 个并发探测只触发一次检查；检查点变慢后返回未就绪
+    from langgraph.checkpoint.memory import InMemorySaver
+
+    class SlowSaver(InMemorySaver):
+        delay = 0.0
+
+        async def aget_tuple(self, config):
+            await asyncio.sleep(self.delay)
+            return await super().aget_tuple(config)
+
+    class FakeGraph:
+        checkpointer = SlowSaver()
+
+    class FakeAgent:
+        graph = FakeGraph()
+
+    async def main():
+        checker = ReadinessChecker(cache_seconds=0.2, checkpointer_timeout=0.05)
+        agent = FakeAgent()
+        evaluations = 0
+        evaluate = checker._evaluate
+
+        async def counting_evaluate(key, agent):
+            nonlocal evaluations
+            evaluations += 1
+            return await evaluate(key, agent)
+
+        checker._evaluate = counting_evaluate
+        t0 = time.perf_counter()
+        reports = await asyncio.gather(*(checker.check(agent) for _ in range(1000)))
+        elapsed = (time.perf_counter() - t0) * 1000
+        print(f"1000 concurrent probes: {evaluations} evaluation(s), {elapsed:.1f} ms total, ready={reports[0]['ready']}")
+        print({name: check["ok"] for name, check in reports[0]["checks"].items()})
+
+        t0 = time.perf_counter()
+        for _ in range(1000):
+            await checker.check(agent)
+        print(f"cached probe: {(time.perf_counter() - t0) * 1000:.3f} us")
+
+        FakeGraph.checkpointer.delay = 0.1
+        await asyncio.sleep(0.25)
+        report = await checker.check(agent)
+        print(f"slow checkpointer: ready={report['ready']} failing={report['failing']} {report['checks']['checkpointer']}")
+
+    asyncio.run(main())
@@ -0,0 +1,354 @@
+"""
+可恢复的运行（run）注册表：
+
+- 每个运行由独立的后台任务驱动，与发起它的 HTTP 连接解耦；
+  分发出的事件按顺序编号（seq，即 SSE 的 id）写入有界的事件日志（仅内存）
+- 客户端重连时带上 Last-Event-ID，从该序号之后回放，再继续跟随实时事件
+- 相同 run_id 的重复 POST 附加到已有运行，而不是重新执行一遍模型和工具
+- 所有订阅者都断开后，等待一个宽限期仍无人重连才取消运行（后台运行不受此限制）
+- 运行可以先以排队状态登记，由调度器（api.scheduler）分配到执行名额后再启动；排队期间同样可以订阅
+- 状态事件（STATE_SNAPSHOT / STATE_DELTA）被挤出日志时合并进基准状态；重连出现缺口时先补发一个快照，
+  之后回放的 STATE_DELTA 仍能正确应用
+"""
+import asyncio
+import copy
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from api.models.events import BaseEvent, EventType, RunErrorEvent, StateSnapshotEvent
+from api.state_diff import apply_patch
+from api.streaming import CANCEL_CLIENT_DISCONNECT
+from config.settings import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+RUN_QUEUED = "queued"
+RUN_RUNNING = "running"
+RUN_FINISHED = "finished"
+RUN_FAILED = "failed"
+RUN_CANCELLED = "cancelled"
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """解析 Last-Event-ID 请求头，无效值按 0（从头回放）处理"""
+    if not value:
+        return 0
+    try:
+        return max(0, int(value.strip()))
+    except ValueError:
+        return 0
+
+
+class RunRecord:
+    """一个运行的事件日志、驱动任务与订阅者计数"""
+
+    def __init__(
+        self,
+        run_id: str,
+        thread_id: str,
+        user_id: Optional[str] = None,
+        graph: Optional[str] = None,
+        log_maxlen: int = settings.RUN_EVENT_LOG_MAXLEN,
+        detach_grace: float = settings.RUN_DETACH_GRACE_SECONDS,
+        cancel_on_detach: bool = True,
+    ):
+        self.run_id = run_id
+        self.thread_id = thread_id
+        self.user_id = user_id
+        # 运行所属的图：所有图共用一个登记表，按 run_id 查到的运行需核对是否属于当前路由的图
+        self.graph = graph
+        self.detach_grace = detach_grace
+        # 后台运行（POST /runs）没有订阅者也要执行完，不做断开取消
+        self.cancel_on_detach = cancel_on_detach
+
+        self.events: Deque[Tuple[int, BaseEvent]] = deque(maxlen=max(1, log_maxlen))
+        self.last_seq = 0
+        # 已被挤出日志的状态事件合并后的状态（None 表示还没有状态事件被挤出）
+        self._base_state: Optional[Dict[str, Any]] = None
+        self.status = RUN_QUEUED
+        self.cancel_reason: Optional[str] = None
+        self.subscribers = 0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+        self.task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._detach_timer: Optional[asyncio.TimerHandle] = None
+        self._done_callbacks: List[Callable[["RunRecord"], None]] = []
+
+    @property
+    def done(self) -> bool:
+        return self.status not in (RUN_QUEUED, RUN_RUNNING)
+
+    def start(self, events: AsyncIterator[BaseEvent]) -> None:
+        self.status = RUN_RUNNING
+        self.started_at = time.time()
+        self.task = asyncio.create_task(self._drive(events), name=f"run-{self.run_id}")
+        # 创建后尚无订阅者：若请求方始终没有来读取，同样按宽限期回收
+        self._schedule_detach_cancel()
+
+    def add_done_callback(self, callback: Callable[["RunRecord"], None]) -> None:
+        """运行结束（完成 / 失败 / 取消）后调用 callback(record)；已结束则立即调用"""
+        if self.done and self.finished_at is not None:
+            callback(self)
+        else:
+            self._done_callbacks.append(callback)
+
+    def cancel(self, reason: str) -> bool:
+        if self.done:
+            return False
+        self.cancel_reason = reason
+        if self.task is None:
+            # 仍在排队：直接结束，调度器取到它时会跳过
+            self.status = RUN_CANCELLED
+            self._finish()
+        else:
+            self.task.cancel()
+        return True
+
+    def append(self, event: BaseEvent) -> int:
+        if len(self.events) == self.events.maxlen:
+            self._absorb_state(self.events[0][1])
+        self.last_seq += 1
+        self.events.append((self.last_seq, event))
+        self._notify()
+        return self.last_seq
+
+    async def subscribe(self, after_seq: int = 0) -> AsyncIterator[Tuple[int, BaseEvent]]:
+        """回放 after_seq 之后仍保留在日志中的事件，然后跟随实时事件直到运行结束"""
+        self.subscribers += 1
+        if self._detach_timer is not None:
+            self._detach_timer.cancel()
+            self._detach_timer = None
+        cursor = after_seq
+        try:
+            while True:
+                waker = self._wakeup
+                while cursor < self.last_seq:
+                    first_seq = self.events[0][0]
+                    if cursor + 1 < first_seq:
+                        logger.warning(
+                            f"[RunRegistry] run {self.run_id}: events {cursor + 1}..{first_seq - 1} "
+                            f"already dropped from the log, resuming at {first_seq}"
+                        )
+                        if self._base_state is not None:
+                            # 缺口之前的状态变化补成一个快照，沿用被挤出的最后一个序号
+                            yield first_seq - 1, StateSnapshotEvent(snapshot=copy.deepcopy(self._base_state))
+                            # 让出期间日志可能继续滚动，重新计算位置
+                            cursor = first_seq - 1
+                            continue
+                    seq, event = self.events[max(0, cursor + 1 - first_seq)]
+                    cursor = seq
+                    yield seq, event
+                if self.done:
+                    return
+                await waker.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                self._schedule_detach_cancel()
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "run_id": self.run_id,
+            "thread_id": self.thread_id,
+            "graph": self.graph,
+            "status": self.status,
+            "cancel_reason": self.cancel_reason,
+            "background": not self.cancel_on_detach,
+            "last_event_id": self.last_seq,
+            "retained_events": len(self.events),
+            "subscribers": self.subscribers,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def _notify(self) -> None:
+        waker, self._wakeup = self._wakeup, asyncio.Event()
+        waker.set()
+
+    def _absorb_state(self, event: BaseEvent) -> None:
+        if event.type == EventType.STATE_SNAPSHOT:
+            self._base_state = copy.deepcopy(event.snapshot)
+        elif event.type == EventType.STATE_DELTA:
+            if self._base_state is None:
+                self._base_state = {}
+            apply_patch(self._base_state, event.delta)
+
+    def _schedule_detach_cancel(self) -> None:
+        if not self.cancel_on_detach or self.done or self._detach_timer is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._detach_timer = loop.call_later(self.detach_grace, self._cancel_if_detached)
+
+    def _cancel_if_detached(self) -> None:
+        self._detach_timer = None
+        if self.subscribers == 0 and self.cancel(CANCEL_CLIENT_DISCONNECT):
+            logger.info(f"[RunRegistry] run {self.run_id} cancelled: no subscriber for {self.detach_grace}s")
+
+    async def _drive(self, events: AsyncIterator[BaseEvent]) -> None:
+        try:
+            async with aclosing(events) as stream:
+                async for event in stream:
+                    if event is not None:
+                        self.append(event)
+            self.status = RUN_FINISHED
+        except asyncio.CancelledError:
+            self.status = RUN_CANCELLED
+        except Exception as e:
+            logger.exception(f"[RunRegistry] run {self.run_id} failed: {e}")
+            self.status = RUN_FAILED
+            self.append(RunErrorEvent(message=str(e), code=type(e).__name__))
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        if self._detach_timer is not None:
+            self._detach_timer.cancel()
+            self._detach_timer = None
+        self.finished_at = time.time()
+        self._notify()
+        callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f"[RunRegistry] done callback of run {self.run_id} failed: {e}")
+
+
+class RunRegistry:
+    """进程内的运行注册表；运行结束后保留一段时间供重连回放，超过容量时淘汰最早结束的运行"""
+
+    def __init__(
+        self,
+        max_runs: int = settings.RUN_REGISTRY_MAX_RUNS,
+        retention: float = settings.RUN_RETENTION_SECONDS,
+    ):
+        self.max_runs = max(1, max_runs)
+        self.retention = retention
+        self._runs: "OrderedDict[str, RunRecord]" = OrderedDict()
+        self._attaches = 0
+        self._evicted = 0
+        self._outcomes: Dict[str, int] = {}
+        self._cancelled: Dict[str, int] = {}
+
+    def get(self, run_id: str) -> Optional[RunRecord]:
+        record = self._runs.get(run_id)
+        if record is not None and self._expired(record, time.time()):
+            self._remove(run_id)
+            return None
+        return record
+
+    def create(
+        self,
+        run_id: str,
+        thread_id: str,
+        user_id: Optional[str] = None,
+        cancel_on_detach: bool = True,
+        graph: Optional[str] = None,
+    ) -> RunRecord:
+        """登记一个排队中的运行，稍后由调度器调用 record.start() 启动"""
+        self._evict()
+        record = RunRecord(
+            run_id=run_id, thread_id=thread_id, user_id=user_id, graph=graph, cancel_on_detach=cancel_on_detach
+        )
+        record.add_done_callback(self._on_done)
+        self._runs[run_id] = record
+        # 排队期间若请求方断开且无人重连，同样按宽限期取消
+        record._schedule_detach_cancel()
+        return record
+
+    def start(
+        self,
+        run_id: str,
+        thread_id: str,
+        events: AsyncIterator[BaseEvent],
+        user_id: Optional[str] = None,
+        graph: Optional[str] = None,
+    ) -> RunRecord:
+        record = self.create(run_id, thread_id, user_id, graph=graph)
+        record.start(events)
+        return record
+
+    def attach(self, record: RunRecord) -> RunRecord:
+        self._attaches += 1
+        return record
+
+    def stats(self) -> Dict[str, Any]:
+        queued = sum(1 for record in self._runs.values() if record.status == RUN_QUEUED)
+        running = sum(1 for record in self._runs.values() if record.status == RUN_RUNNING)
+        return {
+            "queued": queued,
+            "running": running,
+            "retained": len(self._runs) - running - queued,
+            "attaches": self._attaches,
+            "evicted": self._evicted,
+            "outcomes": dict(self._outcomes),
+            "cancelled": dict(self._cancelled),
+        }
+
+    def _on_done(self, record: RunRecord) -> None:
+        self._outcomes[record.status] = self._outcomes.get(record.status, 0) + 1
+        if record.status == RUN_CANCELLED:
+            reason = record.cancel_reason or "unknown"
+            self._cancelled[reason] = self._cancelled.get(reason, 0) + 1
+
+    def _expired(self, record: RunRecord, now: float) -> bool:
+        return record.done and record.subscribers == 0 and now - record.finished_at > self.retention
+
+    def _remove(self, run_id: str) -> None:
+        self._runs.pop(run_id, None)
+        self._evicted += 1
+
+    def _evict(self) -> None:
+        now = time.time()
+        for run_id in [run_id for run_id, record in self._runs.items() if self._expired(record, now)]:
+            self._remove(run_id)
+        # 仍然超出容量时，按创建顺序淘汰已结束的运行（进行中的运行不会被淘汰）
+        if len(self._runs) >= self.max_runs:
+            for run_id in [run_id for run_id, record in self._runs.items() if record.done]:
+                if len(self._runs) < self.max_runs:
+                    break
+                self._remove(run_id)
+
+
+run_registry = RunRegistry()
+
+
+if __name__ == "__main__":
+    # 演示：运行途中断开，带 Last-Event-ID 重连后从断点继续，且上游只执行了一次
+    from api.models.events import TextMessageContentEvent
+
+    async def main():
+        executions = {"count": 0}
+
+        async def fake_run():
+            executions["count"] += 1
+            for i in range(20):
+                await asyncio.sleep(0.01)
+                yield TextMessageContentEvent(message_id="m1", delta=f"tok{i} ")
+
+        registry = RunRegistry()
+        record = registry.start("run-1", "thread-1", fake_run())
+
+        first = []
+        async with aclosing(record.subscribe(0)) as events:
+            async for seq, event in events:
+                first.append(seq)
+                if seq == 7:
+                    break  # 模拟网络中断
+
+        await asyncio.sleep(0.05)
+        retried = registry.get("run-1")
+        assert retried is record, "retried POST must attach to the existing run"
+        second = [seq async for seq, _ in registry.attach(retried).subscribe(first[-1])]
+        print(f"before drop: {first}")
+        print(f"after reconnect (Last-Event-ID={first[-1]}): {second}")
+        print(f"upstream executions: {executions['count']}, status: {record.status}, stats: {registry.stats()}")
+
+    asyncio.run(main())
@@ -0,0 +1,306 @@
+"""
+运行调度器：所有图执行都经由这里启动，统一限制全进程同时执行的运行数
+
+- 固定数量的 worker 从队列中取运行执行，运行结束后 worker 才取下一个
+- 两条优先级通道：interactive（聊天）优先于 batch（批量 / 离线任务）；
+  每连续调度 INTERACTIVE_WEIGHT 个 interactive 运行后，若 batch 有积压则让出一个名额，避免 batch 饿死
+- 同一通道内按用户轮转（round-robin），一个用户提交再多运行也只是排在自己的队列里，不会挡住其他用户
+- 运行先以排队状态登记到 RunRegistry，排队期间即可订阅事件流；排队中被取消的运行会被直接跳过
+- 不产生事件流的工作（如批量任务的单条执行）通过 run_task 排队，与运行共用同一组 worker 名额
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+from api.models.events import BaseEvent
+from api.run_registry import RunRecord
+from config.settings import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)
+
+T = TypeVar("T")
+
+
+class SchedulerFull(Exception):
+    def __init__(self, priority: str, retry_after: float):
+        super().__init__(f"Run queue for {priority} runs is full")
+        self.priority = priority
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, round(self.retry_after)))
+
+
+def resolve_priority(forwarded_props: Optional[Dict[str, Any]], headers=None, default: str = PRIORITY_INTERACTIVE) -> str:
+    """优先级：forwarded_props.priority > X-Run-Priority 请求头 > default"""
+    value = (forwarded_props or {}).get("priority")
+    if value is None and headers is not None:
+        value = headers.get("x-run-priority")
+    value = str(value).strip().lower() if value is not None else default
+    return value if value in PRIORITIES else default
+
+
+class _Job:
+    """一个排队项：带事件流的运行（record + events），或普通协程任务（fn + future）"""
+
+    __slots__ = ("record", "events", "fn", "future", "priority", "user_key", "enqueued_at")
+
+    def __init__(
+        self,
+        priority: str,
+        user_key: str,
+        record: Optional[RunRecord] = None,
+        events: Optional[AsyncIterator[BaseEvent]] = None,
+        fn: Optional[Callable[[], Awaitable[Any]]] = None,
+        future: Optional[asyncio.Future] = None,
+    ):
+        self.record = record
+        self.events = events
+        self.fn = fn
+        self.future = future
+        self.priority = priority
+        self.user_key = user_key
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.record.done if self.record is not None else self.future.done()
+
+
+class _Lane:
+    """一条优先级通道：用户 -> 该用户的 FIFO 队列，按用户轮转出队"""
+
+    def __init__(self):
+        self.users: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self.size = 0
+
+    def push(self, job: _Job) -> None:
+        jobs = self.users.get(job.user_key)
+        if jobs is None:
+            jobs = self.users[job.user_key] = deque()
+        jobs.append(job)
+        self.size += 1
+
+    def pop(self) -> Optional[_Job]:
+        while self.users:
+            user_key, jobs = next(iter(self.users.items()))
+            job = jobs.popleft()
+            self.size -= 1
+            if jobs:
+                self.users.move_to_end(user_key)
+            else:
+                del self.users[user_key]
+            if not job.cancelled:
+                return job
+        return None
+
+    def discard(self, job: _Job) -> None:
+        jobs = self.users.get(job.user_key)
+        if jobs is None:
+            return
+        try:
+            jobs.remove(job)
+        except ValueError:
+            return
+        self.size -= 1
+        if not jobs:
+            del self.users[job.user_key]
+
+
+class RunScheduler:
+    def __init__(
+        self,
+        max_workers: int = settings.SCHEDULER_MAX_WORKERS,
+        max_queue: int = settings.SCHEDULER_MAX_QUEUE,
+        interactive_weight: int = settings.SCHEDULER_INTERACTIVE_WEIGHT,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.interactive_weight = max(1, interactive_weight)
+
+        self._lanes: Dict[str, _Lane] = {priority: _Lane() for priority in PRIORITIES}
+        self._workers: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._interactive_streak = 0
+        self._busy = 0
+        self._submitted: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+        self._rejected: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+        self._wait_seconds: Dict[str, float] = {priority: 0.0 for priority in PRIORITIES}
+        self._dispatched: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+
+    def check_capacity(self, priority: str) -> None:
+        """通道排队已满时抛出 SchedulerFull；在登记运行之前调用，避免登记了却无法排队"""
+        if self.max_queue and self._lanes[priority].size >= self.max_queue:
+            self._rejected[priority] += 1
+            raise SchedulerFull(priority, retry_after=1.0)
+
+    def submit(self, record: RunRecord, events: AsyncIterator[BaseEvent], priority: str, user_key: str) -> None:
+        """把已登记（排队状态）的运行放入对应通道；队列已满时抛出 SchedulerFull"""
+        self.check_capacity(priority)
+        lane = self._lanes[priority]
+        job = _Job(priority, user_key, record=record, events=events)
+        lane.push(job)
+        self._submitted[priority] += 1
+        # 排队中被取消（客户端断开等）时立即出队，不占队列容量
+        record.add_done_callback(lambda _: lane.discard(job))
+        self._ensure_workers()
+        self._notify()
+
+    async def run_task(self, fn: Callable[[], Awaitable[T]], priority: str, user_key: str) -> T:
+        """
+        排队执行 fn()，返回其结果；队列已满时抛出 SchedulerFull。
+        调用方被取消时：仍在排队则直接出队，已在执行则取消执行中的任务
+        """
+        self.check_capacity(priority)
+        lane = self._lanes[priority]
+        job = _Job(priority, user_key, fn=fn, future=asyncio.get_running_loop().create_future())
+        lane.push(job)
+        self._submitted[priority] += 1
+        self._ensure_workers()
+        self._notify()
+        try:
+            return await job.future
+        finally:
+            if not job.future.done():
+                job.future.cancel()
+            lane.discard(job)
+
+    async def stop(self) -> None:
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for lane in self._lanes.values():
+            while (job := lane.pop()) is not None:
+                if job.record is not None:
+                    job.record.cancel("shutdown")
+                else:
+                    job.future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "busy": self._busy,
+            "queued": {priority: lane.size for priority, lane in self._lanes.items()},
+            "queued_users": {priority: len(lane.users) for priority, lane in self._lanes.items()},
+            "submitted": dict(self._submitted),
+            "dispatched": dict(self._dispatched),
+            "rejected": dict(self._rejected),
+            "avg_wait_ms": {
+                priority: round(self._wait_seconds[priority] / count * 1000, 1) if (count := self._dispatched[priority]) else 0.0
+                for priority in PRIORITIES
+            },
+        }
+
+    def _ensure_workers(self) -> None:
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"run-worker-{i}") for i in range(self.max_workers)
+        ]
+        logger.info(f"[Scheduler] started {self.max_workers} workers")
+
+    def _notify(self) -> None:
+        waker, self._wakeup = self._wakeup, asyncio.Event()
+        waker.set()
+
+    def _next_job(self) -> Optional[_Job]:
+        interactive, batch = self._lanes[PRIORITY_INTERACTIVE], self._lanes[PRIORITY_BATCH]
+        if interactive.size and (not batch.size or self._interactive_streak < self.interactive_weight):
+            job = interactive.pop()
+            if job is not None:
+                self._interactive_streak = self._interactive_streak + 1 if batch.size else 0
+                return job
+        job = batch.pop()
+        if job is not None:
+            self._interactive_streak = 0
+            return job
+        return interactive.pop()
+
+    async def _worker(self) -> None:
+        while True:
+            job = self._next_job()
+            if job is None:
+                await self._wakeup.wait()
+                continue
+            self._dispatched[job.priority] += 1
+            self._wait_seconds[job.priority] += time.monotonic() - job.enqueued_at
+            self._busy += 1
+            try:
+                if job.record is not None:
+                    job.record.start(job.events)
+                    # 运行任务本身的异常 / 取消由 RunRecord 处理，这里只等待它结束
+                    await asyncio.wait({job.record.task})
+                else:
+                    await self._execute(job)
+            finally:
+                self._busy -= 1
+
+    @staticmethod
+    async def _execute(job: _Job) -> None:
+        task = asyncio.ensure_future(job.fn())
+        # 调用方放弃等待（future 被取消）时同时取消执行中的任务
+        job.future.add_done_callback(lambda future: task.cancel() if future.cancelled() else None)
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            job.future.cancel()
+            raise
+        if job.future.done():
+            if not task.cancelled():
+                task.exception()  # 调用方已不再关心结果，避免 "never retrieved" 警告
+        elif task.cancelled():
+            job.future.cancel()
+        elif task.exception() is not None:
+            job.future.set_exception(task.exception())
+        else:
+            job.future.set_result(task.result())
+
+
+run_scheduler = RunScheduler()
+
+
+if __name__ == "__main__":
+    # 演示：2 个 worker，一个用户灌入大量 batch 运行，另一个用户随后提交的聊天和 batch 运行仍能及时执行
+    from api.models.events import TextMessageContentEvent
+    from api.run_registry import RunRegistry
+
+    async def main():
+        registry = RunRegistry()
+        scheduler = RunScheduler(max_workers=2, max_queue=100, interactive_weight=3)
+        started: List[str] = []
+        t0 = time.perf_counter()
+
+        async def fake_run(name: str):
+            started.append(name)
+            await asyncio.sleep(0.05)
+            yield TextMessageContentEvent(message_id=name, delta="done")
+
+        def submit(name: str, priority: str, user: str):
+            record = registry.create(name, f"thread-{name}", user, cancel_on_detach=False)
+            scheduler.submit(record, fake_run(name), priority, user)
+            return record
+
+        for i in range(10):
+            submit(f"greedy-batch-{i}", PRIORITY_BATCH, "greedy")
+        await asyncio.sleep(0.01)
+        submit("polite-batch", PRIORITY_BATCH, "polite")
+        chats = [submit(f"chat-{i}", PRIORITY_INTERACTIVE, "polite") for i in range(4)]
+        while any(not r.done for r in chats):
+            await asyncio.sleep(0.01)
+        print(f"chats finished after {(time.perf_counter() - t0) * 1000:.0f}ms")
+        while scheduler.stats()["busy"] or any(lane.size for lane in scheduler._lanes.values()):
+            await asyncio.sleep(0.01)
+        print("start order:", started)
+        print(scheduler.stats())
+        await scheduler.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,312 @@
+"""
+单次运行（run）级别的会话状态
+
+LangGraphAgent 是整个进程共享的单例，所有随运行变化的状态都放在 RunSession 中，
+由 _handle_stream_events 为每个请求单独创建，运行结束即释放；
+其中可能随事件数量增长的集合都是有界的。
+"""
+import json
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Hashable, List, Optional, Tuple
+
+from api.encoder import WIRE_MODE_LEAN
+from api.event_filter import EventFilter
+from api.models.types import RunAgentInput
+from api.state_diff import StateTracker
+
+# 单次运行中最多记住的消息 ID / 工具调用数量
+MAX_TRACKED_MESSAGES = 1024
+MAX_TRACKED_TOOL_CALLS = 512
+
+
+class BoundedSet:
+    """按插入顺序淘汰最旧元素的有界集合"""
+
+    def __init__(self, maxlen: int):
+        self.maxlen = maxlen
+        self._items: "OrderedDict[Hashable, None]" = OrderedDict()
+
+    def add(self, item: Hashable) -> None:
+        self._items[item] = None
+        self._items.move_to_end(item)
+        if len(self._items) > self.maxlen:
+            self._items.popitem(last=False)
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class BoundedDict(OrderedDict):
+    """按插入顺序淘汰最旧条目的有界字典"""
+
+    def __init__(self, maxlen: int):
+        super().__init__()
+        self.maxlen = maxlen
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxlen:
+            self.popitem(last=False)
+
+
+class _PendingToolCall:
+    """一个正在流式组装参数的工具调用"""
+
+    __slots__ = ("id", "name", "arg_parts")
+
+    def __init__(self):
+        self.id: Optional[str] = None
+        self.name: Optional[str] = None
+        self.arg_parts: List[str] = []
+
+
+class ToolCallAccumulator:
+    """
+    工具调用关联器：
+
+    - 流式阶段按 (message_id, index) 累积 tool_call_chunks，参数只做字符串拼接
+    - 模型消息结束时，把解析好的 tool_calls 按工具名放入待执行队列
+    - on_tool_start 时把 LangGraph 的工具 run_id 绑定到对应的 tool_call_id，
+      on_tool_end 时按 run_id O(1) 取回；全程不做 JSON 往返，同名同参的调用也不会串
+    """
+
+    def __init__(self, maxlen: int = MAX_TRACKED_TOOL_CALLS):
+        self._streaming: BoundedDict = BoundedDict(maxlen)
+        self._queued: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._runs: BoundedDict = BoundedDict(maxlen)
+        self._maxlen = maxlen
+
+    def add_chunk(self, message_id: Optional[str], chunk: Dict[str, Any]) -> None:
+        """累积一个 tool_call_chunk（来自 AIMessageChunk.tool_call_chunks）"""
+        key = (message_id, chunk.get("index"))
+        pending = self._streaming.get(key)
+        if pending is None:
+            pending = _PendingToolCall()
+            self._streaming[key] = pending
+        if chunk.get("id"):
+            pending.id = chunk["id"]
+        if chunk.get("name"):
+            pending.name = chunk["name"]
+        if chunk.get("args"):
+            pending.arg_parts.append(chunk["args"])
+
+    def finish_message(self, message: Any) -> None:
+        """模型消息结束：登记该消息发起的所有工具调用"""
+        message_id = getattr(message, "id", None)
+        tool_calls = getattr(message, "tool_calls", None) or []
+        keys = [key for key in self._streaming if key[0] == message_id]
+
+        if tool_calls:
+            for tool_call in tool_calls:
+                self._enqueue(tool_call.get("name"), tool_call.get("id"), tool_call.get("args"))
+        else:
+            # 模型没有给出解析好的 tool_calls 时，退回到流式累积的结果（仅在此处解析一次）
+            for key in keys:
+                pending = self._streaming[key]
+                if pending.name:
+                    self._enqueue(pending.name, pending.id, _parse_args("".join(pending.arg_parts)))
+
+        for key in keys:
+            del self._streaming[key]
+
+    def bind_run(self, run_id: str, name: str, args: Any) -> Tuple[str, Any]:
+        """
+        工具开始执行：为 LangGraph 工具 run 找到对应的 tool_call_id。
+        返回 (tool_call_id, 模型给出的原始参数)；工具输入里可能混入了注入参数（如 runtime），
+        发给前端的参数应以模型给出的为准。
+        """
+        queue = self._queued.get(name)
+        tool_call_id, call_args = None, args
+        if queue:
+            # 优先匹配参数完全相同的调用，否则按发起顺序取第一个
+            match = next((call for call in queue if call["args"] == args), queue[0])
+            queue.remove(match)
+            tool_call_id, call_args = match["id"], match["args"]
+            if not queue:
+                del self._queued[name]
+        if not tool_call_id:
+            tool_call_id = self._take_streaming(name) or run_id
+        self._runs[run_id] = tool_call_id
+        return tool_call_id, call_args
+
+    def resolve_run(self, run_id: str) -> str:
+        """工具结束：按 run_id 取回 tool_call_id，并释放绑定"""
+        return self._runs.pop(run_id, None) or run_id
+
+    def _enqueue(self, name: Optional[str], tool_call_id: Optional[str], args: Any) -> None:
+        if not name:
+            return
+        queue = self._queued.setdefault(name, deque(maxlen=self._maxlen))
+        queue.append({"id": tool_call_id, "args": args})
+
+    def _take_streaming(self, name: str) -> Optional[str]:
+        """兜底：消息结束事件缺失时，直接从流式累积中取同名调用"""
+        for key, pending in self._streaming.items():
+            if pending.name == name and pending.id:
+                del self._streaming[key]
+                return pending.id
+        return None
+
+
+def _parse_args(raw: str) -> Any:
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw
+
+
+class RunSession:
+    def __init__(self, run_id: str, thread_id: str, lean: bool = False, event_filter: Optional[EventFilter] = None):
+        self.run_id = run_id
+        self.thread_id = thread_id
+        self.lean = lean
+        self.event_filter = event_filter or EventFilter()
+
+        self.node_name: Optional[str] = None
+        self.mode: str = "start"
+        self.thinking_process = None
+        self.has_function_streaming = False
+
+        # 运行开始时由 prepare_stream 以检查点中的状态初始化
+        self.state = StateTracker()
+        self.schema_keys: Optional[Dict[str, Any]] = None
+
+        self.messages_id = BoundedSet(MAX_TRACKED_MESSAGES)
+        self.tool_calls = ToolCallAccumulator(MAX_TRACKED_TOOL_CALLS)
+
+    @classmethod
+    def from_input(cls, input: RunAgentInput, thread_id: str) -> "RunSession":
+        forwarded_props = input.forwarded_props or {}
+        return cls(
+            run_id=input.run_id,
+            thread_id=thread_id,
+            lean=forwarded_props.get("wire_mode") == WIRE_MODE_LEAN,
+            event_filter=EventFilter.from_props(forwarded_props),
+        )
+
+
+if __name__ == "__main__":
+    # 压力测试：500 个并发运行共享同一个 LangGraphAgent，检查会话隔离与内存是否平稳
+    import asyncio
+    import gc
+    import operator
+    import tracemalloc
+    import uuid
+    from typing import Annotated, AsyncIterator, List, TypedDict
+
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+    from langgraph.checkpoint.memory import InMemorySaver
+    from langgraph.graph import END, START, StateGraph
+    from langgraph.graph.message import add_messages
+
+    from api.event_handler import LangGraphAgent
+    from api.models.events import EventType
+
+    N_RUNS = 500
+    ROUNDS = 4
+
+    class EchoChatModel(BaseChatModel):
+        """逐词回显最后一条用户消息的假模型"""
+
+        @property
+        def _llm_type(self) -> str:
+            return "echo"
+
+        def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=messages[-1].content))])
+
+        async def _astream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+            for word in str(messages[-1].content).split(" "):
+                await asyncio.sleep(0)
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+
+    class FakeState(TypedDict):
+        messages: Annotated[list, add_messages]
+
+    model = EchoChatModel()
+
+    async def call_model(state: FakeState):
+        return {"messages": [await model.ainvoke(state["messages"])]}
+
+    builder = StateGraph(FakeState)
+    builder.add_node("model", call_model)
+    builder.add_edge(START, "model")
+    builder.add_edge("model", END)
+    saver = InMemorySaver()
+    agent = LangGraphAgent(name="stress", graph=builder.compile(checkpointer=saver))
+
+    async def one_run(i: int):
+        marker = f"run-{i}-{uuid.uuid4().hex[:8]}"
+        input_data = RunAgentInput(
+            thread_id=f"thread-{i}",
+            run_id=marker,
+            state={},
+            messages=[{"id": str(uuid.uuid4()), "role": "user", "content": f"{marker} hello from {marker}"}],
+            tools=[],
+            context=[],
+            forwarded_props={"wire_mode": "lean"},
+        )
+        text, run_ids = [], set()
+        async for event in agent.run(input_data):
+            if event.type == EventType.TEXT_MESSAGE_CONTENT:
+                text.append(event.delta)
+            elif event.type in (EventType.RUN_STARTED, EventType.RUN_FINISHED):
+                run_ids.add(event.thread_id)
+        reply = "".join(text).strip()
+        assert reply == f"{marker} hello from {marker}", f"cross-talk detected in {marker}: {reply!r}"
+        assert run_ids == {f"thread-{i}"}, f"run lifecycle leaked across threads: {run_ids}"
+
+    class NotesState(TypedDict):
+        notes: Annotated[list, operator.add]
+
+    notes_builder = StateGraph(NotesState)
+    notes_builder.add_node("first", lambda state: {"notes": ["a"]})
+    notes_builder.add_node("second", lambda state: {"notes": ["b"]})
+    notes_builder.add_edge(START, "first")
+    notes_builder.add_edge("first", "second")
+    notes_builder.add_edge("second", END)
+    notes_agent = LangGraphAgent(name="notes", graph=notes_builder.compile(checkpointer=InMemorySaver()))
+
+    def reject(left, right):
+        raise TypeError("reducer does not accept this update")
+
+    # reducer 与图不一致：第二个节点的更新被当作覆盖，根图结束时用完整状态校正出非空的 STATE_DELTA
+    notes_agent._state_reducers["notes"] = reject
+
+    async def check_final_state_delta():
+        input_data = RunAgentInput(
+            thread_id="notes-thread", run_id="notes-run", state={}, messages=[], tools=[], context=[], forwarded_props={}
+        )
+        events = [event async for event in notes_agent.run(input_data)]
+        types = [event.type for event in events]
+        assert types[-1] == EventType.RUN_FINISHED, f"RUN_FINISHED must be the last event, got {types[-3:]}"
+        final_delta = events[-2]
+        assert final_delta.type == EventType.STATE_DELTA and final_delta.delta, "expected a non-empty final STATE_DELTA"
+        print(f"reducer drift: final STATE_DELTA {final_delta.delta} precedes RUN_FINISHED")
+
+    async def main():
+        await check_final_state_delta()
+        tracemalloc.start()
+        for round_no in range(ROUNDS):
+            await asyncio.gather(*(one_run(i) for i in range(N_RUNS)))
+            # 检查点属于持久化数据，不计入 agent 自身的内存
+            saver.storage.clear()
+            saver.writes.clear()
+            saver.blobs.clear()
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+            print(f"round {round_no + 1}: {N_RUNS} runs isolated, active_runs={len(agent.active_runs)}, traced={current / 1024:.0f} KiB")
+        assert not agent.active_runs
+
+    asyncio.run(main())
@@ -0,0 +1,183 @@
+"""
+运行期间的图状态跟踪：以 RFC 6902 JSON Patch（STATE_DELTA）增量下发状态变化
+
+- 运行开始时下发一次 STATE_SNAPSHOT，之后每个根图节点结束时只对其更新的键（如 todos、files）做差分
+- 节点输出是局部更新，带 reducer 的键（如 deepagents 的 files）先按图的 reducer 合并再比较
+- 字典逐键比较；列表只追加时生成 "/key/-" 的 add，长度不变时逐项比较，其余情况整体 replace
+- messages 和 tools 不进入状态跟踪（消息已通过 TEXT_MESSAGE_* / TOOL_CALL_* 事件流式下发，tools 是客户端自己提交的）
+- apply_patch 供 RunRegistry 在事件日志淘汰时维护基准状态，断线重连出现缺口时补发快照
+"""
+import copy
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional
+
+from langgraph.types import Command
+
+from api.utils import make_json_safe
+
+DEFAULT_EXCLUDED_KEYS = ("messages", "tools")
+
+Patch = List[Dict[str, Any]]
+
+
+def _escape(key: Any) -> str:
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def diff(old: Any, new: Any, path: str = "") -> Patch:
+    """生成把 old 变为 new 的 JSON Patch（两者都应是 JSON 安全的值）"""
+    if old is new:
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops: Patch = [{"op": "remove", "path": f"{path}/{_escape(key)}"} for key in old if key not in new]
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+            else:
+                ops.extend(diff(old[key], value, f"{path}/{_escape(key)}"))
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        if len(new) == len(old):
+            ops = []
+            for index, (before, after) in enumerate(zip(old, new)):
+                ops.extend(diff(before, after, f"{path}/{index}"))
+            return ops
+        if len(new) > len(old) and new[:len(old)] == old:
+            return [{"op": "add", "path": f"{path}/-", "value": value} for value in new[len(old):]]
+    if type(old) is type(new) and old == new:
+        return []
+    return [{"op": "replace", "path": path, "value": new}]
+
+
+def apply_patch(document: Dict[str, Any], patch: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """就地应用 diff 生成的 add / remove / replace 操作（值会被深拷贝，不与事件共享对象）"""
+    for op in patch:
+        *parents, last = [_unescape(token) for token in op["path"].split("/")[1:]]
+        target: Any = document
+        for token in parents:
+            target = target[int(token)] if isinstance(target, list) else target[token]
+        if op["op"] == "remove":
+            if isinstance(target, list):
+                del target[int(last)]
+            else:
+                target.pop(last, None)
+            continue
+        value = copy.deepcopy(op["value"])
+        if isinstance(target, list):
+            if last == "-":
+                target.append(value)
+            elif op["op"] == "add":
+                target.insert(int(last), value)
+            else:
+                target[int(last)] = value
+        else:
+            target[last] = value
+    return document
+
+
+def iter_state_updates(output: Any) -> Iterator[Mapping[str, Any]]:
+    """节点输出中的状态更新：dict、Command(update=dict)，或它们组成的列表（ToolNode）"""
+    if isinstance(output, Command):
+        if isinstance(output.update, dict):
+            yield output.update
+    elif isinstance(output, dict):
+        yield output
+    elif isinstance(output, (list, tuple)):
+        for item in output:
+            yield from iter_state_updates(item)
+
+
+class StateTracker:
+    def __init__(
+        self,
+        state: Optional[Mapping[str, Any]] = None,
+        reducers: Optional[Mapping[str, Callable[[Any, Any], Any]]] = None,
+        exclude: Iterable[str] = DEFAULT_EXCLUDED_KEYS,
+    ):
+        self.reducers = reducers or {}
+        self.exclude = frozenset(exclude)
+        self._raw: Dict[str, Any] = {}
+        self._json: Dict[str, Any] = {}
+        for key, value in (state or {}).items():
+            if key not in self.exclude:
+                self._raw[key] = value
+                self._json[key] = make_json_safe(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        # 各键的值只会被整体替换、不会原地修改，浅拷贝即可与后续变化隔离
+        return dict(self._json)
+
+    def update(self, update: Mapping[str, Any]) -> Patch:
+        """应用一个节点的局部更新（经过 reducer），返回变化的 patch"""
+        ops: Patch = []
+        for key, value in update.items():
+            if key in self.exclude:
+                continue
+            reducer = self.reducers.get(key)
+            if reducer is not None and self._raw.get(key) is not None:
+                try:
+                    value = reducer(self._raw[key], value)
+                except Exception:
+                    # reducer 不接受该更新时按覆盖处理，根图结束时会用完整状态纠正
+                    pass
+            ops.extend(self._set(key, value))
+        return ops
+
+    def replace(self, state: Mapping[str, Any]) -> Patch:
+        """用完整状态（根图的最终输出）覆盖，不经过 reducer"""
+        ops: Patch = []
+        for key, value in state.items():
+            if key not in self.exclude:
+                ops.extend(self._set(key, value))
+        return ops
+
+    def _set(self, key: str, value: Any) -> Patch:
+        if key in self._raw and self._raw[key] is value:
+            return []
+        self._raw[key] = value
+        new = make_json_safe(value)
+        path = f"/{_escape(key)}"
+        if key not in self._json:
+            self._json[key] = new
+            return [{"op": "add", "path": path, "value": new}]
+        ops = diff(self._json[key], new, path)
+        self._json[key] = new
+        return ops
+
+
+if __name__ == "__main__":
+    # 基准：deepagents 风格的状态（todos + files），每步改一个 todo 状态或写一个文件，
+    # 对比每步下发完整快照与下发 patch 的字节数；并校验 patch 依次应用后与最终状态一致
+    import json
+    import time
+
+    def merge_files(left, right):
+        return {**(left or {}), **right}
+
+    todos = [{"content": f"第 {i} 步：检索并整理长沙天气相关资料", "status": "pending"} for i in range(12)]
+    state = {"messages": [], "todos": todos, "files": {}}
+    tracker = StateTracker(state, reducers={"files": merge_files})
+    client = copy.deepcopy(tracker.snapshot())
+    snapshot_bytes = patch_bytes = 0
+    steps, elapsed = 0, 0.0
+    for i in range(12):
+        todos = [dict(todo, status="completed" if j < i else "in_progress" if j == i else "pending") for j, todo in enumerate(todos)]
+        updates = [
+            {"todos": todos},
+            {"files": {f"/notes/{i}.md": {"content": ["长沙明天多云转小雨，气温 18-24℃。"] * 20, "modified_at": f"2025-01-01T00:{i:02d}"}}},
+        ]
+        for update in updates:
+            t0 = time.perf_counter()
+            patch = tracker.update(update)
+            elapsed += time.perf_counter() - t0
+            steps += 1
+            apply_patch(client, patch)
+            patch_bytes += len(json.dumps(patch, ensure_ascii=False))
+            snapshot_bytes += len(json.dumps(tracker.snapshot(), ensure_ascii=False))
+    elapsed = elapsed / steps * 1e6
+    assert client == tracker.snapshot(), "patches must reproduce the tracked state"
+    print(f"{steps} node updates: full snapshots {snapshot_bytes / 1024:.1f} KiB vs patches {patch_bytes / 1024:.1f} KiB "
+          f"(x{snapshot_bytes / patch_bytes:.1f} smaller), {elapsed:.0f} us/update")
@@ -0,0 +1,217 @@
+"""
+图事件流与 SSE 写出之间的生产者/消费者隔离层：
+
+- 生产者任务驱动事件源（运行注册表中某个运行的订阅），把事件放入有界队列
+- 消费者（StreamingResponse 的生成器）从队列取出事件写给客户端
+- 客户端断开，或队列持续写满超过阈值（慢消费者）时，取消生产者任务并退订；
+  运行没有任何订阅者超过宽限期后，由 RunRegistry 取消 astream_events 内部运行图的任务及其工具子任务
+"""
+import asyncio
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, Optional
+
+from starlette.requests import Request
+
+from config.settings import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+CANCEL_CLIENT_DISCONNECT = "client_disconnect"
+CANCEL_SLOW_CONSUMER = "slow_consumer"
+
+_DONE = object()
+
+
+class StreamCancelled(Exception):
+    """流被服务端主动取消（客户端断开 / 慢消费者）"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Failure:
+    __slots__ = ("exc",)
+
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+class StreamStats:
+    """流的运行计数，供 /health 和指标使用"""
+
+    def __init__(self):
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.active = 0
+        self.cancelled: Dict[str, int] = {}
+        self.max_queue_depth = 0
+
+    def record_cancel(self, reason: str) -> None:
+        self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "completed": self.completed,
+            "failed": self.failed,
+            "active": self.active,
+            "cancelled": dict(self.cancelled),
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+stream_stats = StreamStats()
+
+
+class StreamPump:
+    def __init__(
+        self,
+        queue_size: int = settings.STREAM_QUEUE_MAXSIZE,
+        slow_consumer_timeout: float = settings.STREAM_SLOW_CONSUMER_TIMEOUT,
+        disconnect_poll_interval: float = settings.STREAM_DISCONNECT_POLL_INTERVAL,
+        stats: StreamStats = stream_stats,
+    ):
+        self.queue_size = max(1, queue_size)
+        self.slow_consumer_timeout = slow_consumer_timeout
+        self.disconnect_poll_interval = disconnect_poll_interval
+        self.stats = stats
+
+    async def pump(
+        self,
+        events: AsyncIterator[Any],
+        request: Optional[Request] = None,
+        run_id: Optional[str] = None,
+    ) -> AsyncIterator[Any]:
+        """
+        通过有界队列转发 events；流被取消时抛出 StreamCancelled。
+        消费者提前退出（例如 StreamingResponse 因断开而取消生成器）时同样会取消生产者。
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        cancel_reason: Optional[str] = None
+        stats = self.stats
+
+        def abort(reason: str) -> None:
+            nonlocal cancel_reason
+            if cancel_reason is None:
+                cancel_reason = reason
+            # 丢弃尚未写出的事件，保证消费者能立刻看到结束标记
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(_DONE)
+
+        async def produce():
+            try:
+                async with aclosing(events) as stream:
+                    async for item in stream:
+                        try:
+                            async with asyncio.timeout(self.slow_consumer_timeout):
+                                await queue.put(item)
+                        except TimeoutError:
+                            abort(CANCEL_SLOW_CONSUMER)
+                            return
+                        depth = queue.qsize()
+                        if depth > stats.max_queue_depth:
+                            stats.max_queue_depth = depth
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                await queue.put(_Failure(exc))
+                return
+            await queue.put(_DONE)
+
+        async def watch_disconnect():
+            while True:
+                await asyncio.sleep(self.disconnect_poll_interval)
+                if await request.is_disconnected():
+                    producer.cancel()
+                    abort(CANCEL_CLIENT_DISCONNECT)
+                    return
+
+        started_at = time.monotonic()
+        producer = asyncio.create_task(produce())
+        watcher = asyncio.create_task(watch_disconnect()) if request is not None else None
+        stats.started += 1
+        stats.active += 1
+        outcome = "completed"
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    outcome = "failed"
+                    raise item.exc
+                yield item
+            if cancel_reason is not None:
+                raise StreamCancelled(cancel_reason)
+        except (asyncio.CancelledError, GeneratorExit):
+            # 消费者被外部取消 / 关闭：对 StreamingResponse 而言意味着客户端已经断开
+            if cancel_reason is None:
+                cancel_reason = CANCEL_CLIENT_DISCONNECT
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if not producer.done():
+                producer.cancel()
+                try:
+                    await producer
+                except (asyncio.CancelledError, Exception):
+                    pass
+            stats.active -= 1
+            if cancel_reason is not None:
+                stats.record_cancel(cancel_reason)
+                logger.info(
+                    f"[StreamPump] stream of run {run_id} cancelled ({cancel_reason}) "
+                    f"after {time.monotonic() - started_at:.1f}s"
+                )
+            elif outcome == "failed":
+                stats.failed += 1
+            else:
+                stats.completed += 1
+
+
+if __name__ == "__main__":
+    # 演示：慢消费者 / 消费者提前退出时，上游图任务会被取消而不是继续跑完
+    async def main():
+        upstream_state = {"produced": 0, "cancelled": False}
+
+        async def upstream():
+            try:
+                for i in range(10_000):
+                    await asyncio.sleep(0.001)
+                    upstream_state["produced"] += 1
+                    yield i
+            except asyncio.CancelledError:
+                upstream_state["cancelled"] = True
+                raise
+            finally:
+                upstream_state["closed"] = True
+
+        # 1. 慢消费者：队列写满 0.2s 后取消
+        pump = StreamPump(queue_size=8, slow_consumer_timeout=0.2, stats=StreamStats())
+        received = 0
+        try:
+            async for _ in pump.pump(upstream()):
+                received += 1
+                await asyncio.sleep(1)
+        except StreamCancelled as e:
+            print(f"slow consumer: cancelled ({e.reason}) after receiving {received}, upstream produced {upstream_state['produced']}, closed={upstream_state.get('closed')}")
+
+        # 2. 消费者提前退出（模拟 StreamingResponse 因客户端断开而关闭生成器）
+        upstream_state.update(produced=0, closed=False)
+        stats = StreamStats()
+        pump = StreamPump(queue_size=8, stats=stats)
+        consumer = pump.pump(upstream())
+        async for item in consumer:
+            if item == 20:
+                break
+        await consumer.aclose()
+        await asyncio.sleep(0.05)
+        print(f"early exit: upstream produced {upstream_state['produced']}, closed={upstream_state['closed']}, stats={stats.snapshot()}")
+
+    asyncio.run(main())
@@ -3,6 +3,7 @@ import re
 from enum import Enum
 from typing import List, Any, Dict, NotRequired, Optional, TypedDict, Union
 from dataclasses import is_dataclass, asdict
+from itertools import islice
 from datetime import date, datetime
 
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage, ToolMessage
@@ -140,56 +141,329 @@ def json_safe_stringify(o):
 def is_json_primitive(value: Any) -> bool:
     return isinstance(value, (str, int, float, bool)) or value is None
 
+_PRIMITIVE_TYPES = frozenset({str, int, float, bool, type(None)})
+
+# 转换器内部的处理类别
+_KIND_PRIMITIVE = 0
+_KIND_MAPPING = 1
+_KIND_SEQUENCE = 2
+_KIND_ENUM = 3
+_KIND_TRANSFORM = 4
+_KIND_REPR = 5
+
+_EXIT = object()
+_MISSING = object()
+
+
+def _dump_pydantic(value: Any) -> Any:
+    return value.model_dump(by_alias=True, exclude_none=True)
+
+
+def _dump_to_dict(value: Any) -> Any:
+    return value.to_dict()
+
+
+def _dump_vars(value: Any) -> Any:
+    return {"__type__": type(value).__name__, **value.__dict__}
+
+
+class JsonSafeConverter:
+    """
+    基于类型注册表的 JSON 安全化转换器（替代原递归版 make_json_safe）：
+
+    - 每个类型只解析一次处理方式并缓存
+    - 显式栈迭代遍历，不受递归深度限制；对当前路径上的对象做环检测
+    - 深度、单个容器元素数、总节点数都有上限，超出部分以占位字符串代替
+    - 已经是 JSON 基础类型（或只含基础类型的 dict/list）时直接短路
+    """
+
+    def __init__(self, max_depth: int = 64, max_items: int = 5000, max_nodes: int = 200_000):
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.max_nodes = max_nodes
+        self._registry: Dict[type, Any] = {}
+        self._cache: Dict[type, Any] = {}
+
+    def register(self, tp: type, handler) -> None:
+        """
+        为某个类型（及其子类）注册转换函数，handler(value) 返回的结果会继续被遍历
+        """
+        self._registry[tp] = handler
+        self._cache.clear()
+
+    def _resolve(self, tp: type):
+        """解析并缓存类型对应的 (类别, 转换函数链)"""
+        cached = self._cache.get(tp)
+        if cached is not None:
+            return cached
+
+        resolved = None
+        for base in tp.__mro__:
+            if base in self._registry:
+                resolved = (_KIND_TRANSFORM, (self._registry[base],))
+                break
+
+        if resolved is None:
+            # 与原实现保持相同的优先级：model_dump -> to_dict -> dict -> list/tuple -> Enum -> 基础类型 -> __dict__ -> repr
+            transforms = []
+            if hasattr(tp, "model_dump"):
+                transforms.append(_dump_pydantic)
+            if hasattr(tp, "to_dict"):
+                transforms.append(_dump_to_dict)
+
+            if tp in _PRIMITIVE_TYPES:
+                resolved = (_KIND_PRIMITIVE, ())
+            elif transforms:
+                if "__dict__" in dir(tp):
+                    transforms.append(_dump_vars)
+                resolved = (_KIND_TRANSFORM, tuple(transforms))
+            elif issubclass(tp, dict):
+                resolved = (_KIND_MAPPING, ())
+            elif issubclass(tp, (list, tuple)):
+                resolved = (_KIND_SEQUENCE, ())
+            elif issubclass(tp, Enum):
+                resolved = (_KIND_ENUM, ())
+            elif issubclass(tp, (str, int, float, bool)):
+                resolved = (_KIND_PRIMITIVE, ())
+            elif "__dict__" in dir(tp):
+                resolved = (_KIND_TRANSFORM, (_dump_vars,))
+            else:
+                resolved = (_KIND_REPR, ())
+
+        self._cache[tp] = resolved
+        return resolved
+
+    def convert(self, value: Any) -> Any:
+        tp = type(value)
+        if tp in _PRIMITIVE_TYPES:
+            return value
+        if tp is dict and all(type(k) is str and type(v) in _PRIMITIVE_TYPES for k, v in value.items()):
+            return value if len(value) <= self.max_items else self._walk(value)
+        if tp is list and all(type(v) in _PRIMITIVE_TYPES for v in value):
+            return value if len(value) <= self.max_items else self._walk(value)
+        return self._walk(value)
+
+    def _walk(self, value: Any) -> Any:
+        primitive_types = _PRIMITIVE_TYPES
+        resolve_cached = self._cache.get
+        max_items = self.max_items
+        max_depth = self.max_depth
+        max_nodes = self.max_nodes
+
+        root = [None]
+        stack: List[Any] = [(value, root, 0, 0)]
+        push = stack.append
+        pop = stack.pop
+        active = set()
+        nodes = 0
+
+        while stack:
+            item = pop()
+            current = item[0]
+            if current is _EXIT:
+                active.discard(item[1])
+                continue
+
+            _, parent, key, depth = item
+            nodes += 1
+            if nodes > max_nodes:
+                parent[key] = "<truncated>"
+                continue
+
+            while True:
+                tp = type(current)
+                kind, transforms = resolve_cached(tp) or self._resolve(tp)
+
+                if kind == _KIND_PRIMITIVE:
+                    parent[key] = current
+                    break
+
+                if kind == _KIND_REPR:
+                    parent[key] = _safe_repr(current)
+                    break
+
+                if kind == _KIND_ENUM:
+                    enum_value = current.value
+                    if is_json_primitive(enum_value):
+                        parent[key] = enum_value
+                        break
+                    out = {"__type__": tp.__name__, "name": current.name, "value": None}
+                    parent[key] = out
+                    push((enum_value, out, "value", depth + 1))
+                    break
+
+                oid = id(current)
+                if oid in active:
+                    parent[key] = f"<cycle: {tp.__name__}>"
+                    break
+
+                if kind == _KIND_TRANSFORM:
+                    transformed = _MISSING
+                    for transform in transforms:
+                        try:
+                            transformed = transform(current)
+                            break
+                        except Exception:
+                            continue
+                    if transformed is _MISSING:
+                        parent[key] = _safe_repr(current)
+                        break
+                    # 对象本身留在路径上，直到其转换结果遍历完成
+                    active.add(oid)
+                    push((_EXIT, oid))
+                    current = transformed
+                    continue
+
+                if depth >= max_depth:
+                    parent[key] = "<max depth exceeded>"
+                    break
+
+                active.add(oid)
+                push((_EXIT, oid))
+                child_depth = depth + 1
+                size = len(current)
+
+                if kind == _KIND_MAPPING:
+                    out = {}
+                    parent[key] = out
+                    entries = current.items() if size <= max_items else islice(current.items(), max_items)
+                    for sub_key, sub_value in entries:
+                        if type(sub_key) not in primitive_types:
+                            sub_key = str(sub_key)
+                        sub_type = type(sub_value)
+                        if sub_type in primitive_types:
+                            out[sub_key] = sub_value
+                        elif (sub_type is dict or sub_type is list) and not sub_value:
+                            out[sub_key] = sub_type()
+                        else:
+                            out[sub_key] = None
+                            push((sub_value, out, sub_key, child_depth))
+                    if size > max_items:
+                        out["__truncated__"] = size - max_items
+                else:
+                    out = list(current) if size <= max_items else list(islice(current, max_items))
+                    parent[key] = out
+                    for index, sub_value in enumerate(out):
+                        sub_type = type(sub_value)
+                        if sub_type in primitive_types:
+                            continue
+                        if (sub_type is dict or sub_type is list) and not sub_value:
+                            out[index] = sub_type()
+                        else:
+                            push((sub_value, out, index, child_depth))
+                    if size > max_items:
+                        out.append(f"<{size - max_items} more items>")
+                break
+
+        return root[0]
+
+
+def _safe_repr(value: Any) -> str:
+    try:
+        return repr(value)
+    except Exception:
+        return f"<unrepresentable {type(value).__name__}>"
+
+
+json_safe_converter = JsonSafeConverter()
+json_safe_converter.register(datetime, lambda o: o.isoformat())
+json_safe_converter.register(date, lambda o: o.isoformat())
+
+
 def make_json_safe(value: Any) -> Any:
     """
-    Recursively convert a value into a JSON-serializable structure.
+    Convert a value into a JSON-serializable structure.
 
     - Handles Pydantic models via `model_dump`.
     - Handles LangChain messages via `to_dict`.
-    - Recursively walks dicts, lists, and tuples.
+    - Walks dicts, lists, and tuples iteratively with cycle detection.
     - For arbitrary objects, falls back to `__dict__` if available, else `repr()`.
     """
-    # Pydantic models
-    if hasattr(value, "model_dump"):
-        try:
-            return make_json_safe(value.model_dump(by_alias=True, exclude_none=True))
-        except Exception:
-            pass
-
-    # LangChain-style objects
-    if hasattr(value, "to_dict"):
-        try:
-            return make_json_safe(value.to_dict())
-        except Exception:
-            pass
-
-    # Dict
-    if isinstance(value, dict):
-        return {key: make_json_safe(sub_value) for key, sub_value in value.items()}
-
-    # List / tuple
-    if isinstance(value, (list, tuple)):
-        return [make_json_safe(sub_value) for sub_value in value]
-
-    if isinstance(value, Enum):
-        enum_value = value.value
-        if is_json_primitive(enum_value):
-            return enum_value
-        return {
-            "__type__": type(value).__name__,
-            "name": value.name,
-            "value": make_json_safe(enum_value),
-        }
-
-    # Already JSON safe
-    if is_json_primitive(value):
-        return value
-
-    # Arbitrary object: try __dict__ first, fallback to repr
-    if hasattr(value, "__dict__"):
-        return {
-            "__type__": type(value).__name__,
-            **make_json_safe(value.__dict__),
-        }
-
-    return repr(value)
+    return json_safe_converter.convert(value)
+
+
+def summarize_run_result(output: Any, max_content_length: int = 200) -> Optional[Dict[str, Any]]:
+    """
+    把根节点的最终状态投影为一个小摘要（lean 模式下替代 `str(output)`）：
+    只保留状态键、消息条数和最后一条消息的截断内容。
+    """
+    if output is None:
+        return None
+    if not isinstance(output, dict):
+        return {"value": str(output)[:max_content_length]}
+
+    summary: Dict[str, Any] = {"keys": sorted(output.keys())}
+    messages = output.get("messages")
+    if isinstance(messages, list):
+        summary["message_count"] = len(messages)
+        if messages:
+            last = messages[-1]
+            content = getattr(last, "content", None)
+            if content is None and isinstance(last, dict):
+                content = last.get("content")
+            if not isinstance(content, str):
+                content = stringify_if_needed(make_json_safe(content))
+            summary["last_message"] = {
+                "id": getattr(last, "id", None) or (last.get("id") if isinstance(last, dict) else None),
+                "type": getattr(last, "type", None) or (last.get("type") if isinstance(last, dict) else None),
+                "content": content[:max_content_length],
+            }
+    return summary
+
+
+if __name__ == "__main__":
+    # 微基准：在真实的 astream_events 负载上对比旧的递归实现与新的转换器
+    import asyncio
+    import timeit
+    from typing import Annotated
+
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+    from langgraph.graph import END, START, StateGraph
+    from langgraph.graph.message import add_messages
+
+    def legacy_make_json_safe(value: Any) -> Any:
+        if hasattr(value, "model_dump"):
+            try:
+                return legacy_make_json_safe(value.model_dump(by_alias=True, exclude_none=True))
+            except Exception:
+                pass
+        if hasattr(value, "to_dict"):
+            try:
+                return legacy_make_json_safe(value.to_dict())
+            except Exception:
+                pass
+        if isinstance(value, dict):
+            return {k: legacy_make_json_safe(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [legacy_make_json_safe(v) for v in value]
+        if isinstance(value, Enum):
+            return value.value if is_json_primitive(value.value) else repr(value)
+        if is_json_primitive(value):
+            return value
+        if hasattr(value, "__dict__"):
+            return {"__type__": type(value).__name__, **legacy_make_json_safe(value.__dict__)}
+        return repr(value)
+
+    class BenchState(TypedDict):
+        messages: Annotated[list, add_messages]
+
+    model = GenericFakeChatModel(messages=iter(["今天 长沙 天气 晴 最高 气温 18 度 " * 40] * 100))
+
+    async def call_model(state: BenchState):
+        return {"messages": [await model.ainvoke(state["messages"])]}
+
+    builder = StateGraph(BenchState)
+    builder.add_node("model", call_model)
+    builder.add_edge(START, "model")
+    builder.add_edge("model", END)
+    graph = builder.compile()
+
+    async def collect_events():
+        history = [HumanMessage(content="湖南长沙的天气怎么样？" * 10, id=f"h{i}") for i in range(40)]
+        return [event async for event in graph.astream_events({"messages": history}, version="v2")]
+
+    events = asyncio.run(collect_events())
+    print(f"collected {len(events)} astream_events payloads")
+    for name, fn in (("legacy", legacy_make_json_safe), ("converter", make_json_safe)):
+        seconds = min(timeit.repeat(lambda: [fn(e) for e in events], number=5, repeat=3)) / 5
+        print(f"{name:>10}: {seconds / len(events) * 1e6:.1f} us/event")
@@ -0,0 +1,408 @@
+"""
+AG-UI 事件的 WebSocket 传输
+
+与 SSE 使用同一套事件（api/models/events.py）和同一个运行注册表，区别在于：
+- 双向：在同一条连接上发起运行、取消、断线续传、调整订阅过滤，不需要额外的 HTTP 请求
+- 紧凑帧：事件帧为数组 [sid, seq, code, payload]，code 为整数事件类型（见 EVENT_TYPE_CODES），
+  payload 为去掉 type 的字段字典；编码通过 Sec-WebSocket-Protocol 协商：
+  agui.msgpack（二进制帧）或 agui.json（文本帧），未协商时可用 ?encoding=msgpack|json，默认 json
+- 一条连接可以同时订阅多个运行，sid 区分各个订阅
+
+客户端 -> 服务端控制消息（均可带 ref，服务端回执原样带回）：
+    {"op": "run", "input": RunAgentInput, "types": [...]?}       发起运行并订阅
+    {"op": "subscribe", "runId": ..., "after": seq?, "types": [...]?}  订阅已有运行，从 after 之后回放
+    {"op": "resume", "runId": ..., "after": seq}                  断线重连后续传，等同 subscribe
+    {"op": "cancel", "runId": ...}                                取消运行
+    {"op": "filter", "sid": ..., "types": [...] | null}           调整订阅的事件类型过滤（null 为不过滤）
+    （run 的 types 同时作为运行的源头过滤，未声明的事件不会产生，之后的 filter 只能在此范围内收窄）
+    {"op": "unsubscribe", "sid": ...}
+    {"op": "ping"}
+服务端 -> 客户端控制帧为字典：hello / subscribed / end / cancelled / error / pong
+"""
+import asyncio
+import json
+from contextlib import aclosing
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+from pydantic import ValidationError
+from starlette.websockets import WebSocket, WebSocketDisconnect, WebSocketState
+
+from api.encoder import EventEncoder, resolve_wire_mode
+from api.event_filter import LIFECYCLE_EVENT_TYPES
+from api.metrics import STREAM_SIZE, stream_counters
+from api.models.events import BaseEvent, EventType
+from api.models.types import RunAgentInput
+from api.run_registry import RunRecord, run_registry
+from api.streaming import StreamCancelled, StreamPump
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+try:  # ormsgpack 随 langgraph-checkpoint 安装；缺失时只提供 JSON 编码
+    import ormsgpack
+except ImportError:  # pragma: no cover
+    ormsgpack = None
+
+try:  # orjson 为可选依赖，缺失时回退到标准库 json
+    import orjson
+
+    def _dumps_json(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:  # pragma: no cover
+    def _dumps_json(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+SUBPROTOCOL_MSGPACK = "agui.msgpack"
+SUBPROTOCOL_JSON = "agui.json"
+
+# 整数事件类型码：只可追加，不可修改已有编号
+EVENT_TYPE_CODES: Dict[EventType, int] = {
+    EventType.TEXT_MESSAGE_START: 1,
+    EventType.TEXT_MESSAGE_CONTENT: 2,
+    EventType.TEXT_MESSAGE_END: 3,
+    EventType.TEXT_MESSAGE_CHUNK: 4,
+    EventType.THINKING_TEXT_MESSAGE_START: 5,
+    EventType.THINKING_TEXT_MESSAGE_CONTENT: 6,
+    EventType.THINKING_TEXT_MESSAGE_END: 7,
+    EventType.TOOL_CALL_START: 8,
+    EventType.TOOL_CALL_ARGS: 9,
+    EventType.TOOL_CALL_END: 10,
+    EventType.TOOL_CALL_CHUNK: 11,
+    EventType.TOOL_CALL_RESULT: 12,
+    EventType.THINKING_START: 13,
+    EventType.THINKING_END: 14,
+    EventType.STATE_SNAPSHOT: 15,
+    EventType.STATE_DELTA: 16,
+    EventType.MESSAGES_SNAPSHOT: 17,
+    EventType.ACTIVITY_SNAPSHOT: 18,
+    EventType.ACTIVITY_DELTA: 19,
+    EventType.RAW: 20,
+    EventType.CUSTOM: 21,
+    EventType.RUN_STARTED: 22,
+    EventType.RUN_FINISHED: 23,
+    EventType.RUN_ERROR: 24,
+    EventType.STEP_STARTED: 25,
+    EventType.STEP_FINISHED: 26,
+}
+EVENT_TYPES_BY_CODE: Dict[int, EventType] = {code: event_type for event_type, code in EVENT_TYPE_CODES.items()}
+
+
+class FrameCodec:
+    def __init__(self, subprotocol: str):
+        self.subprotocol = subprotocol
+        self.binary = subprotocol == SUBPROTOCOL_MSGPACK
+
+    def dumps(self, frame: Any):
+        if self.binary:
+            return ormsgpack.packb(frame)
+        return _dumps_json(frame)
+
+    def loads(self, data) -> Any:
+        if isinstance(data, (bytes, bytearray)):
+            return ormsgpack.unpackb(data) if ormsgpack is not None else json.loads(data)
+        return json.loads(data)
+
+
+def available_subprotocols() -> Iterable[str]:
+    return (SUBPROTOCOL_MSGPACK, SUBPROTOCOL_JSON) if ormsgpack is not None else (SUBPROTOCOL_JSON,)
+
+
+def negotiate_codec(websocket: WebSocket) -> FrameCodec:
+    """按客户端在 Sec-WebSocket-Protocol 中给出的顺序选第一个支持的编码；未协商时看 ?encoding="""
+    supported = available_subprotocols()
+    for subprotocol in websocket.scope.get("subprotocols") or ():
+        if subprotocol in supported:
+            return FrameCodec(subprotocol)
+    encoding = websocket.query_params.get("encoding", "")
+    if encoding == "msgpack" and SUBPROTOCOL_MSGPACK in supported:
+        return FrameCodec(SUBPROTOCOL_MSGPACK)
+    return FrameCodec(SUBPROTOCOL_JSON)
+
+
+def parse_event_types(values: Optional[Iterable[Any]]) -> Optional[Set[EventType]]:
+    """订阅过滤：接受事件类型名或整数码；None 表示不过滤"""
+    if values is None:
+        return None
+    if not isinstance(values, (list, tuple)):
+        raise ValueError("types must be a list of event type names or codes")
+    types = set()
+    for value in values:
+        if isinstance(value, int) and value in EVENT_TYPES_BY_CODE:
+            types.add(EVENT_TYPES_BY_CODE[value])
+        elif isinstance(value, str) and value in EventType.__members__:
+            types.add(EventType[value])
+        else:
+            raise ValueError(f"Unknown event type: {value!r}")
+    return types
+
+
+class _Subscription:
+    __slots__ = ("sid", "record", "encoder", "types", "task")
+
+    def __init__(self, sid: int, record: RunRecord, encoder: EventEncoder, types: Optional[Set[EventType]]):
+        self.sid = sid
+        self.record = record
+        self.encoder = encoder
+        self.types = types
+        self.task: Optional[asyncio.Task] = None
+
+
+class WebSocketSession:
+    """一条 WebSocket 连接：接收控制消息，把各订阅的事件写回客户端"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        codec: FrameCodec,
+        start_run: Callable[[RunAgentInput], Awaitable[RunRecord]],
+        reject_types: tuple = (),
+        graph: Optional[str] = None,
+    ):
+        self.websocket = websocket
+        self.codec = codec
+        # start_run 通过准入后返回排队中的 RunRecord；被拒绝时抛出 reject_types 中的异常（需带 status_code / body）
+        self.start_run = start_run
+        self.reject_types = reject_types
+        self.user_id = getattr(websocket.state, "user_id", None)
+        # 连接挂在某个图的路由下，只能订阅 / 取消该图的运行
+        self.graph = graph
+        self._subscriptions: Dict[int, _Subscription] = {}
+        self._next_sid = 1
+        self._frames, self._frame_bytes = stream_counters("ws")
+        self._bytes_sent = 0
+
+    async def serve(self) -> None:
+        await self._send({"op": "hello", "encoding": self.codec.subprotocol, "eventTypes": {
+            event_type.value: code for event_type, code in EVENT_TYPE_CODES.items()
+        }})
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                data = message.get("bytes") if message.get("bytes") is not None else message.get("text")
+                if data is None:
+                    await self._error(None, 400, "Empty message")
+                    continue
+                try:
+                    request = self.codec.loads(data)
+                except (TypeError, ValueError) as e:
+                    await self._error(None, 400, f"Malformed message: {e}")
+                    continue
+                if not isinstance(request, dict):
+                    await self._error(None, 400, "Control messages must be objects")
+                    continue
+                await self._handle(request)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            # 只退订；运行本身在无人订阅超过宽限期后才由 RunRegistry 取消，期间可以重连续传
+            for subscription in list(self._subscriptions.values()):
+                self._unsubscribe(subscription)
+            # 一条连接上多路复用多个运行，单流字节数按整条连接计
+            STREAM_SIZE.labels("ws").observe(self._bytes_sent)
+
+    async def _handle(self, request: Dict[str, Any]) -> None:
+        op = request.get("op")
+        ref = request.get("ref")
+        try:
+            # 字段类型不对的请求只回错误帧，不能让异常打断整条连接（及其上的其他订阅）
+            sid = request.get("sid")
+            if sid is not None and (not isinstance(sid, int) or isinstance(sid, bool)):
+                raise ValueError("sid must be an integer")
+            run_id = request.get("runId")
+            if run_id is not None and not isinstance(run_id, str):
+                raise ValueError("runId must be a string")
+            if op == "run":
+                await self._op_run(request, ref)
+            elif op in ("subscribe", "resume"):
+                await self._op_subscribe(request, ref)
+            elif op == "cancel":
+                await self._op_cancel(request, ref)
+            elif op == "filter":
+                subscription = self._subscriptions.get(request.get("sid"))
+                if subscription is None:
+                    await self._error(ref, 404, "Subscription not found")
+                    return
+                subscription.types = parse_event_types(request.get("types"))
+                await self._send({"op": "filtered", "ref": ref, "sid": subscription.sid})
+            elif op == "unsubscribe":
+                subscription = self._subscriptions.get(request.get("sid"))
+                if subscription is not None:
+                    self._unsubscribe(subscription)
+                await self._send({"op": "unsubscribed", "ref": ref, "sid": request.get("sid")})
+            elif op == "ping":
+                await self._send({"op": "pong", "ref": ref})
+            else:
+                await self._error(ref, 400, f"Unknown op: {op!r}")
+        except (TypeError, ValueError) as e:
+            await self._error(ref, 400, str(e))
+
+    async def _op_run(self, request: Dict[str, Any], ref: Any) -> None:
+        try:
+            input_data = RunAgentInput.model_validate(request.get("input") or {})
+        except ValidationError as e:
+            await self._error(ref, 422, "Invalid run input", detail=json.loads(e.json()))
+            return
+        types = parse_event_types(request.get("types"))
+        record = run_registry.get(input_data.run_id)
+        if record is None:
+            if types is not None:
+                # 新运行：订阅的类型同时作为运行的源头过滤，不需要的事件不会被构造
+                if input_data.forwarded_props is None:
+                    input_data.forwarded_props = {}
+                input_data.forwarded_props.setdefault("event_types", [event_type.value for event_type in types])
+            try:
+                record = await self.start_run(input_data)
+            except self.reject_types as e:
+                await self._error(ref, e.status_code, e.body.get("error"), detail=e.body)
+                return
+        elif record.user_id != self.user_id or record.graph != self.graph or record.thread_id != input_data.thread_id:
+            await self._error(ref, 409, "run_id already used")
+            return
+        encoder = EventEncoder(resolve_wire_mode(input_data.forwarded_props, self.websocket.headers))
+        self._subscribe(record, encoder, types, after_seq=0, ref=ref)
+
+    def _find_run(self, run_id: Any) -> Optional[RunRecord]:
+        record = run_registry.get(run_id)
+        if record is None or record.user_id != self.user_id or record.graph != self.graph:
+            return None
+        return record
+
+    async def _op_subscribe(self, request: Dict[str, Any], ref: Any) -> None:
+        record = self._find_run(request.get("runId"))
+        if record is None:
+            await self._error(ref, 404, "Run not found")
+            return
+        after = request.get("after") or 0
+        if not isinstance(after, int) or after < 0:
+            raise ValueError("after must be a non-negative integer")
+        types = parse_event_types(request.get("types"))
+        encoder = EventEncoder(resolve_wire_mode({"wire_mode": request.get("wireMode")}, self.websocket.headers))
+        run_registry.attach(record)
+        self._subscribe(record, encoder, types, after_seq=after, ref=ref)
+
+    async def _op_cancel(self, request: Dict[str, Any], ref: Any) -> None:
+        record = self._find_run(request.get("runId"))
+        if record is None:
+            await self._error(ref, 404, "Run not found")
+            return
+        cancelled = record.cancel("client_cancel")
+        await self._send({"op": "cancelled", "ref": ref, "runId": record.run_id, "cancelled": cancelled})
+
+    def _subscribe(self, record: RunRecord, encoder: EventEncoder, types, after_seq: int, ref: Any) -> None:
+        subscription = _Subscription(self._next_sid, record, encoder, types)
+        self._next_sid += 1
+        self._subscriptions[subscription.sid] = subscription
+        subscription.task = asyncio.create_task(self._forward(subscription, after_seq, ref))
+
+    def _unsubscribe(self, subscription: _Subscription) -> None:
+        self._subscriptions.pop(subscription.sid, None)
+        if subscription.task is not None and not subscription.task.done():
+            subscription.task.cancel()
+
+    async def _forward(self, subscription: _Subscription, after_seq: int, ref: Any) -> None:
+        record = subscription.record
+        await self._send({
+            "op": "subscribed", "ref": ref, "sid": subscription.sid,
+            "runId": record.run_id, "threadId": record.thread_id, "status": record.status,
+        })
+        try:
+            # 与 SSE 相同：经有界队列转发，客户端长期不读时判定为慢消费者并退订
+            events = StreamPump().pump(record.subscribe(after_seq), run_id=record.run_id)
+            async with aclosing(events):
+                async for seq, event in events:
+                    if subscription.types is not None and event.type not in subscription.types \
+                            and event.type not in LIFECYCLE_EVENT_TYPES:
+                        continue
+                    await self._send_event(subscription, seq, event)
+            await self._send({"op": "end", "sid": subscription.sid, "runId": record.run_id, "status": record.status})
+        except StreamCancelled as e:
+            await self._error(None, 499, "Stream cancelled", detail={"sid": subscription.sid, "reason": e.reason})
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            self._subscriptions.pop(subscription.sid, None)
+
+    async def _send_event(self, subscription: _Subscription, seq: int, event: BaseEvent) -> None:
+        code = EVENT_TYPE_CODES.get(event.type, 0)
+        try:
+            data = self.codec.dumps([subscription.sid, seq, code, subscription.encoder.to_payload(event)])
+        except TypeError:
+            # 快速路径里出现了非基础类型（如对象形式的工具结果），改用 pydantic 的 JSON 兼容转换
+            data = self.codec.dumps([subscription.sid, seq, code, subscription.encoder.to_payload(event, fast=False)])
+        size = len(data) if self.codec.binary else len(data.encode())
+        self._frames.inc()
+        self._frame_bytes.inc(size)
+        self._bytes_sent += size
+        await self._send_raw(data)
+
+    async def _send(self, frame: Dict[str, Any]) -> None:
+        await self._send_raw(self.codec.dumps({k: v for k, v in frame.items() if v is not None}))
+
+    async def _send_raw(self, data) -> None:
+        if self.websocket.application_state != WebSocketState.CONNECTED:
+            return
+        if self.codec.binary:
+            await self.websocket.send_bytes(data)
+        else:
+            await self.websocket.send_text(data)
+
+    async def _error(self, ref: Any, status: int, message: str, detail: Any = None) -> None:
+        await self._send({"op": "error", "ref": ref, "status": status, "message": message, "detail": detail})
+
+
+if __name__ == "__main__":
+    # 基准测试：同一次运行（文本增量 + 一个大工具结果）在 SSE 与 WebSocket 各编码下的字节数与每个事件的 CPU 耗时
+    import time
+
+    from api.models.events import (
+        RunFinishedEvent,
+        RunStartedEvent,
+        TextMessageContentEvent,
+        ToolCallResultEvent,
+    )
+
+    N_TOKENS = 400
+    ROUNDS = 20
+
+    def build_events():
+        events = [RunStartedEvent(run_id="run-1", thread_id="t-1")]
+        events += [TextMessageContentEvent(message_id="msg-1", delta="晴转多云", timestamp=i) for i in range(N_TOKENS)]
+        events.append(ToolCallResultEvent(
+            message_id="tool-msg-1", tool_call_id="call-1", role="tool",
+            content="# 长沙天气\n" + "今天白天晴，最高气温 28℃，夜间多云。" * 200,
+        ))
+        events.append(RunFinishedEvent(run_id="run-1", thread_id="t-1", result={"message_count": 3}))
+        return events
+
+    def bench(label: str, encode: Callable[[int, BaseEvent], Any]):
+        events = build_events()
+        total = sum(len(frame if isinstance(frame, bytes) else frame.encode()) for frame in (
+            encode(seq, event) for seq, event in enumerate(events, 1)
+        ))
+        t0 = time.perf_counter()
+        for _ in range(ROUNDS):
+            for seq, event in enumerate(events, 1):
+                frame = encode(seq, event)
+                if not isinstance(frame, bytes):
+                    frame.encode()
+        us = (time.perf_counter() - t0) / (ROUNDS * len(events)) * 1e6
+        print(f"{label:<22} {total / 1024:8.1f} KiB/run {us:7.2f} us/event")
+        return total
+
+    lean = EventEncoder("lean")
+    full = EventEncoder("full")
+    msgpack_codec = FrameCodec(SUBPROTOCOL_MSGPACK) if ormsgpack is not None else None
+    json_codec = FrameCodec(SUBPROTOCOL_JSON)
+
+    def ws_frame(codec: FrameCodec, encoder: EventEncoder):
+        return lambda seq, event: codec.dumps([1, seq, EVENT_TYPE_CODES[event.type], encoder.to_payload(event)])
+
+    print(f"events per run: {N_TOKENS + 3}")
+    sse_full = bench("SSE full", lambda seq, event: full.encode_sse(event, event_id=seq))
+    sse_lean = bench("SSE lean", lambda seq, event: lean.encode_sse(event, event_id=seq))
+    bench("WebSocket json", ws_frame(json_codec, lean))
+    if msgpack_codec is not None:
+        ws_msgpack = bench("WebSocket msgpack", ws_frame(msgpack_codec, lean))
+        print(f"msgpack frames vs SSE lean: x{sse_lean / ws_msgpack:.2f} fewer bytes")
@@ -12,5 +12,96 @@ class Settings:
     LOG_FILTER_TREE_PREFIX: str = ''
     # 默认用户ID配置
     DEFAULT_USER_ID: str = os.getenv("DEFAULT_USER_ID", "default_user")
+    # API key 校验配置：key 库路径、是否强制要求 key、摘要用的 pepper、缓存 TTL（秒）与容量
+    API_KEY_STORE_PATH: str = os.getenv("API_KEY_STORE_PATH", str(Path(os.getcwd()) / "data" / "api_keys.db"))
+    API_KEY_REQUIRED: bool = os.getenv("API_KEY_REQUIRED", "False").lower() == "true"
+    API_KEY_PEPPER: str = os.getenv("API_KEY_PEPPER", "")
+    API_KEY_CACHE_TTL: float = float(os.getenv("API_KEY_CACHE_TTL", "300"))
+    API_KEY_NEGATIVE_CACHE_TTL: float = float(os.getenv("API_KEY_NEGATIVE_CACHE_TTL", "30"))
+    API_KEY_CACHE_SIZE: int = int(os.getenv("API_KEY_CACHE_SIZE", "10000"))
+    # 运行准入控制（按用户）：并发运行上限、每分钟可发起的运行数与突发量、等待队列长度与等待时间（秒）
+    ADMISSION_ENABLED: bool = os.getenv("ADMISSION_ENABLED", "True").lower() == "true"
+    ADMISSION_MAX_CONCURRENT_RUNS: int = int(os.getenv("ADMISSION_MAX_CONCURRENT_RUNS", "3"))
+    ADMISSION_RATE_PER_MINUTE: float = float(os.getenv("ADMISSION_RATE_PER_MINUTE", "30"))
+    ADMISSION_BURST: int = int(os.getenv("ADMISSION_BURST", "10"))
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "2"))
+    ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+    # 全局过载控制：采样间隔（秒）、事件循环延迟的降级/拒绝阈值（毫秒）、进行中运行数（调度器执行 + 排队，含批量任务）与线程池排队上限、过载时新运行最多延后多久（秒）
+    OVERLOAD_SAMPLE_INTERVAL: float = float(os.getenv("OVERLOAD_SAMPLE_INTERVAL", "0.25"))
+    OVERLOAD_LAG_DEGRADE_MS: float = float(os.getenv("OVERLOAD_LAG_DEGRADE_MS", "100"))
+    OVERLOAD_LAG_REJECT_MS: float = float(os.getenv("OVERLOAD_LAG_REJECT_MS", "500"))
+    OVERLOAD_MAX_INFLIGHT_RUNS: int = int(os.getenv("OVERLOAD_MAX_INFLIGHT_RUNS", "64"))
+    OVERLOAD_EXECUTOR_QUEUE_REJECT: int = int(os.getenv("OVERLOAD_EXECUTOR_QUEUE_REJECT", "100"))
+    OVERLOAD_DEFER_SECONDS: float = float(os.getenv("OVERLOAD_DEFER_SECONDS", "1.0"))
+    # 运行调度：同时执行的运行数（worker 数）、每条优先级通道的排队上限、batch 有积压时每调度多少个 interactive 运行让出一个名额
+    SCHEDULER_MAX_WORKERS: int = int(os.getenv("SCHEDULER_MAX_WORKERS", "16"))
+    SCHEDULER_MAX_QUEUE: int = int(os.getenv("SCHEDULER_MAX_QUEUE", "500"))
+    SCHEDULER_INTERACTIVE_WEIGHT: int = int(os.getenv("SCHEDULER_INTERACTIVE_WEIGHT", "4"))
+    # 批量运行：输入 / 输出文件目录、单次上传的最大字节数、默认与最大并发条数
+    BATCH_DIR: Path = Path(os.getenv("BATCH_DIR", str(Path(os.getcwd()) / "data" / "batches")))
+    BATCH_MAX_BYTES: int = int(os.getenv("BATCH_MAX_BYTES", str(200 * 1024 * 1024)))
+    BATCH_DEFAULT_CONCURRENCY: int = int(os.getenv("BATCH_DEFAULT_CONCURRENCY", "4"))
+    BATCH_MAX_CONCURRENCY: int = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+    # 多图部署：langgraph.json 路径、要挂载的图（逗号分隔，留空为全部）、挂载到根路径的默认图、是否在启动时预加载
+    LANGGRAPH_CONFIG: Path = Path(os.getenv("LANGGRAPH_CONFIG", str(Path(os.getcwd()) / "langgraph.json")))
+    GRAPHS: list = [name.strip() for name in os.getenv("GRAPHS", "").split(",") if name.strip()]
+    DEFAULT_GRAPH: str = os.getenv("DEFAULT_GRAPH", "agent")
+    GRAPH_WARM_UP: bool = os.getenv("GRAPH_WARM_UP", "False").lower() == "true"
+    # SSE 流式压缩（按事件边界 flush 的 gzip），需客户端 Accept-Encoding 接受 gzip；压缩级别 1-9
+    SSE_COMPRESSION_ENABLED: bool = os.getenv("SSE_COMPRESSION_ENABLED", "False").lower() == "true"
+    SSE_COMPRESSION_LEVEL: int = int(os.getenv("SSE_COMPRESSION_LEVEL", "6"))
+    # 就绪探针（/ready）：结果缓存时长（秒）、检查点读取超时（秒）、调度队列占用比例上限、
+    # 浏览器池等待租用数上限与连续启动失败上限、MemOS 连续失败多少次后标记为异常（不影响就绪）
+    READY_CACHE_SECONDS: float = float(os.getenv("READY_CACHE_SECONDS", "1.0"))
+    READY_CHECKPOINTER_TIMEOUT: float = float(os.getenv("READY_CHECKPOINTER_TIMEOUT", "0.5"))
+    READY_MAX_QUEUE_RATIO: float = float(os.getenv("READY_MAX_QUEUE_RATIO", "0.9"))
+    READY_BROWSER_MAX_WAITING: int = int(os.getenv("READY_BROWSER_MAX_WAITING", "16"))
+    READY_BROWSER_MAX_LAUNCH_FAILURES: int = int(os.getenv("READY_BROWSER_MAX_LAUNCH_FAILURES", "3"))
+    READY_MEMOS_MAX_FAILURES: int = int(os.getenv("READY_MEMOS_MAX_FAILURES", "5"))
+    # 是否挂载 Prometheus 抓取端点 /metrics（与 /health 一样无需 API key，应只在内网暴露）
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+    # 检查点存储：memory（进程内，重启丢失）/ sqlite（本地单机）/ postgres（多 worker 共享）；
+    # SQLite 文件路径；Postgres 连接串、连接池大小、取连接的超时（秒）、启动时是否自动建表 / 迁移
+    CHECKPOINTER_BACKEND: str = os.getenv("CHECKPOINTER_BACKEND", "memory").strip().lower()
+    CHECKPOINTER_SQLITE_PATH: str = os.getenv("CHECKPOINTER_SQLITE_PATH", str(Path(os.getcwd()) / "data" / "checkpoints.db"))
+    CHECKPOINTER_POSTGRES_URI: str = os.getenv("CHECKPOINTER_POSTGRES_URI", os.getenv("POSTGRES_URI", ""))
+    CHECKPOINTER_POOL_MIN_SIZE: int = int(os.getenv("CHECKPOINTER_POOL_MIN_SIZE", "2"))
+    CHECKPOINTER_POOL_MAX_SIZE: int = int(os.getenv("CHECKPOINTER_POOL_MAX_SIZE", "10"))
+    CHECKPOINTER_POOL_TIMEOUT: float = float(os.getenv("CHECKPOINTER_POOL_TIMEOUT", "10"))
+    CHECKPOINTER_SETUP: bool = os.getenv("CHECKPOINTER_SETUP", "True").lower() == "true"
+    # 检查点体积：序列化压缩算法（zstd / zlib / none）、压缩级别、小于多少字节不压缩；
+    # messages 是否按增量存储（DeltaChannel，每 50 次更新存一次全量快照）；每个线程保留最近多少个检查点（0 为不清理）
+    CHECKPOINT_COMPRESSION: str = os.getenv("CHECKPOINT_COMPRESSION", "zstd").strip().lower()
+    CHECKPOINT_COMPRESSION_LEVEL: int = int(os.getenv("CHECKPOINT_COMPRESSION_LEVEL", "3"))
+    CHECKPOINT_COMPRESSION_MIN_BYTES: int = int(os.getenv("CHECKPOINT_COMPRESSION_MIN_BYTES", "1024"))
+    CHECKPOINT_DELTA_MESSAGES: bool = os.getenv("CHECKPOINT_DELTA_MESSAGES", "True").lower() == "true"
+    CHECKPOINT_RETENTION: int = int(os.getenv("CHECKPOINT_RETENTION", "50"))
+    # 日志中间件从请求体中提取 threadId / runId 时最多扫描的前缀字节数
+    LOG_BODY_SCAN_BYTES: int = int(os.getenv("LOG_BODY_SCAN_BYTES", "8192"))
 
-settings = Settings()
\ No newline at end of file
+    # 无头浏览器池配置 (web_fetch 使用)
+    BROWSER_POOL_SIZE: int = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+    BROWSER_POOL_PAGES_PER_BROWSER: int = int(os.getenv("BROWSER_POOL_PAGES_PER_BROWSER", "4"))
+    BROWSER_POOL_MAX_PAGES_BEFORE_RECYCLE: int = int(os.getenv("BROWSER_POOL_MAX_PAGES_BEFORE_RECYCLE", "200"))
+    BROWSER_POOL_MAX_MEMORY_MB: int = int(os.getenv("BROWSER_POOL_MAX_MEMORY_MB", "1536"))
+    BROWSER_POOL_LEASE_TIMEOUT: float = float(os.getenv("BROWSER_POOL_LEASE_TIMEOUT", "60"))
+    # 浏览器子进程内存（RSS）扫描的最小间隔（秒）
+    BROWSER_POOL_MEMORY_CHECK_INTERVAL: float = float(os.getenv("BROWSER_POOL_MEMORY_CHECK_INTERVAL", "5"))
+
+    # TEXT_MESSAGE_CONTENT 增量合并配置（客户端可按请求关闭）
+    STREAM_COALESCE_ENABLED: bool = os.getenv("STREAM_COALESCE_ENABLED", "True").lower() == "true"
+    STREAM_COALESCE_WINDOW_MS: float = float(os.getenv("STREAM_COALESCE_WINDOW_MS", "30"))
+    STREAM_COALESCE_MAX_BYTES: int = int(os.getenv("STREAM_COALESCE_MAX_BYTES", "1024"))
+
+    # 事件流背压配置：有界队列长度、慢消费者判定时间、断开检测间隔（秒）
+    STREAM_QUEUE_MAXSIZE: int = int(os.getenv("STREAM_QUEUE_MAXSIZE", "256"))
+    STREAM_SLOW_CONSUMER_TIMEOUT: float = float(os.getenv("STREAM_SLOW_CONSUMER_TIMEOUT", "30"))
+    STREAM_DISCONNECT_POLL_INTERVAL: float = float(os.getenv("STREAM_DISCONNECT_POLL_INTERVAL", "1.0"))
+
+    # 可恢复运行配置：每个运行保留的事件数、断开后的取消宽限期、结束后保留时长（秒）、最多保留的运行数
+    RUN_EVENT_LOG_MAXLEN: int = int(os.getenv("RUN_EVENT_LOG_MAXLEN", "2000"))
+    RUN_DETACH_GRACE_SECONDS: float = float(os.getenv("RUN_DETACH_GRACE_SECONDS", "15"))
+    RUN_RETENTION_SECONDS: float = float(os.getenv("RUN_RETENTION_SECONDS", "300"))
+    RUN_REGISTRY_MAX_RUNS: int = int(os.getenv("RUN_REGISTRY_MAX_RUNS", "1000"))
+
+settings = Settings()
@@ -8,6 +8,30 @@ from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+
+class MemosClientStats:
+    """所有 MemosClient 实例共享的请求计数，供就绪探针 / metrics 读取"""
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.inflight = 0
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "inflight": self.inflight,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+
+memos_stats = MemosClientStats()
+
+
 class MemosClient:
     def __init__(self, api_key: str = None, base_url: str = None, session: aiohttp.ClientSession = None):
         """
@@ -51,14 +75,21 @@ class MemosClient:
         else:
             created_new_session = False
 
+        memos_stats.requests += 1
+        memos_stats.inflight += 1
         try:
             async with session.post(url=url, headers=self.headers, json=payload) as response:
                 response.raise_for_status()
                 result = await response.json()
+                memos_stats.consecutive_failures = 0
                 return result
         except aiohttp.ClientError as e:
+            memos_stats.failures += 1
+            memos_stats.consecutive_failures += 1
+            memos_stats.last_error = f"{type(e).__name__}: {e}"
             return {"code": -1, "message": f"Request failed: {str(e)}"}
         finally:
+            memos_stats.inflight -= 1
             # 如果创建了新的 session,需要关闭它
             if created_new_session and not session.closed:
                 await session.close()
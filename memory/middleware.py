@@ -12,6 +12,10 @@ from .memos_client import MemosClient
 from langchain_core.messages.base import BaseMessage
 from langchain.tools import tool, ToolRuntime
 from langgraph.config import get_config
+from utils.load_state import is_degraded
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 SEARCH_MEMO_TOOL_DESCRIPTION = """
 This tool is your access to the User's Long-Term Memory (facts, preferences, past projects).
@@ -182,6 +186,10 @@ class MemOSMiddleware(AgentMiddleware):
 
 
     async def abefore_agent(self, state, runtime):
+        # 过载降级时跳过记忆写入（可选工作），检索工具不受影响
+        if is_degraded():
+            logger.debug("MemOS write skipped: server is degraded")
+            return
         config = get_config()
         user_id = config.get("metadata", {}).get("user_id", "default_user") if config else "default_user"
         conversation_id = config.get("metadata", {}).get("thread_id", None) if config else None
@@ -192,6 +200,9 @@ class MemOSMiddleware(AgentMiddleware):
         )
 
     async def aafter_model(self, state, runtime):
+        if is_degraded():
+            logger.debug("MemOS write skipped: server is degraded")
+            return
         config = get_config()
         user_id = config.get("metadata", {}).get("user_id", "default_user") if config else "default_user"
         conversation_id = config.get("metadata", {}).get("thread_id", None) if config else None
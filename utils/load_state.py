@@ -0,0 +1,19 @@
+# load_state.py
+"""
+进程级的负载状态标记。
+
+由 api 层的过载控制器写入，agent / 工具 / 记忆等下游代码只读取，
+这样它们不需要依赖 api 层就能在高负载时跳过或缩短可选的工作。
+"""
+
+_degraded = False
+
+
+def is_degraded() -> bool:
+    """当前是否处于降级模式（跳过可选工作、缩短等待）"""
+    return _degraded
+
+
+def set_degraded(value: bool) -> None:
+    global _degraded
+    _degraded = bool(value)